@@ -1,8 +1,12 @@
 from django.contrib import admin
 
 from .models import SlowishAccount, SlowishUser, SlowishContainer, SlowishFile
+from .models import SlowishBlob, SlowishChange, SlowishToken
 
 admin.site.register(SlowishAccount)
 admin.site.register(SlowishUser)
+admin.site.register(SlowishToken)
 admin.site.register(SlowishContainer)
 admin.site.register(SlowishFile)
+admin.site.register(SlowishBlob)
+admin.site.register(SlowishChange)
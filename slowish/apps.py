@@ -0,0 +1,19 @@
+from django.apps import AppConfig
+
+
+class SlowishConfig(AppConfig):
+    name = 'slowish'
+    verbose_name = "Slowish"
+
+    def ready(self):
+        # Connect the signal handlers that keep the token cache in
+        # step with SlowishUser changes.
+        from . import auth  # noqa
+
+        # Sweep for expired files, (if a sweeper thread is configured)
+        from . import background
+        background.start_expirer()
+
+        # Check that the listing engine setting names an engine
+        from . import engines
+        engines.listing_engine()
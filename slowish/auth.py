@@ -0,0 +1,180 @@
+import calendar
+from collections import OrderedDict
+from functools import wraps
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import JsonResponse
+
+from .models import SlowishUser, SlowishToken, token_lifetime
+
+# Default number of tokens remembered by the in-process token cache.
+AUTH_CACHE_SIZE = 1024
+
+# Default number of seconds a cached token is trusted before the
+# database is consulted again.
+AUTH_CACHE_TIMEOUT = 60
+
+
+def unauthorized():
+    unauth_response = {
+        "unauthorized":
+        {"code": 401,
+         "message":
+         "Unable to authenticate user with credentials provided."}}
+
+    return JsonResponse(unauth_response, status=401)
+
+
+class TokenCache(object):
+    """
+    A bounded cache of authenticated SlowishTokens, keyed by token.
+
+    Entries are evicted in least-recently-used order once the cache
+    holds SLOWISH_AUTH_CACHE_SIZE tokens, and each entry expires
+    SLOWISH_AUTH_CACHE_TIMEOUT seconds after it was added, (which
+    bounds how long other processes may trust a token after it has
+    been changed), or when the token itself expires, if sooner. The
+    cache is shared by all threads of a process.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.pop(token, None)
+            if entry is None:
+                return None
+
+            (expires, value) = entry
+            if expires < time.time():
+                return None
+
+            # Re-insert the entry to mark it as most recently used
+            self._entries[token] = entry
+            return value
+
+    def set(self, token, value, expires):
+        size = getattr(settings, 'SLOWISH_AUTH_CACHE_SIZE', AUTH_CACHE_SIZE)
+        timeout = getattr(
+            settings, 'SLOWISH_AUTH_CACHE_TIMEOUT', AUTH_CACHE_TIMEOUT)
+
+        with self._lock:
+            self._entries.pop(token, None)
+            if size <= 0:
+                return
+
+            expires = min(expires, time.time() + timeout)
+            self._entries[token] = (expires, value)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def discard_token(self, token):
+        """Drop any cached entries for the given token."""
+        with self._lock:
+            stale = [key for (key, (expires, value))
+                     in self._entries.items() if value.token == token]
+            for key in stale:
+                del self._entries[key]
+
+    def discard_user(self, user_id):
+        """Drop any cached tokens that belong to the given user."""
+        with self._lock:
+            stale = [key for (key, (expires, value))
+                     in self._entries.items() if value.user_id == user_id]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Tokens presented to the storage views, keyed by token.
+token_cache = TokenCache()
+
+# Tokens issued to users by the tokens view, keyed by credentials.
+credentials_cache = TokenCache()
+
+
+@receiver(post_save, sender=SlowishUser)
+@receiver(post_delete, sender=SlowishUser)
+def invalidate_user(sender, instance, **kwargs):
+    token_cache.discard_user(instance.pk)
+    credentials_cache.discard_user(instance.pk)
+
+
+@receiver(post_save, sender=SlowishToken)
+@receiver(post_delete, sender=SlowishToken)
+def invalidate_token(sender, instance, **kwargs):
+    token_cache.discard_token(instance.token)
+    credentials_cache.discard_token(instance.token)
+
+
+def authenticate(token):
+    """Return the live SlowishToken matching token, or None."""
+    if not token:
+        return None
+
+    value = token_cache.get(token)
+    if value is None:
+        try:
+            value = SlowishToken.objects.live().select_related(
+                'user__account').get(token=token)
+        except SlowishToken.DoesNotExist:
+            return None
+        token_cache.set(
+            token, value, calendar.timegm(value.expires.utctimetuple()))
+
+    return value
+
+
+def authenticate_credentials(account_id, username, password):
+    """
+    Return a live SlowishToken for the user with the given credentials.
+
+    Returns None if the credentials don't match any user. The user and
+    account are fetched together, and the token issued to them is then
+    handed out again, (without touching the database), to any request
+    with the same credentials until it is due to be rotated.
+    """
+    key = (str(account_id), username, password)
+    value = credentials_cache.get(key)
+    if value is None:
+        try:
+            user = SlowishUser.objects.select_related('account').get(
+                account__id=account_id,
+                username=username,
+                password=password)
+        except (SlowishUser.DoesNotExist, ValueError):
+            return None
+        value = user.issue_token()
+        rotation = value.expires - token_lifetime() / 2
+        credentials_cache.set(
+            key, value, calendar.timegm(rotation.utctimetuple()))
+
+    return value
+
+
+def token_required(view):
+    """
+    Require a valid HTTP_X_AUTH_TOKEN for the account of a request.
+
+    The decorated view is called with the authenticated SlowishAccount
+    in place of the account_id captured from the URL. Requests without
+    a token for that account get a 401 response.
+    """
+    @wraps(view)
+    def wrapper(request, account_id, *args, **kwargs):
+        token = authenticate(request.META.get('HTTP_X_AUTH_TOKEN'))
+        if token is None or str(token.user.account_id) != str(account_id):
+            return unauthorized()
+
+        return view(request, token.user.account, *args, **kwargs)
+
+    return wrapper
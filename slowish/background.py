@@ -0,0 +1,93 @@
+"""
+Work that slowish does outside of requests, in background threads.
+
+These are only used if SLOWISH_PURGE_IN_BACKGROUND or
+SLOWISH_EXPIRY_INTERVAL is set. Otherwise, the same work is done by
+running the slowish_purge_containers and slowish_expire_files commands.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .models import SlowishContainer, SlowishFile
+
+logger = logging.getLogger(__name__)
+
+# Whether deleted containers are purged by a thread of the process
+# that deleted them, by default.
+PURGE_IN_BACKGROUND = False
+
+# Default number of seconds between sweeps for expired files, (or None
+# for there to be no sweeper thread).
+EXPIRY_INTERVAL = None
+
+_lock = threading.Lock()
+_worker = None
+_requested = False
+
+
+def request_purge():
+    """
+    Have the files of deleted containers purged in the background.
+
+    At most one thread does so at a time, (which carries on until no
+    more purges have been requested).
+    """
+    global _worker, _requested
+
+    if not getattr(
+            settings, 'SLOWISH_PURGE_IN_BACKGROUND', PURGE_IN_BACKGROUND):
+        return
+
+    with _lock:
+        _requested = True
+        if _worker is None:
+            _worker = threading.Thread(
+                target=purge_worker, name="slowish-purge")
+            _worker.daemon = True
+            _worker.start()
+
+
+def purge_worker():
+    global _worker, _requested
+
+    try:
+        while True:
+            with _lock:
+                if not _requested:
+                    _worker = None
+                    return
+                _requested = False
+
+            try:
+                SlowishContainer.objects.purge_deleted()
+            except Exception:
+                logger.exception("Failed to purge deleted containers")
+    finally:
+        connection.close()
+
+
+def start_expirer():
+    """Start a thread that deletes expired files, if one is wanted."""
+    interval = getattr(settings, 'SLOWISH_EXPIRY_INTERVAL', EXPIRY_INTERVAL)
+    if not interval:
+        return
+
+    expirer = threading.Thread(
+        target=expiry_worker, args=(interval,), name="slowish-expirer")
+    expirer.daemon = True
+    expirer.start()
+
+
+def expiry_worker(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            SlowishFile.objects.expire()
+        except Exception:
+            logger.exception("Failed to delete expired files")
+        finally:
+            connection.close()
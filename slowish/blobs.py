@@ -0,0 +1,98 @@
+"""
+Content-addressed storage for the contents of Slowish files.
+
+Each distinct content is stored once, in a file named by its MD5
+digest, (which is also the ETag that Swift reports for it), under
+SLOWISH_BLOB_ROOT. Which blobs are in use, and by how many files, is
+tracked by the SlowishBlob model.
+"""
+import errno
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+
+# Number of bytes read from a request (or written to a response) at a time.
+BLOB_CHUNK_SIZE = 64 * 1024
+
+# The ETag of empty content.
+EMPTY_ETAG = hashlib.md5(b'').hexdigest()
+
+
+def blob_root():
+    return getattr(
+        settings,
+        'SLOWISH_BLOB_ROOT',
+        os.path.join(tempfile.gettempdir(), 'slowish_blobs'))
+
+
+def blob_path(etag):
+    # Two levels of subdirectories keep any one directory from growing
+    # too large.
+    return os.path.join(blob_root(), etag[:2], etag[2:4], etag)
+
+
+def make_directory(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def write_temporary(stream, chunk_size=BLOB_CHUNK_SIZE):
+    """
+    Copy the contents of stream into a temporary file in the blob store.
+
+    The stream is read a chunk at a time, (so it is never held in
+    memory as a whole), while its MD5 digest and size are computed.
+    Returns a tuple of the temporary file's path, the etag of the
+    contents and their size.
+    """
+    directory = os.path.join(blob_root(), 'tmp')
+    make_directory(directory)
+
+    (fd, path) = tempfile.mkstemp(dir=directory)
+    md5 = hashlib.md5()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                md5.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+    except Exception:
+        discard_temporary(path)
+        raise
+
+    return (path, md5.hexdigest(), size)
+
+
+def commit_temporary(path, etag):
+    """Move a file from write_temporary() into place as the blob for etag."""
+    destination = blob_path(etag)
+    make_directory(os.path.dirname(destination))
+
+    # Any existing blob for etag has the same content, so replacing it
+    # (atomically) is harmless.
+    os.rename(path, destination)
+
+
+def discard_temporary(path):
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def remove(etag):
+    discard_temporary(blob_path(etag))
+
+
+def open_blob(etag):
+    return open(blob_path(etag), 'rb')
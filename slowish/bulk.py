@@ -0,0 +1,269 @@
+"""
+Swift's bulk operations on many files in a single request.
+
+The responses follow Swift's bulk middleware: the status of the request
+as a whole is reported within the body, along with counts of what was
+done and a list of the paths that failed, (as plain text, or as JSON if
+the client accepts it).
+"""
+from itertools import groupby
+import json
+import tarfile
+import zlib
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.http import urlquote, urlunquote
+
+from . import blobs
+from .models import SlowishContainer
+
+# Default number of paths that one bulk-delete request may list, (the
+# max_deletes_per_request of Swift itself).
+BULK_DELETE_LIMIT = 10000
+
+# Number of files removed by each DELETE statement of a bulk-delete.
+BULK_DELETE_CHUNK_SIZE = 1000
+
+# Number of files from an archive that are stored together, (in a
+# single transaction).
+EXTRACT_ARCHIVE_BATCH_SIZE = 1000
+
+# The tarfile modes for each format of extract-archive, which read the
+# archive as a stream, (without seeking back or holding it in memory).
+ARCHIVE_MODES = {
+    'tar': 'r|',
+    'tar.gz': 'r|gz',
+    'tar.bz2': 'r|bz2',
+}
+
+# Errors from reading an archive that is corrupt or truncated.
+ARCHIVE_ERRORS = (tarfile.TarError, IOError, EOFError, zlib.error)
+
+# The longest path a file may have, (as for SlowishFile.path).
+MAX_PATH_LENGTH = 1024
+
+
+def bulk_response(request, result, errors):
+    """Return the body of a bulk request, in the format it accepts."""
+    if 'application/json' in request.META.get('HTTP_ACCEPT', ''):
+        result = dict(result, Errors=errors)
+        return HttpResponse(
+            json.dumps(result), content_type="application/json")
+
+    lines = ['{0}: {1}\n'.format(key, result[key]) for key in sorted(result)]
+    lines.append('Errors:\n')
+    lines.extend('{0}, {1}\n'.format(name, status)
+                 for (name, status) in errors)
+    return HttpResponse(''.join(lines), content_type="text/plain")
+
+
+def read_targets(request, limit):
+    """
+    Read the paths listed in the body of a bulk-delete request.
+
+    Each line is a URL encoded "container/path", or just "container".
+    Returns a list of (container name, path) tuples, or None if there
+    are more than limit of them. Names that aren't valid UTF-8 are
+    returned as None, (with the line that held them as the path).
+    """
+    targets = []
+    for line in request:
+        line = line.strip()
+        if not line:
+            continue
+
+        if len(targets) >= limit:
+            return None
+
+        try:
+            name = urlunquote(line).lstrip('/')
+        except UnicodeDecodeError:
+            targets.append((None, line))
+            continue
+
+        (container_name, sep, path) = name.partition('/')
+        if container_name:
+            targets.append((container_name, path))
+
+    return targets
+
+
+def delete_container(account, name):
+    """Delete the named container if it is empty, returning the status."""
+    try:
+        container = SlowishContainer.objects.live().get(
+            account=account,
+            name=name)
+        if not container.delete_if_empty():
+            return '409 Conflict'
+    except SlowishContainer.DoesNotExist:
+        return '404 Not Found'
+
+    return '204 No Content'
+
+
+def delete_files(account, container_name, paths, result):
+    """Delete files from the named container, counting them in result."""
+    try:
+        container = SlowishContainer.objects.live().get(
+            account=account,
+            name=container_name)
+    except SlowishContainer.DoesNotExist:
+        result["Number Not Found"] += len(paths)
+        return
+
+    for start in range(0, len(paths), BULK_DELETE_CHUNK_SIZE):
+        chunk = paths[start:start + BULK_DELETE_CHUNK_SIZE]
+        deleted = container.delete_files(chunk)
+        result["Number Deleted"] += deleted
+        result["Number Not Found"] += len(chunk) - deleted
+
+
+def bulk_delete(request, account):
+    """
+    Delete the files and containers listed in the body of request.
+
+    Consecutive files in the same container are deleted together, (a
+    chunk at a time), rather than one by one. Containers are only
+    deleted if they are empty by the time they are reached.
+    """
+    limit = getattr(settings, 'SLOWISH_BULK_DELETE_LIMIT', BULK_DELETE_LIMIT)
+    result = {"Number Deleted": 0,
+              "Number Not Found": 0,
+              "Response Body": "",
+              "Response Status": "200 OK"}
+    errors = []
+
+    targets = read_targets(request, limit)
+    if targets is None:
+        result["Response Status"] = "413 Request Entity Too Large"
+        result["Response Body"] = (
+            "Maximum Bulk Deletes: {0} per request".format(limit))
+        return bulk_response(request, result, errors)
+
+    runs = groupby(targets, lambda target: (target[0], target[1] == ''))
+    for ((container_name, whole_container), run) in runs:
+        if container_name is None:
+            errors.extend([urlquote(line), '412 Precondition Failed']
+                          for (name, line) in run)
+        elif whole_container:
+            for target in run:
+                status = delete_container(account, container_name)
+                if status == '404 Not Found':
+                    result["Number Not Found"] += 1
+                elif status == '409 Conflict':
+                    errors.append([urlquote(container_name), status])
+                else:
+                    result["Number Deleted"] += 1
+        else:
+            delete_files(account, container_name,
+                         [path for (name, path) in run], result)
+
+    if errors:
+        result["Response Status"] = "400 Bad Request"
+
+    return bulk_response(request, result, errors)
+
+
+def member_path(member, prefix, errors):
+    """
+    Return the path at which to store a member of an archive.
+
+    Returns None if the member isn't a regular file, or if its name
+    can't be used, (in which case an error is added to errors).
+    """
+    if not member.isfile():
+        return None
+
+    name = member.name
+    if name.startswith('./'):
+        name = name[2:]
+    name = name.lstrip('/')
+    if prefix.strip('/'):
+        name = prefix.strip('/') + '/' + name
+
+    try:
+        name = name.decode('utf-8')
+    except UnicodeDecodeError:
+        errors.append([urlquote(name), '412 Precondition Failed'])
+        return None
+
+    if len(name) > MAX_PATH_LENGTH:
+        errors.append(
+            [urlquote(name[:MAX_PATH_LENGTH]), '400 Bad Request'])
+        return None
+
+    return name
+
+
+def extract_files(archive, container, prefix, result, errors):
+    """
+    Store the regular files of archive in container.
+
+    Each file's content is copied to the blob store as it is read, and
+    the files are then stored a batch at a time, so neither the archive
+    nor a batch of its contents is ever held in memory.
+    """
+    batch = []
+    try:
+        for member in archive:
+            path = member_path(member, prefix, errors)
+            if path is None:
+                continue
+
+            batch.append(
+                (path,) + blobs.write_temporary(archive.extractfile(member)))
+            if len(batch) >= EXTRACT_ARCHIVE_BATCH_SIZE:
+                (files, batch) = (batch, [])
+                result["Number Files Created"] += len(
+                    container.store_files(files))
+    except ARCHIVE_ERRORS:
+        # The files read before an error in the archive are kept
+        if batch:
+            result["Number Files Created"] += len(
+                container.store_files(batch))
+        raise
+    except Exception:
+        for (path, temporary, etag, size) in batch:
+            blobs.discard_temporary(temporary)
+        raise
+
+    if batch:
+        result["Number Files Created"] += len(container.store_files(batch))
+
+
+def extract_archive(request, account, container_name, path):
+    """
+    Store the files in the archive sent as the body of request.
+
+    The files are stored in the named container, (which is created if
+    need be), at their paths within the archive, under the given path.
+    """
+    mode = ARCHIVE_MODES.get(request.GET['extract-archive'])
+    if mode is None:
+        return HttpResponse('Unsupported archive format', status=400)
+
+    (container, created) = SlowishContainer.objects.get_or_insert(
+        account, container_name)
+
+    result = {"Number Files Created": 0,
+              "Response Body": "",
+              "Response Status": "201 Created"}
+    errors = []
+
+    try:
+        archive = tarfile.open(mode=mode, fileobj=request)
+        extract_files(archive, container, path, result, errors)
+    except ARCHIVE_ERRORS as e:
+        result["Response Status"] = "400 Bad Request"
+        result["Response Body"] = "Invalid Tar File: {0}".format(e)
+        return bulk_response(request, result, errors)
+
+    if errors:
+        result["Response Status"] = "400 Bad Request"
+    elif not result["Number Files Created"]:
+        result["Response Status"] = "400 Bad Request"
+        result["Response Body"] = "Invalid Tar File: No Valid Files"
+
+    return bulk_response(request, result, errors)
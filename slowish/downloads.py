@@ -0,0 +1,260 @@
+"""
+Serving the contents of Slowish files.
+
+This handles the conditional request headers, (If-Match, If-None-Match,
+If-Modified-Since and If-Unmodified-Since), as well as Range requests
+for one or more byte ranges of a file. Ranges are served by seeking
+into the content, so only the requested bytes are ever read.
+"""
+import binascii
+import calendar
+import os
+import re
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+
+from .blobs import BLOB_CHUNK_SIZE
+
+# The Content-Type of files stored without one.
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+# A Range header with more ranges than this is ignored, (and the whole
+# content served), rather than being split into that many parts.
+MAX_RANGES = 100
+
+RANGE_SPEC = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+def parse_etags(header):
+    """Return the entity tags listed in an If-Match/If-None-Match header."""
+
+    # Swift clients send etags both with and without quotes, so either
+    # is accepted here. Weak tags compare the same as strong ones.
+    etags = []
+    for etag in header.split(','):
+        etag = etag.strip()
+        if etag.startswith('W/'):
+            etag = etag[2:]
+        etags.append(etag.strip('"'))
+    return etags
+
+
+def parse_range(header, size):
+    """
+    Parse the value of a Range header for content of the given size.
+
+    Returns a list of (first, last) byte positions, inclusive. The
+    list is empty if none of the ranges can be satisfied. Returns None
+    if the header is malformed, (in which case it should be ignored).
+    """
+    (unit, sep, specs) = header.partition('=')
+    if unit.strip() != 'bytes' or not sep:
+        return None
+
+    specs = specs.split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        match = RANGE_SPEC.match(spec)
+        if match is None:
+            return None
+
+        (first, last) = match.groups()
+        if first == '' and last == '':
+            return None
+
+        if first == '':
+            # A suffix range, for the final bytes of the content, (of
+            # which an empty file has none)
+            if int(last) == 0 or size == 0:
+                continue
+            first = max(size - int(last), 0)
+            last = size - 1
+        else:
+            first = int(first)
+            if last != '' and int(last) < first:
+                return None
+            if first >= size:
+                continue
+            last = size - 1 if last == '' else min(int(last), size - 1)
+
+        ranges.append((first, last))
+
+    return ranges
+
+
+def check_preconditions(request, etag, last_modified):
+    """
+    Evaluate the conditional headers of request against a file.
+
+    Returns a 304 (Not Modified) or 412 (Precondition Failed) response
+    if the request's conditions say so, otherwise None. The last
+    modified time is given in seconds since the epoch.
+    """
+    last_modified = int(last_modified)
+
+    if_match = request.META.get('HTTP_IF_MATCH')
+    if if_match is not None:
+        etags = parse_etags(if_match)
+        if '*' not in etags and etag not in etags:
+            return HttpResponse('', status=412)
+    else:
+        since = parse_http_date_safe(
+            request.META.get('HTTP_IF_UNMODIFIED_SINCE', ''))
+        if since is not None and last_modified > since:
+            return HttpResponse('', status=412)
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        if '*' in etags or etag in etags:
+            return not_modified(etag, last_modified)
+    else:
+        since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if since is not None and last_modified <= since:
+            return not_modified(etag, last_modified)
+
+    return None
+
+
+def not_modified(etag, last_modified):
+    response = HttpResponse(status=304)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def range_applies(request, etag, last_modified):
+    """Return whether any Range header of request should be honored."""
+
+    # With If-Range, ranges are only served if the file is unchanged
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is None:
+        return True
+
+    date = parse_http_date_safe(if_range)
+    if date is not None:
+        return int(last_modified) == date
+
+    return if_range.strip().strip('"') == etag
+
+
+def read_range(content, first, last, chunk_size=BLOB_CHUNK_SIZE):
+    """Generate the bytes from first to last (inclusive) of content."""
+    content.seek(first)
+    remaining = last - first + 1
+    while remaining > 0:
+        chunk = content.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def single_range(content, first, last):
+    try:
+        for chunk in read_range(content, first, last):
+            yield chunk
+    finally:
+        content.close()
+
+
+def multiple_ranges(content, parts, trailer):
+    try:
+        for (header, first, last) in parts:
+            yield header
+            for chunk in read_range(content, first, last):
+                yield chunk
+            yield b'\r\n'
+        yield trailer
+    finally:
+        content.close()
+
+
+def range_response(content, ranges, size, content_type):
+    """Return a 206 (Partial Content) response for ranges of content."""
+
+    if len(ranges) == 1:
+        (first, last) = ranges[0]
+        response = StreamingHttpResponse(
+            single_range(content, first, last),
+            status=206,
+            content_type=content_type)
+        response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(
+            first, last, size)
+        response['Content-Length'] = last - first + 1
+        return response
+
+    boundary = binascii.hexlify(os.urandom(16)).decode('ascii')
+    parts = []
+    length = 0
+    for (first, last) in ranges:
+        header = (
+            '--{0}\r\n'
+            'Content-Type: {1}\r\n'
+            'Content-Range: bytes {2}-{3}/{4}\r\n'
+            '\r\n').format(
+                boundary, content_type, first, last, size).encode('ascii')
+        parts.append((header, first, last))
+        length += len(header) + (last - first + 1) + 2
+    trailer = '--{0}--'.format(boundary).encode('ascii')
+    length += len(trailer)
+
+    response = StreamingHttpResponse(
+        multiple_ranges(content, parts, trailer),
+        status=206,
+        content_type='multipart/byteranges; boundary=' + boundary)
+    response['Content-Length'] = length
+    return response
+
+
+def file_response(request, content, size, etag, last_modified, content_type):
+    """
+    Return a response serving the content of a file for request.
+
+    The content argument is an open, seekable file object which the
+    response takes ownership of, (closing it once served, or at once if
+    it isn't needed). Its last modification is a datetime. A HEAD
+    request gets the headers of the whole content, without reading it.
+    """
+    last_modified = calendar.timegm(last_modified.utctimetuple())
+
+    response = check_preconditions(request, etag, last_modified)
+    if response is not None:
+        content.close()
+        return response
+
+    header = request.META.get('HTTP_RANGE')
+    ranges = None
+    if request.method == 'HEAD':
+        header = None
+    if header and range_applies(request, etag, last_modified):
+        ranges = parse_range(header, size)
+
+    if ranges == []:
+        content.close()
+        response = HttpResponse('', status=416)  # Range not satisfiable
+        response['Content-Range'] = 'bytes */{0}'.format(size)
+        return response
+
+    if ranges:
+        response = range_response(content, ranges, size, content_type)
+    elif request.method == 'HEAD':
+        content.close()
+        response = HttpResponse('', content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        # A FileResponse is handed to the server's wsgi.file_wrapper,
+        # (when it has one), which can send the content with sendfile
+        # rather than copying it through Python.
+        response = FileResponse(content, content_type=content_type)
+        response['Content-Length'] = size
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -0,0 +1,228 @@
+"""
+Engines that list the files of containers.
+
+The engine is chosen by the SLOWISH_LISTING_ENGINE setting:
+
+* "orm", (the default), queries the database for each listing.
+
+* "memory" keeps the paths of each container in a sorted list in the
+  process, along with a dict of their sizes and expiry times. A prefix
+  or marker becomes a bisect of the list. The lists are brought up to
+  date from the container's changes feed, (see SlowishChange), whenever
+  a listing finds that the container has changed. So every process
+  sees the changes made by the others, at the cost of one query for
+  the changes and one for the files they touched.
+
+Files are always stored and deleted through the database. The engines
+only differ in how listings read them.
+"""
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+import sys
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import six, timezone
+
+from .models import SlowishChange, SlowishFile
+
+# Number of containers whose paths the memory engine keeps, (those
+# listed least recently are dropped first).
+MEMORY_ENGINE_CONTAINERS = 1000
+
+# A change to more paths than this rebuilds a container's sorted list,
+# rather than inserting and removing them one at a time.
+MEMORY_ENGINE_REBUILD_SIZE = 64
+
+
+def prefix_end(prefix):
+    """
+    Return the first path after all those starting with prefix.
+
+    Returns None if there is no such path, (as for SlowishFile.objects
+    .with_prefix()).
+    """
+    end = prefix.rstrip(six.unichr(sys.maxunicode))
+    if not end:
+        return None
+    return end[:-1] + six.unichr(ord(end[-1]) + 1)
+
+
+class ORMEngine(object):
+    """Lists files by querying the database."""
+
+    def files(self, container, prefix, marker, end_marker, limit,
+              inclusive=False):
+        """
+        Return the files of container in order of path, (as tuples of
+        path, size and delete_at).
+
+        Only live files whose paths start with prefix, and come after
+        marker, (or at it, if inclusive), and before end_marker, (where
+        those aren't None), are returned, up to limit of them.
+        """
+        files = SlowishFile.objects.live().filter(container=container)
+        if prefix:
+            files = files.with_prefix(prefix)
+        if marker is not None and inclusive:
+            files = files.filter(path__gte=marker)
+        elif marker is not None:
+            files = files.filter(path__gt=marker)
+        if end_marker is not None:
+            files = files.filter(path__lt=end_marker)
+
+        # Using iterator() reads the rows through a server-side cursor,
+        # (on PostgreSQL), so a long listing isn't held in memory.
+        files = files.order_by('path').values_list(
+            'path', 'bytes', 'delete_at')[:limit]
+        return files.iterator()
+
+    def clear(self):
+        pass
+
+
+class ContainerIndex(object):
+    """The files of a container, as held by the memory engine."""
+
+    def __init__(self, last_change, files):
+        self.last_change = last_change
+        self.files = dict(
+            (path, (size, delete_at)) for (path, size, delete_at) in files)
+        self.paths = sorted(self.files)
+
+    def update(self, last_change, paths, files):
+        """Replace the files at paths with files, (those that exist)."""
+        paths = set(paths)
+        for path in paths:
+            self.files.pop(path, None)
+        for (path, size, delete_at) in files:
+            self.files[path] = (size, delete_at)
+
+        if len(paths) > MEMORY_ENGINE_REBUILD_SIZE:
+            self.paths = sorted(self.files)
+        else:
+            for path in paths:
+                i = bisect_left(self.paths, path)
+                if i < len(self.paths) and self.paths[i] == path:
+                    del self.paths[i]
+                if path in self.files:
+                    insort(self.paths, path)
+        self.last_change = last_change
+
+    def scan(self, start, end, limit):
+        """Return up to limit live files from position start to end."""
+        now = timezone.now()
+        files = []
+        # (By position, rather than copying the slice of the paths)
+        for i in xrange(start, end):
+            if len(files) >= limit:
+                break
+            path = self.paths[i]
+            (size, delete_at) = self.files[path]
+            if delete_at is None or delete_at > now:
+                files.append((path, size, delete_at))
+        return files
+
+
+class MemoryEngine(object):
+    """Lists files from sorted lists of the paths of each container."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.indexes = OrderedDict()
+
+    def files(self, container, prefix, marker, end_marker, limit,
+              inclusive=False):
+        """Return files as for ORMEngine.files(), (but as a list)."""
+        index = self.index(container)
+
+        with self.lock:
+            paths = index.paths
+            start = 0
+            end = len(paths)
+            if prefix:
+                start = bisect_left(paths, prefix)
+                following = prefix_end(prefix)
+                if following is not None:
+                    end = bisect_left(paths, following)
+            if marker is not None:
+                bisect = bisect_left if inclusive else bisect_right
+                start = max(start, bisect(paths, marker))
+            if end_marker is not None:
+                end = min(end, bisect_left(paths, end_marker))
+            return index.scan(start, end, limit)
+
+    def index(self, container):
+        """Return the index of container, brought up to its last change."""
+        with self.lock:
+            index = self.indexes.pop(container.pk, None)
+            if index is not None:
+                self.indexes[container.pk] = index
+
+        # An index that is ahead of the container was built from some
+        # other container with the same ID, (one whose creation was
+        # rolled back), so it is rebuilt.
+        if index is None or index.last_change > container.last_change:
+            index = self.load(container)
+        elif index.last_change < container.last_change:
+            self.catch_up(container, index)
+        return index
+
+    def load(self, container):
+        files = SlowishFile.objects.filter(container=container).values_list(
+            'path', 'bytes', 'delete_at')
+        index = ContainerIndex(container.last_change, files.iterator())
+
+        with self.lock:
+            self.indexes[container.pk] = index
+            while len(self.indexes) > MEMORY_ENGINE_CONTAINERS:
+                self.indexes.popitem(last=False)
+        return index
+
+    def catch_up(self, container, index):
+        # Files changed after the container was read may be included,
+        # and are then read again by the next catch up, (which is
+        # harmless, as they're replaced with their latest state).
+        paths = list(SlowishChange.objects.filter(
+            container=container,
+            change__gt=index.last_change).values_list('path', flat=True))
+        files = SlowishFile.objects.filter(
+            container=container, path__in=paths).values_list(
+                'path', 'bytes', 'delete_at')
+
+        files = list(files)
+        with self.lock:
+            if index.last_change < container.last_change:
+                index.update(container.last_change, paths, files)
+
+    def clear(self):
+        with self.lock:
+            self.indexes.clear()
+
+
+ENGINES = {
+    "memory": MemoryEngine,
+    "orm": ORMEngine,
+}
+
+# The engine for each setting, (created when first used).
+engines = {}
+
+
+def listing_engine():
+    """
+    Return the engine that SLOWISH_LISTING_ENGINE selects.
+
+    Raises ImproperlyConfigured if there is no such engine, (which is
+    checked when the app is loaded).
+    """
+    name = getattr(settings, 'SLOWISH_LISTING_ENGINE', 'orm')
+    engine = engines.get(name)
+    if engine is None:
+        if name not in ENGINES:
+            raise ImproperlyConfigured(
+                "SLOWISH_LISTING_ENGINE must be one of {0}, not {1!r}.".format(
+                    ", ".join(sorted(ENGINES)), name))
+        engine = engines.setdefault(name, ENGINES[name]())
+    return engine
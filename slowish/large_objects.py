@@ -0,0 +1,324 @@
+"""
+Swift's large objects, whose content is split over other files.
+
+A dynamic large object (DLO) is a file with an X-Object-Manifest header
+naming a "container/prefix": its content is that of every file in the
+container whose path starts with the prefix, in order of path. A static
+large object (SLO) is stored with ?multipart-manifest=put, with a JSON
+list of its segments as the body. The segments are checked when the
+manifest is stored, and it is their contents at that time which make
+up the object.
+
+Either way, the content is served by reading each segment's blob in
+turn, (only one of which is open at a time), so no segment is ever
+held in memory.
+"""
+from bisect import bisect_right
+import hashlib
+import io
+import json
+
+from django.http import HttpResponse
+from django.utils.http import urlunquote
+
+from . import blobs, bulk, downloads
+from .models import SlowishBlob, SlowishFile
+
+# The largest number of segments a static large object may have, (the
+# max_manifest_segments of Swift itself).
+MAX_MANIFEST_SEGMENTS = 1000
+
+
+class SegmentedContent(object):
+    """
+    A seekable, read-only file of the contents of blobs, one after another.
+
+    The segments are given as a list of (etag, size) tuples. Each blob
+    is opened when it is first read from, and closed when reading
+    moves on to the next, so reading from the middle of the content
+    only touches the blobs that hold the bytes read.
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.offsets = []
+        self.size = 0
+        for (etag, size) in segments:
+            self.offsets.append(self.size)
+            self.size += size
+        self.position = 0
+        self.current = None
+
+    def seek(self, position):
+        self.position = position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.size - self.position
+
+        chunks = []
+        while size > 0 and self.position < self.size:
+            # The last segment starting at or before the position, (which
+            # skips over any empty segments)
+            index = bisect_right(self.offsets, self.position) - 1
+            start = self.offsets[index]
+            available = start + self.segments[index][1] - self.position
+
+            content = self.open(index)
+            content.seek(self.position - start)
+            chunk = content.read(min(size, available))
+            if not chunk:
+                raise IOError(
+                    "Segment {0} is shorter than expected".format(
+                        self.segments[index][0]))
+
+            chunks.append(chunk)
+            self.position += len(chunk)
+            size -= len(chunk)
+
+        return b''.join(chunks)
+
+    def open(self, index):
+        if self.current is None or self.current[0] != index:
+            self.close()
+            self.current = (index, blobs.open_blob(self.segments[index][0]))
+        return self.current[1]
+
+    def close(self):
+        if self.current is not None:
+            self.current[1].close()
+            self.current = None
+
+
+def manifest_etag(segments):
+    """Return the ETag of a large object, (from its segments' ETags)."""
+    return hashlib.md5(
+        ''.join(etag for (etag, size) in segments)).hexdigest()
+
+
+def segment_location(name):
+    """Return the (container name, path) of a segment, or None."""
+    (container_name, sep, path) = urlunquote(name).lstrip('/').partition('/')
+    if not container_name or not path:
+        return None
+    return (container_name, path)
+
+
+def find_segments(account, locations):
+    """
+    Return the (etag, size, is_manifest) of the files at locations in
+    account.
+
+    The locations are (container name, path) tuples, and the result is
+    a dict keyed by them, (without any that don't exist). The last of
+    each tuple is whether the file is itself a large object. They are
+    all fetched with a single query.
+    """
+    files = SlowishFile.objects.live().filter(
+        container__account=account,
+        container__deleted=False,
+        container__name__in=set(name for (name, path) in locations),
+        path__in=set(path for (name, path) in locations))
+
+    found = {}
+    for (name, path, etag, size, static, dynamic) in files.values_list(
+            'container__name', 'path', 'blob__etag', 'bytes',
+            'static_manifest', 'dynamic_manifest').iterator():
+        found[(name, path)] = (
+            etag or blobs.EMPTY_ETAG, size,
+            static is not None or dynamic is not None)
+    return found
+
+
+def parse_manifest(body):
+    """
+    Return the segments listed in the body of a manifest PUT.
+
+    Returns a list of (name, location, etag, size) tuples, where the
+    etag and size are None if the manifest doesn't give them. Raises
+    ValueError, with a message for the client, if it isn't valid.
+    """
+    try:
+        manifest = json.loads(body)
+    except ValueError:
+        raise ValueError("Manifest must be valid JSON.")
+
+    if not isinstance(manifest, list) or not manifest:
+        raise ValueError("Manifest must be a list of segments.")
+    if len(manifest) > MAX_MANIFEST_SEGMENTS:
+        raise ValueError(
+            "Too many segments in manifest, (the maximum is {0}).".format(
+                MAX_MANIFEST_SEGMENTS))
+
+    segments = []
+    for segment in manifest:
+        if not isinstance(segment, dict) or not isinstance(
+                segment.get('path'), basestring):
+            raise ValueError("Each segment must be an object with a path.")
+
+        etag = segment.get('etag')
+        size = segment.get('size_bytes')
+        if etag is not None:
+            if not isinstance(etag, basestring):
+                raise ValueError("Each segment's etag must be a string.")
+            etag = etag.strip('"').lower()
+        if size is not None and (
+                isinstance(size, bool) or
+                not isinstance(size, (int, long)) or size < 0):
+            raise ValueError(
+                "Each segment's size_bytes must be a non-negative integer.")
+        segments.append(
+            (segment['path'], segment_location(segment['path']), etag, size))
+
+    return segments
+
+
+def static_manifest_put(request, container, path, attributes):
+    """Store a static large object from the manifest in request."""
+    try:
+        segments = parse_manifest(request.body)
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
+
+    found = find_segments(
+        container.account,
+        [location for (name, location, etag, size) in segments
+         if location is not None])
+
+    errors = []
+    manifest = []
+    for (name, location, etag, size) in segments:
+        if location not in found:
+            errors.append((name, "404 Not Found"))
+            continue
+
+        (actual_etag, actual_size, is_manifest) = found[location]
+        if is_manifest:
+            # (Segments' contents are read straight from their blobs,
+            # which a large object doesn't have)
+            errors.append((name, "Nested Manifests Not Supported"))
+        elif etag is not None and etag != actual_etag:
+            errors.append((name, "Etag Mismatch"))
+        elif size is not None and size != actual_size:
+            errors.append((name, "Size Mismatch"))
+        else:
+            manifest.append(
+                {"name": u'/' + u'/'.join(location),
+                 "hash": actual_etag,
+                 "bytes": actual_size})
+
+    if errors:
+        return HttpResponse(
+            "Errors:\n" + "".join(
+                u"{0}, {1}\n".format(name, status)
+                for (name, status) in errors),
+            status=400,
+            content_type="text/plain")
+
+    # The manifest itself has no blob, but its size is the total size
+    # of the segments, (which is what Swift lists for it).
+    attributes = dict(attributes, static_manifest=json.dumps(manifest))
+    blob = SlowishBlob(bytes=sum(segment["bytes"] for segment in manifest))
+    (created,) = container.store_blobs([(path, blob)], attributes)
+
+    if created:
+        response = HttpResponse('', status=201)  # Created
+    else:
+        response = HttpResponse('', status=200)  # OK
+    response['ETag'] = manifest_etag(
+        [(segment["hash"], segment["bytes"]) for segment in manifest])
+    return response
+
+
+def static_segments(file):
+    """Return the (etag, size) of each segment of a static large object."""
+    return [(segment["hash"], segment["bytes"])
+            for segment in json.loads(file.static_manifest)]
+
+
+def segments_stored(segments):
+    """
+    Return whether the content of every segment is still stored.
+
+    This is checked with a single query, before anything is served.
+    """
+    etags = set(etag for (etag, size) in segments if size)
+    stored = SlowishBlob.objects.filter(etag__in=etags, refs__gt=0).count()
+    return stored == len(etags)
+
+
+def dynamic_segments(account, file):
+    """Return the (etag, size) of each segment of a dynamic large object."""
+    (container_name, sep, prefix) = urlunquote(
+        file.dynamic_manifest).lstrip('/').partition('/')
+
+    # (Large objects under the prefix have no blob to read, so aren't
+    # segments, as for a static large object's manifest)
+    segments = SlowishFile.objects.live().filter(
+        container__account=account,
+        container__deleted=False,
+        container__name=container_name,
+        static_manifest__isnull=True,
+        dynamic_manifest__isnull=True).with_prefix(prefix).order_by('path')
+    return [(etag or blobs.EMPTY_ETAG, size)
+            for (etag, size) in segments.values_list(
+                'blob__etag', 'bytes').iterator()]
+
+
+def large_object_response(request, file, segments):
+    """Return a response serving the concatenated segments of file."""
+    if any(size for (etag, size) in segments):
+        content = SegmentedContent(segments)
+    else:
+        content = io.BytesIO()
+
+    response = downloads.file_response(
+        request,
+        content,
+        size=sum(size for (etag, size) in segments),
+        etag=manifest_etag(segments),
+        last_modified=file.last_modified,
+        content_type=file.content_type or downloads.DEFAULT_CONTENT_TYPE)
+
+    if file.static_manifest is not None:
+        response['X-Static-Large-Object'] = 'True'
+    else:
+        response['X-Object-Manifest'] = file.dynamic_manifest
+    return response
+
+
+def static_manifest_get(request, file):
+    """Return the manifest of a static large object, (as stored)."""
+    return HttpResponse(
+        file.static_manifest, content_type="application/json; charset=utf-8")
+
+
+def static_manifest_delete(request, container, file):
+    """
+    Delete a static large object, and all of its segments.
+
+    The result is reported as for a bulk-delete. The segments are
+    deleted a container at a time, (rather than one by one).
+    """
+    result = {"Number Deleted": 0,
+              "Number Not Found": 0,
+              "Response Body": "",
+              "Response Status": "200 OK"}
+
+    locations = [segment_location(segment["name"])
+                 for segment in json.loads(file.static_manifest)]
+    containers = {}
+    for (container_name, path) in locations:
+        containers.setdefault(container_name, []).append(path)
+    for container_name in sorted(containers):
+        bulk.delete_files(
+            container.account, container_name, containers[container_name],
+            result)
+
+    deleted = container.delete_files([file.path])
+    result["Number Deleted"] += deleted
+    result["Number Not Found"] += 1 - deleted
+    return bulk.bulk_response(request, result, [])
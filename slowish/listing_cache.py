@@ -0,0 +1,87 @@
+"""
+An optional cache of the bodies of container listings.
+
+It is enabled by naming one of Django's caches as SLOWISH_LISTING_CACHE.
+Listings are cached under a key that includes the container's
+last_change, which every store or delete of its files increments, so a
+listing is never served from the cache once the container has changed.
+That relies on last_change never going back to a value it has had,
+(with other files). Anything that can set it back, such as restoring a
+snapshot, must call invalidate_listings(), which moves every key to a
+new generation.
+A hit is the serialized body, sent without reading or serializing any
+files. The headers, (the container's counts and metadata), are always
+taken from the container's row, which is read to find last_change.
+"""
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+# Default number of seconds for which a listing is cached.
+LISTING_CACHE_TIMEOUT = 300
+
+# The key of the generation of cached listings, (which is random, so
+# one that is evicted from the cache is never followed by an old one).
+GENERATION_KEY = 'slowish:listing:generation'
+
+
+def listing_cache():
+    """Return the cache for listings, or None if they aren't cached."""
+    alias = getattr(settings, 'SLOWISH_LISTING_CACHE', None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def listing_generation(cache):
+    """Return the current generation of listings in cache."""
+    return cache.get_or_set(GENERATION_KEY, lambda: uuid.uuid4().hex, None)
+
+
+def invalidate_listings():
+    """Stop every listing in the cache from being served, (if cached)."""
+    cache = listing_cache()
+    if cache is not None:
+        cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+def listing_key(cache, container, request):
+    """
+    Return the key in cache of the listing of container that request
+    asks for.
+    """
+    query = json.dumps(sorted(request.GET.items()))
+    return 'slowish:listing:{0}:{1}:{2}:{3}:{4}'.format(
+        listing_generation(cache),
+        container.account_id,
+        container.pk,
+        container.last_change,
+        hashlib.md5(query.encode('utf-8')).hexdigest())
+
+
+def caching_content(chunks, cache, key, expiring):
+    """
+    Generate chunks of a listing, caching them once all are sent.
+
+    The expiring argument lists the delete_at of each file that was
+    read for the listing, (which is filled in as the chunks are
+    generated). A file vanishes from listings when it expires, without
+    any change to its container, so the listing is cached no longer
+    than the first of them has left to live.
+    """
+    content = []
+    for chunk in chunks:
+        content.append(chunk)
+        yield chunk
+
+    timeout = getattr(
+        settings, 'SLOWISH_LISTING_CACHE_TIMEOUT', LISTING_CACHE_TIMEOUT)
+    if expiring:
+        remaining = (min(expiring) - timezone.now()).total_seconds()
+        timeout = min(timeout, int(remaining))
+    if timeout > 0:
+        cache.set(key, b''.join(content), timeout)
@@ -0,0 +1,623 @@
+import errno
+from itertools import count
+import io
+import json
+import math
+import sys
+import tarfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import (
+    WSGIRequestHandler, WSGIServer, is_broken_pipe_error)
+from django.core.urlresolvers import reverse
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test import override_settings
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import six, timezone
+from django.utils.six.moves import http_client, socketserver
+from django.utils.six.moves.urllib.parse import urlencode, urlsplit
+
+from slowish.models import SlowishAccount, SlowishUser, SlowishContainer
+
+BENCHMARK_ACCOUNT = 4321
+BENCHMARK_USERNAME = "slowish_benchmark"
+BENCHMARK_PASSWORD = "not_secret"
+
+# Number of clients downloading slowly throughout the slow_downloads
+# scenario, (more than PostgreSQL's default of 100 connections).
+SLOW_CLIENTS = 200
+
+# Size of the file they download, and how fast they read it.
+SLOW_FILE_SIZE = 4 * 1024 * 1024
+SLOW_READ_SIZE = 16 * 1024
+SLOW_READ_INTERVAL = 0.1
+
+# Number of files in the container listed by the listing scenarios, and
+# the number listed by each request.
+LISTING_FILES = 10000
+LISTING_PAGE_SIZE = 100
+
+# Number of containers in the account listed by account_listing.
+LISTING_CONTAINERS = 100
+
+# Size of the files stored, read and deleted by the object scenarios.
+OBJECT_SIZE = 4096
+
+# The percentiles of latency that are reported.
+PERCENTILES = (50, 95, 99)
+
+
+class ClientTransport(object):
+    """
+    Makes requests of the views in this process, counting the queries
+    each makes, (with a Client for each thread).
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def request(self, method, path, body=b'', headers=None):
+        """Make a request, returning its status, content and queries."""
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client(HTTP_HOST=benchmark_host())
+
+        headers = dict(headers or {})
+        extra = dict(
+            ('HTTP_' + name.upper().replace('-', '_'), value)
+            for (name, value) in headers.items() if name != 'Content-Type')
+        with CaptureQueriesContext(connection) as queries:
+            response = client.generic(
+                method, path, body,
+                content_type=headers.get(
+                    'Content-Type', 'application/octet-stream'),
+                **extra)
+            # (The Client closes the response once its content is read)
+            if response.streaming:
+                content = b''.join(response.streaming_content)
+            else:
+                content = response.content
+        return (response.status_code, content, len(queries))
+
+    def finish(self):
+        # (Each thread has a connection to the database of its own)
+        connection.close()
+
+
+class HTTPTransport(object):
+    """Makes requests of a server, (whose queries aren't counted)."""
+
+    def __init__(self, address):
+        self.address = address
+
+    def request(self, method, path, body=b'', headers=None):
+        """Make a request, returning its status, content and None."""
+        server = http_client.HTTPConnection(*self.address)
+        try:
+            server.request(method, path, body, headers or {})
+            response = server.getresponse()
+            return (response.status, response.read(), None)
+        finally:
+            server.close()
+
+    def finish(self):
+        pass
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of sorted values."""
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def run_requests(transport, make_request, requests, concurrency):
+    """
+    Make requests, with concurrency threads, and measure them.
+
+    The make_request argument returns the (method, path, body, headers)
+    of the i'th request. With a concurrency of 1, the requests are made
+    from this thread, (and so see its transaction). Raises CommandError
+    if any request fails, and otherwise returns a dict of the
+    throughput, latency percentiles, (in milliseconds), and queries
+    per request, (if they were counted).
+    """
+    numbers = count()
+    latencies = []
+    queries = []
+    failures = []
+
+    def work():
+        try:
+            while True:
+                i = next(numbers)
+                if i >= requests or failures:
+                    return
+                (method, path, body, headers) = make_request(i)
+                start = time.time()
+                (status, content, made) = transport.request(
+                    method, path, body, headers)
+                latencies.append(time.time() - start)
+                queries.append(made)
+                if status >= 400:
+                    failures.append(
+                        "Unexpected {0} status from {1} {2}".format(
+                            status, method, path))
+        except Exception as e:
+            failures.append(repr(e))
+        finally:
+            if concurrency > 1:
+                transport.finish()
+
+    start = time.time()
+    if concurrency > 1:
+        workers = [threading.Thread(target=work) for i in range(concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    else:
+        work()
+    elapsed = time.time() - start
+
+    if failures:
+        raise CommandError(failures[0])
+
+    latencies.sort()
+    result = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "requests_per_second": requests / elapsed,
+        "queries_per_request": None,
+    }
+    for percent in PERCENTILES:
+        result["p{0}_ms".format(percent)] = (
+            percentile(latencies, percent) * 1000)
+    if None not in queries:
+        result["queries_per_request"] = sum(queries) / float(len(queries))
+    return result
+
+
+def benchmark_credentials():
+    return json.dumps({
+        "auth": {
+            "passwordCredentials": {
+                "username": BENCHMARK_USERNAME,
+                "password": BENCHMARK_PASSWORD,
+            },
+            "tenantId": str(BENCHMARK_ACCOUNT),
+        }
+    })
+
+
+def benchmark_token(transport):
+    """Return a token for the benchmark user."""
+    (status, content, queries) = transport.request(
+        'POST', reverse('tokens'), benchmark_credentials(),
+        {'Content-Type': "application/json"})
+    if status != 200:
+        raise CommandError("Unexpected {0} status from tokens".format(status))
+    return json.loads(content)["access"]["token"]["id"]
+
+
+def benchmark_path(container_name=None, path=None, **query):
+    """Return the path of the benchmark account, or a container or file."""
+    kwargs = {'account_id': BENCHMARK_ACCOUNT}
+    if container_name is None:
+        url = reverse('account', kwargs=kwargs)
+    elif path is None:
+        url = reverse('container', kwargs=dict(
+            kwargs, container_name=container_name))
+    else:
+        url = reverse('file', kwargs=dict(
+            kwargs, container_name=container_name, path=path))
+    if query:
+        url += '?' + urlencode(sorted(query.items()))
+    return url
+
+
+def store_archive(transport, token, container_name, paths, size):
+    """Store files of size bytes at paths, with a single extract-archive."""
+    archive = io.BytesIO()
+    with tarfile.open(mode='w', fileobj=archive) as tar:
+        content = b'x' * size
+        for path in paths:
+            info = tarfile.TarInfo(path)
+            info.size = size
+            tar.addfile(info, io.BytesIO(content))
+
+    (status, content, queries) = transport.request(
+        'PUT', benchmark_path(container_name, **{'extract-archive': 'tar'}),
+        archive.getvalue(),
+        {'X-Auth-Token': token, 'Accept': "application/json"})
+    if status != 200 or not json.loads(content)[
+            "Response Status"].startswith("201"):
+        raise CommandError(
+            "Couldn't store files in {0}: {1}".format(container_name, content))
+
+
+def fill_container(transport, token, container_name, files):
+    """Store empty files in the named container, unless already stored."""
+    # (Which is the case if the last of them is listed)
+    (status, content, queries) = transport.request(
+        'GET', benchmark_path(container_name, limit=1, marker=listing_path(
+            files - 2)), b'', {'X-Auth-Token': token})
+    if status == 200 and json.loads(content):
+        return
+    store_archive(transport, token, container_name,
+                  [listing_path(i) for i in range(files)], 0)
+
+
+def listing_path(i):
+    return u"file/{0:05d}".format(i)
+
+
+def benchmark_tokens(transport, options):
+    """POST valid credentials to the tokens view."""
+    body = benchmark_credentials()
+    path = reverse('tokens')
+    return run_requests(
+        transport,
+        lambda i: ('POST', path, body, {'Content-Type': "application/json"}),
+        options['requests'], options['concurrency'])
+
+
+def benchmark_account_listing(transport, options):
+    """GET pages of an account with LISTING_CONTAINERS containers."""
+    token = benchmark_token(transport)
+    for i in range(LISTING_CONTAINERS):
+        transport.request(
+            'PUT', benchmark_path(u"listing{0:03d}".format(i)), b'',
+            {'X-Auth-Token': token})
+
+    def make_request(i):
+        return ('GET', benchmark_path(
+            limit=LISTING_PAGE_SIZE,
+            marker=u"listing{0:03d}".format(i % LISTING_CONTAINERS)),
+            b'', {'X-Auth-Token': token})
+    return run_requests(
+        transport, make_request, options['requests'], options['concurrency'])
+
+
+def listing_requests(token, writes):
+    """
+    Return a function making the requests of a container listing
+    scenario.
+
+    Alternate requests list a page by prefix, and from a marker, (each
+    starting at a different file). If writes, every tenth request
+    stores a file instead, (so the listings have changed).
+    """
+    def make_request(i):
+        headers = {'X-Auth-Token': token}
+        if writes and i % 10 == 0:
+            return ('PUT', benchmark_path("listing", "changed"), b'', headers)
+        if i % 2:
+            marker = listing_path(i * 7919 % LISTING_FILES)
+            return ('GET', benchmark_path(
+                "listing", marker=marker, limit=LISTING_PAGE_SIZE),
+                b'', headers)
+        prefix = listing_path(i * 7919 % LISTING_FILES)[:-2]
+        return ('GET', benchmark_path("listing", prefix=prefix),
+                b'', headers)
+    return make_request
+
+
+def benchmark_container_listing(transport, options):
+    """GET pages of a container with LISTING_FILES files."""
+    token = benchmark_token(transport)
+    fill_container(transport, token, "listing", LISTING_FILES)
+    return run_requests(
+        transport, listing_requests(token, False),
+        options['requests'], options['concurrency'])
+
+
+def benchmark_listing(engine):
+    """
+    Return a scenario listing pages of a container with LISTING_FILES
+    files, with engine as the SLOWISH_LISTING_ENGINE.
+
+    Every tenth request stores a file, (so the listing has changed).
+    """
+    def scenario(transport, options):
+        if not isinstance(transport, ClientTransport):
+            raise CommandError(
+                "The listing engine can only be chosen in process.")
+        token = benchmark_token(transport)
+        fill_container(transport, token, "listing", LISTING_FILES)
+        with override_settings(SLOWISH_LISTING_ENGINE=engine):
+            return run_requests(
+                transport, listing_requests(token, True),
+                options['requests'], options['concurrency'])
+    return scenario
+
+
+def benchmark_object_put(transport, options):
+    """PUT files of OBJECT_SIZE bytes, (over 100 paths)."""
+    token = benchmark_token(transport)
+    body = b'x' * OBJECT_SIZE
+    return run_requests(
+        transport,
+        lambda i: ('PUT', benchmark_path("objects", u"put{0}".format(i % 100)),
+                   body, {'X-Auth-Token': token}),
+        options['requests'], options['concurrency'])
+
+
+def benchmark_object_get(transport, options):
+    """GET a file of OBJECT_SIZE bytes."""
+    token = benchmark_token(transport)
+    path = benchmark_path("objects", "get")
+    transport.request('PUT', path, b'x' * OBJECT_SIZE, {'X-Auth-Token': token})
+    return run_requests(
+        transport,
+        lambda i: ('GET', path, b'', {'X-Auth-Token': token}),
+        options['requests'], options['concurrency'])
+
+
+def benchmark_object_delete(transport, options):
+    """DELETE files of OBJECT_SIZE bytes, (stored by one extract-archive)."""
+    token = benchmark_token(transport)
+    paths = [u"delete{0}".format(i) for i in range(options['requests'])]
+    store_archive(transport, token, "objects", paths, OBJECT_SIZE)
+    return run_requests(
+        transport,
+        lambda i: ('DELETE', benchmark_path("objects", paths[i]), b'',
+                   {'X-Auth-Token': token}),
+        options['requests'], options['concurrency'])
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def get_stderr(self):
+        # (Tracebacks of slow clients hanging up are of no interest)
+        return six.StringIO()
+
+
+class ThreadedServer(socketserver.ThreadingMixIn, WSGIServer):
+    """A WSGI server with a thread for each connection, as runserver."""
+
+    daemon_threads = True
+    request_queue_size = SLOW_CLIENTS
+
+    def handle_error(self, request, client_address):
+        # The slow clients hang up without finishing their downloads
+        error = sys.exc_info()[1]
+        if not is_broken_pipe_error() and getattr(
+                error, 'errno', None) != errno.ECONNRESET:
+            super(ThreadedServer, self).handle_error(request, client_address)
+
+
+def slow_download(address, url, token, started, failures, stop):
+    """Download url a little at a time, until stop is set."""
+    connection = http_client.HTTPConnection(*address)
+    try:
+        connection.request('GET', url, headers={'X-Auth-Token': token})
+        response = connection.getresponse()
+        if response.status != 200:
+            failures.append(response.status)
+        started.release()
+        while not stop.is_set() and response.read(SLOW_READ_SIZE):
+            stop.wait(SLOW_READ_INTERVAL)
+    except Exception as e:
+        failures.append(e)
+        started.release()
+    finally:
+        connection.close()
+
+
+def benchmark_slow_downloads(transport, options):
+    """
+    HEAD a file while SLOW_CLIENTS download it slowly.
+
+    The requests are made to a threaded server, (like runserver), on a
+    local port, started in this process.
+    """
+    if not isinstance(transport, ClientTransport):
+        raise CommandError("Slow downloads can only be served in process.")
+    token = benchmark_token(transport)
+    url = benchmark_path("benchmark", "slow")
+    transport.request(
+        'PUT', url, b'x' * SLOW_FILE_SIZE, {'X-Auth-Token': token})
+
+    server = ThreadedServer(('127.0.0.1', 0), QuietRequestHandler)
+    server.set_app(get_wsgi_application())
+    serving = threading.Thread(target=server.serve_forever)
+    serving.daemon = True
+    serving.start()
+    address = server.server_address[:2]
+
+    started = threading.Semaphore(0)
+    failures = []
+    stop = threading.Event()
+    downloads = [threading.Thread(
+        target=slow_download,
+        args=(address, url, token, started, failures, stop))
+        for i in range(SLOW_CLIENTS)]
+    try:
+        for download in downloads:
+            download.start()
+        for download in downloads:
+            started.acquire()
+        if failures:
+            raise CommandError(
+                "{0} slow downloads failed, (first with {1!r})".format(
+                    len(failures), failures[0]))
+
+        result = run_requests(
+            HTTPTransport(address),
+            lambda i: ('HEAD', url, b'', {'X-Auth-Token': token}),
+            options['requests'], options['concurrency'])
+    finally:
+        stop.set()
+        for download in downloads:
+            download.join()
+        server.shutdown()
+        server.server_close()
+
+    result["slow_downloads"] = SLOW_CLIENTS
+    return result
+
+
+def benchmark_host():
+    """Return a host name that the configured ALLOWED_HOSTS accepts."""
+
+    # With DEBUG on, an empty ALLOWED_HOSTS accepts localhost
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*' and not host.startswith('.'):
+            return host
+    return 'localhost'
+
+
+def server_address(url):
+    """Return the (host, port) of a server's URL."""
+    parts = urlsplit(url)
+    if parts.scheme != 'http' or not parts.hostname:
+        raise CommandError("Only http:// servers can be benchmarked.")
+    return (parts.hostname, parts.port or 80)
+
+
+def benchmark_account():
+    """
+    Create the benchmark account and user, unless kept from a run with
+    --keep, returning the account.
+    """
+    (account, created) = SlowishAccount.objects.get_or_create(
+        id=BENCHMARK_ACCOUNT)
+    if not created and not SlowishUser.objects.filter(
+            account=account, username=BENCHMARK_USERNAME).exists():
+        raise CommandError(
+            "Account {0} is in use, (by other than the benchmark).".format(
+                BENCHMARK_ACCOUNT))
+    SlowishUser.objects.get_or_create(
+        account=account,
+        username=BENCHMARK_USERNAME,
+        password=BENCHMARK_PASSWORD)
+    return account
+
+
+def delete_account(account):
+    """Delete the benchmark account, with its files and their contents."""
+    for container in SlowishContainer.objects.filter(account=account):
+        while container.purge_files():
+            pass
+    account.delete()
+
+
+def relative_change(value, base):
+    """Return the change from base to value, as a percentage."""
+    if not base:
+        return "n/a"
+    return "{0:+.0%}".format(value / base - 1)
+
+
+def result_summary(result, baseline):
+    """Return a line summarizing a scenario's result."""
+    summary = (
+        "{requests} requests in {seconds:.2f}s "
+        "({requests_per_second:.0f} requests/s), "
+        "p50 {p50_ms:.1f}ms, p95 {p95_ms:.1f}ms, p99 {p99_ms:.1f}ms".format(
+            **result))
+    if result["queries_per_request"] is not None:
+        summary += ", {0:.1f} queries/request".format(
+            result["queries_per_request"])
+    if "slow_downloads" in result:
+        summary += ", with {0} slow downloads".format(
+            result["slow_downloads"])
+    if baseline is not None:
+        summary += ", {0} requests/s and {1} p95 on baseline".format(
+            relative_change(result["requests_per_second"],
+                            baseline["requests_per_second"]),
+            relative_change(result["p95_ms"], baseline["p95_ms"]))
+    return summary
+
+
+SCENARIOS = {
+    "account_listing": benchmark_account_listing,
+    "container_listing": benchmark_container_listing,
+    "listing_memory": benchmark_listing("memory"),
+    "listing_orm": benchmark_listing("orm"),
+    "object_delete": benchmark_object_delete,
+    "object_get": benchmark_object_get,
+    "object_put": benchmark_object_put,
+    "slow_downloads": benchmark_slow_downloads,
+    "tokens": benchmark_tokens,
+}
+
+
+class Command(BaseCommand):
+    help = ("Measure the throughput and latency of slowish views, (in "
+            "process, against the configured database, or of a server).")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios', nargs='*', metavar='scenario',
+            default=sorted(SCENARIOS),
+            help="Scenarios to run, (any of: {0}).".format(
+                ", ".join(sorted(SCENARIOS))))
+        parser.add_argument(
+            '--requests', type=int, default=1000,
+            help="Number of requests to make in each scenario.")
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help="Number of requests to make at once.")
+        parser.add_argument(
+            '--url',
+            help="Base URL of a server to make the requests of, (such as "
+                 "http://localhost:8000), rather than of the views in "
+                 "process. The server must share the database.")
+        parser.add_argument(
+            '--json',
+            help="File to write the results to, as JSON.")
+        parser.add_argument(
+            '--baseline',
+            help="Results written by an earlier --json to compare with.")
+        parser.add_argument(
+            '--keep', action='store_true',
+            help="Keep the benchmark account and its files, (for later "
+                 "runs to reuse), rather than deleting them.")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError(
+                "The requests and concurrency must be at least 1.")
+        for name in options['scenarios']:
+            if name not in SCENARIOS:
+                raise CommandError("Unknown scenario {0!r}".format(name))
+
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)["scenarios"]
+
+        if options['url']:
+            transport = HTTPTransport(server_address(options['url']))
+        else:
+            transport = ClientTransport()
+
+        account = benchmark_account()
+        results = {}
+        try:
+            for name in options['scenarios']:
+                results[name] = SCENARIOS[name](transport, options)
+                self.stdout.write("{0}: {1}".format(
+                    name, result_summary(results[name], baseline.get(name))))
+        finally:
+            if not options['keep']:
+                delete_account(account)
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump({
+                    "time": timezone.now().isoformat(),
+                    "database": connection.vendor,
+                    "url": options['url'],
+                    "scenarios": results,
+                }, f, indent=2, sort_keys=True)
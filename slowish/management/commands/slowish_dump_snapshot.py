@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from slowish.snapshots import SnapshotError, dump_snapshot
+
+
+class Command(BaseCommand):
+    help = ("Write a snapshot of all Slowish accounts, users, tokens, "
+            "containers and files, (with their contents), to a file.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help="File to write the snapshot, (gzipped), to.")
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help="Database to take the snapshot of.")
+
+    def handle(self, *args, **options):
+        try:
+            rows = dump_snapshot(options['path'], options['database'])
+        except SnapshotError as e:
+            raise CommandError(str(e))
+        self.stdout.write("Wrote {0} rows to {1}.".format(
+            rows, options['path']))
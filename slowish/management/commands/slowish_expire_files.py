@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from slowish.models import PURGE_BATCH_SIZE, SlowishFile
+
+
+class Command(BaseCommand):
+    help = ("Delete the Slowish files whose X-Delete-At time has "
+            "passed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=PURGE_BATCH_SIZE,
+            help="Number of files to delete in each transaction.")
+
+    def handle(self, *args, **options):
+        count = SlowishFile.objects.expire(options['batch_size'])
+        self.stdout.write("Deleted {0} expired files.".format(count))
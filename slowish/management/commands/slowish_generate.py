@@ -0,0 +1,146 @@
+import io
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from slowish import blobs
+from slowish.models import SlowishAccount, SlowishUser, SlowishContainer
+from slowish.models import SlowishBlob, SlowishFile, SlowishChange
+from slowish.snapshots import insert_rows
+
+GENERATED_USERNAME = "generated"
+GENERATED_PASSWORD = "not_secret"
+
+
+def generated_path(i, depth, fan_out):
+    """
+    Return the path of the i'th generated file of a container.
+
+    Files are spread evenly over fan_out ** depth directories, depth
+    levels deep, with consecutive files in different directories.
+    """
+    directories = []
+    for level in range(depth):
+        directories.append(u"dir{0}".format(i // fan_out ** level % fan_out))
+    return u"/".join(directories + [u"file{0:08d}".format(i)])
+
+
+def generated_blob(size, references, using):
+    """Return a blob of size bytes, with references added, (or None)."""
+    if size == 0:
+        return None
+    (temporary, etag, size) = blobs.write_temporary(io.BytesIO(b'x' * size))
+    try:
+        blob = SlowishBlob.objects.using(using).acquire(
+            {etag: (size, references)})[etag]
+    except Exception:
+        blobs.discard_temporary(temporary)
+        raise
+    blobs.commit_temporary(temporary, etag)
+    return blob
+
+
+def generate_account(account_id, options):
+    """
+    Generate an account, with a user, its containers and their files.
+
+    Returns the number of rows inserted. The files and their changes
+    are generated as they are inserted, (rather than listed first), so
+    memory use doesn't grow with their number.
+    """
+    using = options['database']
+    connection = connections[using]
+    (containers, files, depth, fan_out, size) = (
+        options['containers'], options['files'], options['depth'],
+        options['fan_out'], options['file_size'])
+
+    blob = generated_blob(size, containers * files, using)
+    blob_id = blob.pk if blob is not None else None
+    account = SlowishAccount.objects.using(using).create(
+        id=account_id,
+        container_count=containers,
+        object_count=containers * files,
+        bytes_used=containers * files * size)
+    SlowishUser.objects.using(using).create(
+        account=account,
+        username=GENERATED_USERNAME,
+        password=GENERATED_PASSWORD)
+    SlowishContainer.objects.using(using).bulk_create(
+        SlowishContainer(account=account,
+                         name=u"container{0}".format(i),
+                         object_count=files,
+                         bytes_used=files * size,
+                         last_change=files)
+        for i in range(containers))
+
+    # (Formatted once, rather than for every file)
+    now = timezone.now().isoformat()
+    rows = 2 + containers
+    for container_id in SlowishContainer.objects.using(using).filter(
+            account=account).order_by('pk').values_list('pk', flat=True):
+        rows += insert_rows(
+            connection, SlowishFile,
+            ['container_id', 'path', 'blob_id', 'bytes', 'last_modified'],
+            ((container_id, generated_path(i, depth, fan_out), blob_id,
+              size, now)
+             for i in range(files)))
+        rows += insert_rows(
+            connection, SlowishChange,
+            ['container_id', 'path', 'change', 'deleted'],
+            ((container_id, generated_path(i, depth, fan_out), i + 1, False)
+             for i in range(files)))
+    return rows
+
+
+class Command(BaseCommand):
+    help = ("Generate Slowish accounts, containers and files in bulk, "
+            "(for testing at scale).")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--accounts', type=int, default=1,
+            help="Number of accounts to generate, (numbered after the "
+                 "highest existing account).")
+        parser.add_argument(
+            '--containers', type=int, default=10,
+            help="Number of containers in each account.")
+        parser.add_argument(
+            '--files', type=int, default=1000,
+            help="Number of files in each container.")
+        parser.add_argument(
+            '--depth', type=int, default=2,
+            help="Number of directories in the path of each file.")
+        parser.add_argument(
+            '--fan-out', type=int, default=10,
+            help="Number of subdirectories of each directory.")
+        parser.add_argument(
+            '--file-size', type=int, default=0,
+            help="Size of each file, (whose contents share a blob).")
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help="Database to generate the rows in.")
+
+    def handle(self, *args, **options):
+        if options['depth'] < 0 or options['fan_out'] < 1:
+            raise CommandError(
+                "The depth can't be negative, nor the fan-out zero.")
+
+        first = (SlowishAccount.objects.using(options['database']).aggregate(
+            Max('id'))['id__max'] or 0) + 1
+        start = time.time()
+        rows = 0
+        for account_id in range(first, first + options['accounts']):
+            # (Each account is committed as it is generated)
+            with transaction.atomic(using=options['database']):
+                rows += generate_account(account_id, options)
+        elapsed = time.time() - start
+
+        self.stdout.write(
+            "Generated accounts {0} to {1}, (user {2!r}, password {3!r}): "
+            "{4} rows in {5:.2f}s ({6:.0f} rows/s)".format(
+                first, first + options['accounts'] - 1,
+                GENERATED_USERNAME, GENERATED_PASSWORD,
+                rows, elapsed, rows / max(elapsed, 1e-6)))
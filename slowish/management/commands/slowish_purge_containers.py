@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from slowish.models import PURGE_BATCH_SIZE, SlowishContainer
+
+
+class Command(BaseCommand):
+    help = ("Remove the files of deleted Slowish containers, and then "
+            "the containers themselves.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=PURGE_BATCH_SIZE,
+            help="Number of files to remove in each transaction.")
+
+    def handle(self, *args, **options):
+        count = SlowishContainer.objects.purge_deleted(options['batch_size'])
+        self.stdout.write(
+            "Purged {0} files of deleted containers.".format(count))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from slowish.models import SlowishToken
+
+
+class Command(BaseCommand):
+    help = "Delete all expired Slowish tokens."
+
+    def handle(self, *args, **options):
+        count = SlowishToken.objects.purge_expired()
+        self.stdout.write("Deleted {0} expired tokens.".format(count))
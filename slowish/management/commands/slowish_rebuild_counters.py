@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from slowish.models import SlowishAccount, SlowishContainer, SlowishFile
+
+
+def rebuild_counters(account_model, container_model, file_model):
+    """
+    Recompute the counts of every container and account.
+
+    Each set of counts is rebuilt with a single UPDATE statement using
+    correlated subqueries, rather than a query per container. Deleted
+    containers, (whose files are waiting to be purged), don't count
+    towards their accounts.
+    """
+    files = file_model.objects.filter(
+        container=OuterRef('pk')).order_by().values('container')
+    container_model.objects.update(
+        object_count=Coalesce(
+            Subquery(files.annotate(count=Count('pk')).values('count')), 0),
+        bytes_used=Coalesce(
+            Subquery(files.annotate(total=Sum('bytes')).values('total')), 0))
+
+    containers = container_model.objects.filter(
+        account=OuterRef('pk'),
+        deleted=False).order_by().values('account')
+    account_model.objects.update(
+        container_count=Coalesce(
+            Subquery(containers.annotate(
+                count=Count('pk')).values('count')), 0),
+        object_count=Coalesce(
+            Subquery(containers.annotate(
+                total=Sum('object_count')).values('total')), 0),
+        bytes_used=Coalesce(
+            Subquery(containers.annotate(
+                total=Sum('bytes_used')).values('total')), 0))
+
+
+class Command(BaseCommand):
+    help = ("Recompute the object and byte counts of all Slowish "
+            "containers and accounts from their files.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_counters(SlowishAccount, SlowishContainer, SlowishFile)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from slowish.snapshots import SnapshotError, restore_snapshot
+
+
+class Command(BaseCommand):
+    help = ("Replace all Slowish accounts, users, tokens, containers and "
+            "files with those of a snapshot from slowish_dump_snapshot.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help="Snapshot file to restore.")
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help="Database to restore the snapshot into.")
+
+    def handle(self, *args, **options):
+        try:
+            rows = restore_snapshot(options['path'], options['database'])
+        except SnapshotError as e:
+            raise CommandError(str(e))
+        self.stdout.write("Restored {0} rows from {1}.".format(
+            rows, options['path']))
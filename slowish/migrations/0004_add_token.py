@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import slowish.models
+
+
+def copy_user_tokens(apps, schema_editor):
+    SlowishUser = apps.get_model('slowish', 'SlowishUser')
+    SlowishToken = apps.get_model('slowish', 'SlowishToken')
+
+    SlowishToken.objects.bulk_create(
+        SlowishToken(user_id=user_id, token=token)
+        for (user_id, token)
+        in SlowishUser.objects.values_list('id', 'token'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slowish', '0003_add_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowishToken',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('token', models.CharField(default=slowish.models.generate_token, help_text=b'Generated token to allow authorized uses of the API.', unique=True, max_length=255)),
+                ('expires', models.DateTimeField(default=slowish.models.token_expiration, help_text=b'Time after which this token is no longer accepted.', db_index=True)),
+                ('user', models.ForeignKey(related_name='tokens', to='slowish.SlowishUser')),
+            ],
+            options={
+                'verbose_name': 'Slowish Token',
+                'verbose_name_plural': 'Slowish Tokens',
+            },
+        ),
+        migrations.RunPython(copy_user_tokens, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='slowishuser',
+            name='token',
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slowish', '0004_add_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowishBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('etag', models.CharField(help_text=b'MD5 digest of the content, (which names it on disk).', max_length=32, unique=True)),
+                ('bytes', models.BigIntegerField(help_text=b'Size of the content.')),
+                ('refs', models.PositiveIntegerField(help_text=b'Number of files with this content.')),
+            ],
+            options={
+                'verbose_name': 'Slowish Blob',
+                'verbose_name_plural': 'Slowish Blobs',
+            },
+        ),
+        migrations.AddField(
+            model_name='slowishfile',
+            name='bytes',
+            field=models.BigIntegerField(default=0, help_text=b'Size of the content of this file.'),
+        ),
+        migrations.AddField(
+            model_name='slowishfile',
+            name='last_modified',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text=b'Time at which the content of this file was stored.'),
+        ),
+        migrations.AddField(
+            model_name='slowishfile',
+            name='blob',
+            field=models.ForeignKey(blank=True, help_text=b'Content of this file, (if not empty).', null=True, on_delete=django.db.models.deletion.PROTECT, to='slowish.SlowishBlob'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def count_existing(apps, schema_editor):
+    # This is slowish_rebuild_counters as it was when the counters were
+    # added, (before containers could be marked deleted).
+    account_model = apps.get_model('slowish', 'SlowishAccount')
+    container_model = apps.get_model('slowish', 'SlowishContainer')
+    file_model = apps.get_model('slowish', 'SlowishFile')
+
+    files = file_model.objects.filter(
+        container=OuterRef('pk')).order_by().values('container')
+    container_model.objects.update(
+        object_count=Coalesce(
+            Subquery(files.annotate(count=Count('pk')).values('count')), 0),
+        bytes_used=Coalesce(
+            Subquery(files.annotate(total=Sum('bytes')).values('total')), 0))
+
+    containers = container_model.objects.filter(
+        account=OuterRef('pk')).order_by().values('account')
+    account_model.objects.update(
+        container_count=Coalesce(
+            Subquery(containers.annotate(
+                count=Count('pk')).values('count')), 0),
+        object_count=Coalesce(
+            Subquery(containers.annotate(
+                total=Sum('object_count')).values('total')), 0),
+        bytes_used=Coalesce(
+            Subquery(containers.annotate(
+                total=Sum('bytes_used')).values('total')), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slowish', '0005_add_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slowishaccount',
+            name='bytes_used',
+            field=models.BigIntegerField(default=0, help_text=b'Total size of the files in this account.'),
+        ),
+        migrations.AddField(
+            model_name='slowishaccount',
+            name='container_count',
+            field=models.BigIntegerField(default=0, help_text=b'Number of containers in this account.'),
+        ),
+        migrations.AddField(
+            model_name='slowishaccount',
+            name='object_count',
+            field=models.BigIntegerField(default=0, help_text=b'Number of files in this account.'),
+        ),
+        migrations.AddField(
+            model_name='slowishcontainer',
+            name='bytes_used',
+            field=models.BigIntegerField(default=0, help_text=b'Total size of the files in this container.'),
+        ),
+        migrations.AddField(
+            model_name='slowishcontainer',
+            name='object_count',
+            field=models.BigIntegerField(default=0, help_text=b'Number of files in this container.'),
+        ),
+        migrations.RunPython(count_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slowish', '0006_add_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slowishcontainer',
+            name='deleted',
+            field=models.BooleanField(db_index=True, default=False, help_text=b'Whether this container has been deleted, (and its files are waiting to be purged).'),
+        ),
+    ]
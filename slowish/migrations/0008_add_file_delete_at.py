@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slowish', '0007_add_container_deleted'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slowishfile',
+            name='delete_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text=b'Time at which this file expires, (if ever).', null=True),
+        ),
+    ]
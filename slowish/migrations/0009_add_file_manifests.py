@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slowish', '0008_add_file_delete_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slowishfile',
+            name='dynamic_manifest',
+            field=models.CharField(blank=True, help_text=b'The container/prefix of the segments, if this file is the manifest of a dynamic large object.', max_length=1280, null=True),
+        ),
+        migrations.AddField(
+            model_name='slowishfile',
+            name='static_manifest',
+            field=models.TextField(blank=True, help_text=b'JSON list of the segments, if this file is the manifest of a static large object.', null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slowish', '0009_add_file_manifests'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slowishcontainer',
+            name='metadata',
+            field=models.TextField(blank=True, help_text=b'JSON object of the X-Container-Meta-* headers set on this container, (keyed by the lower-cased name after the prefix).', null=True),
+        ),
+        migrations.AddField(
+            model_name='slowishfile',
+            name='content_type',
+            field=models.CharField(blank=True, help_text=b'Content-Type given when this file was stored, (if any).', max_length=256, null=True),
+        ),
+        migrations.AddField(
+            model_name='slowishfile',
+            name='metadata',
+            field=models.TextField(blank=True, help_text=b'JSON object of the X-Object-Meta-* headers set on this file, (keyed by the lower-cased name after the prefix).', null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def set_path_collation(collation):
+    # On PostgreSQL, paths are compared byte by byte, (as Swift orders
+    # its listings), whatever the database's collation. The unique
+    # (container, path) index is rebuilt with the column, and serves
+    # both prefix ranges and LIKE 'prefix%' on it. Other databases
+    # compare text by code point already.
+    def alter(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        file_model = apps.get_model('slowish', 'SlowishFile')
+        schema_editor.execute(
+            'ALTER TABLE {0} ALTER COLUMN {1} TYPE varchar(1024){2}'.format(
+                schema_editor.quote_name(file_model._meta.db_table),
+                schema_editor.quote_name('path'),
+                collation))
+    return alter
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slowish', '0010_add_metadata'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            set_path_collation(' COLLATE "C"'), set_path_collation('')),
+    ]
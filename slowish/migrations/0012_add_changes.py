@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def record_existing(apps, schema_editor):
+    # Every existing file is recorded as a change, (numbered in the
+    # order the files were created), so a client reading a changes feed
+    # from the start sees all of them.
+    container_model = apps.get_model('slowish', 'SlowishContainer')
+    change_model = apps.get_model('slowish', 'SlowishChange')
+    file_model = apps.get_model('slowish', 'SlowishFile')
+
+    for container in container_model.objects.filter(deleted=False):
+        paths = file_model.objects.filter(
+            container=container).order_by('pk').values_list('path', flat=True)
+        count = 0
+        batch = []
+        for path in paths.iterator():
+            count += 1
+            batch.append(change_model(
+                container=container, path=path, change=count))
+            if len(batch) >= 1000:
+                change_model.objects.bulk_create(batch)
+                batch = []
+        change_model.objects.bulk_create(batch)
+        container_model.objects.filter(pk=container.pk).update(
+            last_change=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slowish', '0011_file_path_collation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowishChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(help_text=b'Path of the file that was changed.', max_length=1024)),
+                ('change', models.BigIntegerField(help_text=b'Number of this change, (within the container).')),
+                ('deleted', models.BooleanField(default=False, help_text=b'Whether the change deleted the file, (rather than storing it).')),
+            ],
+            options={
+                'verbose_name': 'Slowish Change',
+                'verbose_name_plural': 'Slowish Changes',
+            },
+        ),
+        migrations.AddField(
+            model_name='slowishcontainer',
+            name='last_change',
+            field=models.BigIntegerField(default=0, help_text=b'Number of the latest change to the files in this container, (0 if there have been none).'),
+        ),
+        migrations.AddField(
+            model_name='slowishchange',
+            name='container',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='slowish.SlowishContainer'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='slowishchange',
+            unique_together=set([('container', 'path'), ('container', 'change')]),
+        ),
+        migrations.RunPython(record_existing, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,47 @@
+from collections import Counter, OrderedDict
+from datetime import timedelta
+import json
 import random
 import string
+import sys
 
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Case, F, Q, When, sql
+from django.utils import six, timezone
+
+from . import blobs
+
+# Default number of seconds for which an issued token remains valid.
+TOKEN_LIFETIME = 2 * 24 * 60 * 60
+
+# Number of files of a deleted container removed by each transaction
+# that purges them.
+PURGE_BATCH_SIZE = 1000
+
+# The fields of a SlowishFile, (besides its content), that are set by
+# storing it, and their values when a request doesn't give them.
+FILE_ATTRIBUTES = {
+    "content_type": None,
+    "delete_at": None,
+    "dynamic_manifest": None,
+    "metadata": None,
+    "static_manifest": None,
+}
+
+
+def dump_metadata(metadata):
+    """Return the value of a metadata column for a dict, (None if empty)."""
+    if not metadata:
+        return None
+    return json.dumps(metadata, sort_keys=True)
+
+
+def load_metadata(value):
+    """Return the dict held in a metadata column."""
+    if value is None:
+        return {}
+    return json.loads(value)
 
 
 def generate_token():
@@ -9,6 +49,136 @@ def generate_token():
         string.letters + string.digits) for i in range(150)])
 
 
+def token_lifetime():
+    return timedelta(seconds=getattr(
+        settings, 'SLOWISH_TOKEN_LIFETIME', TOKEN_LIFETIME))
+
+
+def token_expiration():
+    return timezone.now() + token_lifetime()
+
+
+def insert_new(model, using, rows, unique, returning='pk'):
+    """
+    Insert rows of model, skipping any that conflict with existing ones.
+
+    Each row maps field attnames to their values, and unique lists the
+    attnames of the constraint that may conflict. Returns the values of
+    the returning field for the rows inserted, (so a row is left out if
+    one with the same unique values exists, including one that a
+    concurrent transaction has just inserted). On PostgreSQL this is a
+    single INSERT ... ON CONFLICT DO NOTHING statement, elsewhere an
+    INSERT in a savepoint for each row.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        inserted = []
+        for values in rows:
+            try:
+                with transaction.atomic(using=using):
+                    created = model.objects.using(using).create(**values)
+            except IntegrityError:
+                continue
+            inserted.append(getattr(created, returning))
+        return inserted
+
+    if not rows:
+        return []
+
+    (sql, params, columns) = insert_statement(connection, model, rows)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            sql + ' ON CONFLICT ({0}) DO NOTHING RETURNING {1}'.format(
+                columns(unique), columns([returning])),
+            params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def upsert(model, using, rows, unique):
+    """
+    Insert rows of model, or update the existing rows they conflict with.
+
+    The rows are as for insert_new(), and every field they give is set
+    on an existing row with the same unique values. On PostgreSQL this
+    is a single INSERT ... ON CONFLICT DO UPDATE statement, elsewhere an
+    UPDATE for each row, (followed by an INSERT if it updated nothing).
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        for values in rows:
+            existing = model.objects.using(using).filter(
+                **dict((attname, values[attname]) for attname in unique))
+            if not existing.update(**values):
+                model.objects.using(using).create(**values)
+        return
+
+    if not rows:
+        return
+
+    (sql, params, columns) = insert_statement(connection, model, rows)
+    updated = [attname for attname in sorted(rows[0])
+               if attname not in unique]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            sql + ' ON CONFLICT ({0}) DO UPDATE SET {1}'.format(
+                columns(unique),
+                ', '.join('{0} = EXCLUDED.{0}'.format(columns([attname]))
+                          for attname in updated)),
+            params)
+
+
+def update_returning(queryset, returning, **values):
+    """
+    Update the rows of queryset, returning the new values of a field.
+
+    On PostgreSQL this is a single UPDATE ... RETURNING statement,
+    elsewhere an UPDATE followed by a SELECT, (of the same rows, as the
+    UPDATE leaves them locked until the transaction ends).
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        if not queryset.update(**values):
+            return []
+        return list(queryset.values_list(returning, flat=True))
+
+    query = queryset.query.clone(sql.UpdateQuery)
+    query.add_update_values(values)
+    (update_sql, params) = query.get_compiler(queryset.db).as_sql()
+    column = queryset.model._meta.get_field(returning).column
+    with connection.cursor() as cursor:
+        cursor.execute(
+            update_sql + ' RETURNING ' + connection.ops.quote_name(column),
+            params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def insert_statement(connection, model, rows):
+    """
+    Return an INSERT statement of rows of model, (for insert_new() and
+    upsert()), with its parameters and a function quoting the columns
+    of a list of attnames.
+    """
+    opts = model._meta
+    fields = dict((field.attname, field) for field in opts.concrete_fields)
+    fields['pk'] = opts.pk
+    attnames = sorted(rows[0])
+    params = []
+    for values in rows:
+        params.extend(fields[attname].get_db_prep_save(
+            values[attname], connection) for attname in attnames)
+
+    def columns(attnames):
+        return ', '.join(connection.ops.quote_name(fields[attname].column)
+                         for attname in attnames)
+
+    row_placeholders = '({0})'.format(', '.join(['%s'] * len(attnames)))
+    sql = 'INSERT INTO {0} ({1}) VALUES {2}'.format(
+        connection.ops.quote_name(opts.db_table),
+        columns(attnames),
+        ', '.join([row_placeholders] * len(rows)))
+    return (sql, params, columns)
+
+
 class SlowishAccount(models.Model):
     """An account (aka 'tenant') for Slowish storage."""
 
@@ -16,6 +186,20 @@ class SlowishAccount(models.Model):
         help_text="Also known as Account # within rackspace, eg. '123456'.",
         primary_key=True)
 
+    # The following counts are maintained as containers and files are
+    # added and removed, (see the slowish_rebuild_counters command).
+    container_count = models.BigIntegerField(
+        help_text="Number of containers in this account.",
+        default=0)
+
+    object_count = models.BigIntegerField(
+        help_text="Number of files in this account.",
+        default=0)
+
+    bytes_used = models.BigIntegerField(
+        help_text="Total size of the files in this account.",
+        default=0)
+
     class Meta:
         verbose_name = "Slowish Account"
         verbose_name_plural = "Slowish Accounts"
@@ -30,9 +214,9 @@ class SlowishUser(models.Model):
 
     Each SlowishUser is associated with a single SlowishAccount.
 
-    When a SlowishUser authenticates, a token will be generated for
-    the user, which can be passed as an HTTP_X_AUTH_TOKEN header to
-    authenticate various requests.
+    When a SlowishUser authenticates, a SlowishToken will be issued
+    to the user, which can be passed as an HTTP_X_AUTH_TOKEN header
+    to authenticate various requests.
     """
 
     account = models.ForeignKey(SlowishAccount, on_delete=models.CASCADE)
@@ -45,18 +229,137 @@ class SlowishUser(models.Model):
         help_text="Password associated with this username.",
         max_length=255)
 
+    class Meta:
+        verbose_name = "Slowish User"
+        verbose_name_plural = "Slowish Users"
+        unique_together = ('account', 'username')
+
+    def __unicode__(self):
+        return "{0} (in account {1})".format(self.username, self.account.id)
+
+    def issue_token(self):
+        """
+        Return a live SlowishToken for this user.
+
+        The user's newest token is handed out again until half of its
+        lifetime has passed, at which point a fresh token is issued,
+        (the older one remaining valid until it expires). Expired
+        tokens of all users are purged whenever a token is issued.
+        """
+        token = self.tokens.filter(
+            expires__gt=timezone.now() + token_lifetime() / 2).order_by(
+                '-expires').first()
+        if token is None:
+            SlowishToken.objects.purge_expired()
+            token = SlowishToken.objects.create(user=self)
+        return token
+
+
+class SlowishTokenQuerySet(models.QuerySet):
+
+    def live(self):
+        return self.filter(expires__gt=timezone.now())
+
+    def purge_expired(self):
+        """
+        Delete all expired tokens, returning the number deleted.
+
+        This is a single DELETE statement over the index on expires,
+        rather than the fetch of every row (to send delete signals)
+        that QuerySet.delete() would do. Expired tokens are never
+        accepted from the token cache, so nothing needs to be told.
+        """
+        connection = connections[self.db]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {0} WHERE {1} <= %s'.format(
+                    connection.ops.quote_name(SlowishToken._meta.db_table),
+                    connection.ops.quote_name('expires')),
+                [connection.ops.adapt_datetimefield_value(timezone.now())])
+            return cursor.rowcount
+
+
+class SlowishToken(models.Model):
+    """
+    A token authenticating a SlowishUser, until it expires.
+
+    A user may hold several live tokens at once.
+    """
+
+    user = models.ForeignKey(
+        SlowishUser,
+        related_name='tokens',
+        on_delete=models.CASCADE)
+
     token = models.CharField(
         help_text="Generated token to allow authorized uses of the API.",
         max_length=255,
+        unique=True,
         default=generate_token)
 
+    expires = models.DateTimeField(
+        help_text="Time after which this token is no longer accepted.",
+        db_index=True,
+        default=token_expiration)
+
+    objects = SlowishTokenQuerySet.as_manager()
+
     class Meta:
-        verbose_name = "Slowish User"
-        verbose_name_plural = "Slowish Users"
-        unique_together = ('account', 'username')
+        verbose_name = "Slowish Token"
+        verbose_name_plural = "Slowish Tokens"
 
     def __unicode__(self):
-        return "{0} (in account {1})".format(self.username, self.account.id)
+        return "token for {0} (expires {1})".format(self.user, self.expires)
+
+
+class SlowishContainerQuerySet(models.QuerySet):
+
+    def live(self):
+        return self.filter(deleted=False)
+
+    def get_or_insert(self, account, name):
+        """
+        Return a tuple of the named container in account, and whether it
+        was created, (in which case it is counted in the account).
+
+        Unlike get_or_create(), this never fails when a concurrent
+        request creates the same container: the insert that loses the
+        race does nothing, and the winner's container is returned.
+        """
+        while True:
+            try:
+                return (self.get(account=account, name=name), False)
+            except self.model.DoesNotExist:
+                pass
+
+            inserted = insert_new(
+                self.model, self.db,
+                [{"account_id": account.pk, "name": name,
+                  "object_count": 0, "bytes_used": 0, "deleted": False,
+                  "last_change": 0}],
+                unique=("account_id", "name"))
+            if inserted:
+                SlowishAccount.objects.filter(pk=account.pk).update(
+                    container_count=F('container_count') + 1)
+                return (self.model(pk=inserted[0], account=account, name=name),
+                        True)
+
+    def purge_deleted(self, batch_size=PURGE_BATCH_SIZE):
+        """
+        Remove the files of deleted containers, and then the containers.
+
+        Each batch of files is removed in a transaction of its own, so
+        no lock is held for long, however many files a container has.
+        Returns the number of files removed.
+        """
+        purged = 0
+        for container in self.filter(deleted=True):
+            while True:
+                count = container.purge_files(batch_size)
+                if count == 0:
+                    break
+                purged += count
+        return purged
 
 
 class SlowishContainer(models.Model):
@@ -68,6 +371,33 @@ class SlowishContainer(models.Model):
         help_text="A name for this container.",
         max_length=255)
 
+    object_count = models.BigIntegerField(
+        help_text="Number of files in this container.",
+        default=0)
+
+    bytes_used = models.BigIntegerField(
+        help_text="Total size of the files in this container.",
+        default=0)
+
+    deleted = models.BooleanField(
+        help_text="Whether this container has been deleted, (and its "
+        "files are waiting to be purged).",
+        default=False,
+        db_index=True)
+
+    metadata = models.TextField(
+        help_text="JSON object of the X-Container-Meta-* headers set on "
+        "this container, (keyed by the lower-cased name after the prefix).",
+        null=True,
+        blank=True)
+
+    last_change = models.BigIntegerField(
+        help_text="Number of the latest change to the files in this "
+        "container, (0 if there have been none).",
+        default=0)
+
+    objects = SlowishContainerQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Slowish Container"
         verbose_name_plural = "Slowish Containers"
@@ -76,6 +406,574 @@ class SlowishContainer(models.Model):
     def __unicode__(self):
         return "{0} (in account {1})".format(self.name, self.account.id)
 
+    def record_usage(self, objects, bytes, changes=()):
+        """
+        Adjust the counts of this container and its account, and record
+        changes to its files.
+
+        The changes argument is a list of (path, deleted) tuples, which
+        are numbered in sequence after the container's last change, (see
+        SlowishChange). The counts are applied as F() expressions in the
+        database, so concurrent updates are never lost. This must be
+        called within a transaction: the container's row stays locked
+        until it commits, so changes are committed in order of number.
+        """
+        changes = OrderedDict(changes)
+        if objects == 0 and bytes == 0 and not changes:
+            return
+
+        # Once a container is deleted, its counts have been taken off
+        # those of the account, so nothing more is added to them.
+        updated = update_returning(
+            SlowishContainer.objects.live().filter(pk=self.pk),
+            'last_change',
+            object_count=F('object_count') + objects,
+            bytes_used=F('bytes_used') + bytes,
+            last_change=F('last_change') + len(changes))
+        if not updated:
+            return
+
+        if objects != 0 or bytes != 0:
+            SlowishAccount.objects.filter(pk=self.account_id).update(
+                object_count=F('object_count') + objects,
+                bytes_used=F('bytes_used') + bytes)
+
+        if changes:
+            SlowishChange.objects.record(
+                self, changes.items(), updated[0] - len(changes) + 1)
+
+    def update_metadata(self, changes):
+        """
+        Merge changes into the metadata of this container.
+
+        A change with an empty value removes that item, (as in Swift).
+        The row is locked while the change is made, so concurrent
+        updates of different items are never lost. Raises DoesNotExist
+        if the container has been deleted.
+        """
+        if not changes:
+            return
+
+        with transaction.atomic():
+            containers = SlowishContainer.objects.live().filter(pk=self.pk)
+            metadata = load_metadata(
+                containers.select_for_update().values_list(
+                    'metadata', flat=True).get())
+            for (name, value) in changes.items():
+                if value:
+                    metadata[name] = value
+                else:
+                    metadata.pop(name, None)
+            self.metadata = dump_metadata(metadata)
+            containers.update(metadata=self.metadata)
+
+    def expire_files(self):
+        """
+        Delete the files of this container whose time to be deleted has
+        come, (rather than leaving them for the sweeper), returning how
+        many were deleted.
+
+        So the container's counts agree with its listings, which never
+        include such files.
+        """
+        files = SlowishFile.objects.filter(container=self)
+        if not files.filter(delete_at__lte=timezone.now()).exists():
+            return 0
+        return files.expire()
+
+    def delete_if_empty(self):
+        """
+        Delete this container unless it has files, (other than those
+        whose time to be deleted has come), returning whether it was
+        deleted.
+
+        Raises SlowishContainer.DoesNotExist if it has already gone.
+        """
+        self.expire_files()
+        with transaction.atomic():
+            SlowishContainer.objects.live().select_for_update().get(
+                pk=self.pk)
+            if SlowishFile.objects.filter(container=self).exists():
+                return False
+
+            SlowishContainer.objects.filter(pk=self.pk).delete()
+            SlowishAccount.objects.filter(pk=self.account_id).update(
+                container_count=F('container_count') - 1)
+
+        return True
+
+    def mark_deleted(self):
+        """
+        Delete this container and its files, as far as clients can tell.
+
+        The container is renamed out of the way, (so a new container can
+        take its name at once), and its counts are taken off those of
+        its account. Its files are left for purge_files() to remove.
+        Raises SlowishContainer.DoesNotExist if it has already gone.
+        """
+        with transaction.atomic():
+            container = SlowishContainer.objects.live().select_for_update(
+            ).get(pk=self.pk)
+
+            # No container created through the URLs has a "/" in its name
+            SlowishContainer.objects.filter(pk=self.pk).update(
+                deleted=True,
+                name='/deleted/{0}'.format(self.pk))
+            SlowishAccount.objects.filter(pk=self.account_id).update(
+                container_count=F('container_count') - 1,
+                object_count=F('object_count') - container.object_count,
+                bytes_used=F('bytes_used') - container.bytes_used)
+
+    def purge_files(self, batch_size=PURGE_BATCH_SIZE):
+        """
+        Remove up to batch_size files of this deleted container.
+
+        Returns the number of files removed. Once there are none left,
+        the container itself is removed.
+        """
+        with transaction.atomic():
+            files = list(SlowishFile.objects.select_for_update().filter(
+                container=self).order_by('pk').values_list(
+                    'pk', 'blob_id')[:batch_size])
+            if not files:
+                SlowishContainer.objects.filter(pk=self.pk).delete()
+                return 0
+
+            SlowishFile.objects.filter(
+                pk__in=[pk for (pk, blob_id) in files]).delete()
+            SlowishBlob.objects.release(Counter(
+                blob_id for (pk, blob_id) in files if blob_id is not None))
+
+        return len(files)
+
+    def store_files(self, files, attributes=None):
+        """
+        Store new contents for files, returning whether each was created.
+
+        The files argument is a list of (path, temporary, etag, size)
+        tuples, of contents written by blobs.write_temporary(). Other
+        fields of the files are set from attributes, (as for
+        SlowishFile.objects.store()).
+        """
+        contents = {}
+        for (path, temporary, etag, size) in files:
+            contents[etag] = (size, contents.get(etag, (size, 0))[1] + 1)
+        acquired = SlowishBlob.objects.acquire(contents)
+
+        try:
+            for (path, temporary, etag, size) in files:
+                blobs.commit_temporary(temporary, etag)
+        except Exception:
+            for (path, temporary, etag, size) in files:
+                blobs.discard_temporary(temporary)
+            SlowishBlob.objects.release(dict(
+                (acquired[etag].pk, count)
+                for (etag, (size, count)) in contents.items()))
+            raise
+
+        return self.store_blobs([
+            (path, acquired[etag])
+            for (path, temporary, etag, size) in files], attributes)
+
+    def store_blobs(self, files, attributes=None):
+        """
+        Make blobs the contents of files, returning whether each was
+        created.
+
+        The files argument is a list of (path, blob) tuples, with a
+        reference to each blob already committed, (which is released
+        again if the files can't be stored). Taking the references
+        first means the rows locked here are always taken in the order
+        file, blob, container, account, (as when deleting files), and
+        concurrent requests can't deadlock.
+        """
+        try:
+            with transaction.atomic():
+                stored = SlowishFile.objects.store(self, files, attributes)
+
+                SlowishBlob.objects.release(Counter(
+                    blob_id for (created, blob_id, size) in stored
+                    if blob_id is not None))
+
+                self.record_usage(
+                    sum(created for (created, blob_id, size) in stored),
+                    sum(blob.bytes for (path, blob) in files) -
+                    sum(size for (created, blob_id, size) in stored),
+                    [(path, False) for (path, blob) in files])
+        except Exception:
+            SlowishBlob.objects.release(Counter(
+                blob.pk for (path, blob) in files if blob.pk is not None))
+            raise
+
+        return [created for (created, blob_id, size) in stored]
+
+    def delete_files(self, paths):
+        """
+        Delete the files at the given paths, returning how many existed.
+
+        However many paths there are, the files are deleted with a
+        single DELETE statement, and the references to their blobs and
+        the counters are then adjusted with one statement each.
+        """
+        with transaction.atomic():
+            files = list(SlowishFile.objects.live().select_for_update(
+            ).filter(
+                container=self,
+                path__in=paths).order_by('pk').values_list(
+                    'pk', 'path', 'blob_id', 'bytes'))
+            if not files:
+                return 0
+
+            # There is nothing to cascade to, or any signal receivers,
+            # so this doesn't fetch the rows again.
+            SlowishFile.objects.filter(
+                pk__in=[pk for (pk, path, blob_id, size) in files]).delete()
+
+            SlowishBlob.objects.release(Counter(
+                blob_id for (pk, path, blob_id, size) in files
+                if blob_id is not None))
+
+            self.record_usage(
+                -len(files),
+                -sum(size for (pk, path, blob_id, size) in files),
+                [(path, True) for (pk, path, blob_id, size) in files])
+
+        return len(files)
+
+
+class SlowishBlobQuerySet(models.QuerySet):
+
+    def acquire(self, contents):
+        """
+        Add references to blobs, returning them keyed by etag.
+
+        The contents argument maps the etag of each blob to a tuple of
+        its size and the number of references to add. Blobs are created
+        if no file references them yet. On PostgreSQL this is a single
+        INSERT ... ON CONFLICT DO UPDATE statement. Once the references
+        are committed, the blobs can't be released (and their content
+        removed) until they are released again.
+        """
+        connection = connections[self.db]
+        if connection.vendor != 'postgresql':
+            acquired = {}
+            for (etag, (size, count)) in contents.items():
+                (blob, created) = self.select_for_update().get_or_create(
+                    etag=etag,
+                    defaults={"bytes": size, "refs": count})
+                if not created:
+                    self.filter(pk=blob.pk).update(refs=F('refs') + count)
+                    blob.refs += count
+                acquired[etag] = blob
+            return acquired
+
+        # The rows are listed in order of etag, (and so locked in that
+        # order), to avoid deadlocks between concurrent statements.
+        params = []
+        for etag in sorted(contents):
+            params.extend([etag, contents[etag][0], contents[etag][1]])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {0} (etag, bytes, refs) VALUES {1} '
+                'ON CONFLICT (etag) DO UPDATE '
+                'SET refs = {0}.refs + EXCLUDED.refs '
+                'RETURNING id, etag, bytes, refs'.format(
+                    connection.ops.quote_name(self.model._meta.db_table),
+                    ', '.join(['(%s, %s, %s)'] * len(contents))),
+                params)
+            return dict(
+                (etag, self.model(pk=pk, etag=etag, bytes=size, refs=refs))
+                for (pk, etag, size, refs) in cursor.fetchall())
+
+    def share(self, pk):
+        """
+        Add a reference to an existing blob.
+
+        Returns False if the blob has been released (or is about to be)
+        by the time it is found, in which case it must not be used.
+        """
+        return self.filter(pk=pk, refs__gt=0).update(refs=F('refs') + 1) > 0
+
+    def release(self, references):
+        """
+        Drop references to blobs, removing any that are no longer used.
+
+        The references argument maps blob IDs to the number of
+        references being dropped from each blob. The counts are
+        updated with a single statement. Blobs left without references
+        are kept, (with none), until the transaction commits, and then
+        deleted by remove_unused() along with their content.
+        """
+        if not references:
+            return
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            blobs_queryset = self.filter(pk__in=references)
+
+            # Lock the rows, (in a consistent order to avoid deadlocks
+            # between concurrent releases), before updating them. A
+            # single row is locked by the update itself.
+            if len(references) > 1:
+                list(blobs_queryset.select_for_update().order_by(
+                    'pk').values_list('pk', flat=True))
+
+            blobs_queryset.update(refs=Case(
+                *[When(pk=pk, then=F('refs') - count)
+                  for (pk, count) in references.items()]))
+
+            etags = list(blobs_queryset.filter(refs__lte=0).values_list(
+                'etag', flat=True))
+            if etags:
+                # (A rollback would leave them in use)
+                transaction.on_commit(
+                    lambda: self.remove_unused(etags), using=self.db)
+
+    def remove_unused(self, etags):
+        """
+        Delete the blobs with the given etags that have no references,
+        along with their content.
+
+        Each row is locked, and its content removed before its deletion
+        is committed. So an acquire() of the blob in the meantime either
+        comes first, (and the blob is kept), or waits for the deletion,
+        and then creates the blob afresh, before storing its content.
+        """
+        with transaction.atomic(using=self.db):
+            unused = list(self.select_for_update().filter(
+                etag__in=etags, refs__lte=0).order_by('pk').values_list(
+                    'pk', 'etag'))
+            if not unused:
+                return
+
+            # No file refers to an unused blob, so there's no need for
+            # QuerySet.delete() to look for any first.
+            connection = connections[self.db]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'DELETE FROM {0} WHERE {1} IN ({2})'.format(
+                        connection.ops.quote_name(self.model._meta.db_table),
+                        connection.ops.quote_name('id'),
+                        ', '.join(['%s'] * len(unused))),
+                    [pk for (pk, etag) in unused])
+
+            for (pk, etag) in unused:
+                blobs.remove(etag)
+
+
+class SlowishBlob(models.Model):
+    """
+    The content of one or more files, as held in the blob store.
+
+    Files with identical content share a single blob, which is deleted
+    once no file refers to it, (when the release of the last reference
+    to it commits, until which it is kept without any).
+    """
+
+    etag = models.CharField(
+        help_text="MD5 digest of the content, (which names it on disk).",
+        max_length=32,
+        unique=True)
+
+    bytes = models.BigIntegerField(
+        help_text="Size of the content.")
+
+    refs = models.PositiveIntegerField(
+        help_text="Number of files with this content.")
+
+    objects = SlowishBlobQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Slowish Blob"
+        verbose_name_plural = "Slowish Blobs"
+
+    def __unicode__(self):
+        return "{0} ({1} bytes)".format(self.etag, self.bytes)
+
+
+class SlowishFileQuerySet(models.QuerySet):
+
+    def live(self):
+        return self.filter(
+            Q(delete_at__isnull=True) | Q(delete_at__gt=timezone.now()))
+
+    def with_prefix(self, prefix):
+        """
+        Narrow to files whose paths start with prefix.
+
+        This is a range of paths, (from the prefix up to the prefix with
+        its last character incremented), rather than a LIKE, so that it
+        is a range scan of the (container, path) index. That relies on
+        paths being compared by code point, (see migration 0011).
+        """
+        queryset = self.filter(path__gte=prefix)
+
+        # A final character that can't be incremented is dropped, (as
+        # every path starting with the rest is then past the prefix).
+        end = prefix.rstrip(six.unichr(sys.maxunicode))
+        if end:
+            queryset = queryset.filter(
+                path__lt=end[:-1] + six.unichr(ord(end[-1]) + 1))
+        return queryset
+
+    def store(self, container, files, attributes=None):
+        """
+        Make blobs the contents of files in container.
+
+        The files argument is a list of (path, blob) tuples. The other
+        FILE_ATTRIBUTES of the files are set from the attributes dict,
+        (or reset to their defaults if it doesn't have them, as a PUT
+        does in Swift). Files that don't exist are created, with a
+        single statement on PostgreSQL, and the rest are then updated
+        one by one. Returns a list of tuples for the files of whether
+        each was created, and the ID of the blob and the size it had
+        before, (to be released and accounted for by the caller). This
+        must be called within a transaction, which holds a lock on the
+        files until it commits.
+        """
+        changes = dict(FILE_ATTRIBUTES, last_modified=timezone.now())
+        changes.update(attributes or {})
+        inserted = set(insert_new(
+            self.model, self.db,
+            [dict(changes, container_id=container.pk, path=path,
+                  blob_id=blob.pk, bytes=blob.bytes)
+             for (path, blob) in files],
+            unique=("container_id", "path"),
+            returning="path"))
+
+        stored = [None] * len(files)
+        for (i, (path, blob)) in enumerate(files):
+            if path in inserted:
+                inserted.remove(path)
+                stored[i] = (True, None, 0)
+
+        # Existing files are locked in order of path, to avoid deadlocks
+        # between concurrent requests.
+        existing = [i for i in range(len(files)) if stored[i] is None]
+        for i in sorted(existing, key=lambda i: files[i][0]):
+            (path, blob) = files[i]
+            stored[i] = self.replace(container, path, blob, changes)
+
+        return stored
+
+    def replace(self, container, path, blob, changes):
+        while True:
+            files = self.filter(container=container, path=path)
+            previous = list(files.select_for_update().values_list(
+                'blob_id', 'bytes'))
+            if previous:
+                files.update(blob=blob, bytes=blob.bytes, **changes)
+                return (False,) + previous[0]
+
+            # The file was deleted since it was found to exist
+            if insert_new(
+                    self.model, self.db,
+                    [dict(changes, container_id=container.pk, path=path,
+                          blob_id=blob.pk, bytes=blob.bytes)],
+                    unique=("container_id", "path")):
+                return (True, None, 0)
+
+    def expire(self, batch_size=PURGE_BATCH_SIZE):
+        """
+        Delete the files whose time to be deleted has come.
+
+        The files are found by walking the index on delete_at, (so this
+        takes time in proportion to the number of them, rather than to
+        the number of all files), and are deleted batch_size at a time,
+        each batch in a transaction of its own. Returns the number of
+        files deleted.
+        """
+        expired = 0
+        while True:
+            count = self.expire_batch(batch_size)
+            expired += count
+            if count < batch_size:
+                return expired
+
+    def expire_batch(self, batch_size):
+        with transaction.atomic(using=self.db):
+            # Files locked by a request are left for the next sweep,
+            # rather than waited for.
+            files = list(self.select_for_update(skip_locked=True).filter(
+                delete_at__lte=timezone.now()).order_by(
+                    'delete_at').values_list(
+                        'pk', 'container_id', 'path', 'blob_id',
+                        'bytes')[:batch_size])
+            if not files:
+                return 0
+
+            self.filter(pk__in=[pk for (pk, container_id, path, blob_id, size)
+                                in files]).delete()
+            SlowishBlob.objects.release(Counter(
+                blob_id for (pk, container_id, path, blob_id, size) in files
+                if blob_id is not None))
+
+            usage = {}
+            for (pk, container_id, path, blob_id, size) in files:
+                (objects, bytes, paths) = usage.get(container_id, (0, 0, []))
+                usage[container_id] = (
+                    objects + 1, bytes + size, paths + [(path, True)])
+            for container in SlowishContainer.objects.filter(
+                    pk__in=usage).order_by('pk').only('pk', 'account_id'):
+                (objects, bytes, changes) = usage[container.pk]
+                container.record_usage(-objects, -bytes, changes)
+
+        return len(files)
+
+
+class SlowishChangeQuerySet(models.QuerySet):
+
+    def record(self, container, changes, first):
+        """
+        Record changes to the files of container, numbered from first.
+
+        The changes argument is a sequence of (path, deleted) tuples,
+        with no path given twice. Any earlier change to one of the
+        paths is replaced. This is called by record_usage(), with the
+        container's row locked.
+        """
+        upsert(
+            self.model, self.db,
+            [{"container_id": container.pk, "path": path,
+              "change": first + i, "deleted": deleted}
+             for (i, (path, deleted)) in enumerate(changes)],
+            unique=("container_id", "path"))
+
+
+class SlowishChange(models.Model):
+    """
+    The latest change to a path in a container, for its changes feed.
+
+    Changes are numbered in sequence within each container, so a client
+    which has seen every change up to some number can list just those
+    since. Only the latest change to each path is kept, (so a deleted
+    file leaves a tombstone until its path is used again).
+    """
+
+    container = models.ForeignKey(SlowishContainer, on_delete=models.CASCADE)
+
+    path = models.CharField(
+        help_text="Path of the file that was changed.",
+        max_length=1024)
+
+    change = models.BigIntegerField(
+        help_text="Number of this change, (within the container).")
+
+    deleted = models.BooleanField(
+        help_text="Whether the change deleted the file, (rather than "
+        "storing it).",
+        default=False)
+
+    objects = SlowishChangeQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Slowish Change"
+        verbose_name_plural = "Slowish Changes"
+        unique_together = (('container', 'path'), ('container', 'change'))
+
+    def __unicode__(self):
+        return "change {0} to {1} (in container {2})".format(
+            self.change, self.path, self.container)
+
 
 class SlowishFile(models.Model):
     """A file, (within a particular container)."""
@@ -88,6 +986,54 @@ class SlowishFile(models.Model):
         help_text="Complete path of this file (within the container).",
         max_length=1024)
 
+    blob = models.ForeignKey(
+        SlowishBlob,
+        help_text="Content of this file, (if not empty).",
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT)
+
+    bytes = models.BigIntegerField(
+        help_text="Size of the content of this file.",
+        default=0)
+
+    last_modified = models.DateTimeField(
+        help_text="Time at which the content of this file was stored.",
+        default=timezone.now)
+
+    delete_at = models.DateTimeField(
+        help_text="Time at which this file expires, (if ever).",
+        null=True,
+        blank=True,
+        db_index=True)
+
+    dynamic_manifest = models.CharField(
+        help_text="The container/prefix of the segments, if this file is "
+        "the manifest of a dynamic large object.",
+        max_length=1280,
+        null=True,
+        blank=True)
+
+    static_manifest = models.TextField(
+        help_text="JSON list of the segments, if this file is the "
+        "manifest of a static large object.",
+        null=True,
+        blank=True)
+
+    content_type = models.CharField(
+        help_text="Content-Type given when this file was stored, (if any).",
+        max_length=256,
+        null=True,
+        blank=True)
+
+    metadata = models.TextField(
+        help_text="JSON object of the X-Object-Meta-* headers set on "
+        "this file, (keyed by the lower-cased name after the prefix).",
+        null=True,
+        blank=True)
+
+    objects = SlowishFileQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Slowish File"
         verbose_name_plural = "Slowish Files"
@@ -95,3 +1041,9 @@ class SlowishFile(models.Model):
 
     def __unicode__(self):
         return "{0} (in container {1})".format(self.path, self.container)
+
+    @property
+    def etag(self):
+        if self.blob_id is None:
+            return blobs.EMPTY_ETAG
+        return self.blob.etag
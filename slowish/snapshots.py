@@ -0,0 +1,395 @@
+"""
+Snapshots of the whole of Slowish's state, to be restored at once.
+
+A snapshot is a gzipped stream. Each model's rows are written after a
+line of JSON naming the model and its columns, in the text format of
+PostgreSQL's COPY, (a line per row, with tab-separated values), and
+ended by a line of "\\.". Then the content of each blob in use follows
+a line of JSON giving its etag and size, as raw bytes.
+
+On PostgreSQL, rows are dumped with COPY TO and restored with COPY
+FROM, so they are streamed straight between the database and the
+snapshot. Elsewhere they are read through the ORM, and restored with
+bulk_create() in batches of SNAPSHOT_BATCH_SIZE. Restoring a snapshot
+replaces every Slowish row in a single transaction. Once that commits,
+the process's caches of listings and tokens are cleared, (as the rows
+they were read from are gone), and the contents of blobs that only the
+replaced files used are removed.
+"""
+import gzip
+from itertools import islice
+import json
+import os
+import re
+
+from django.core.handlers.wsgi import LimitedStream
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.utils import six
+
+from . import blobs, engines, listing_cache
+from .auth import credentials_cache, token_cache
+from .models import SlowishAccount, SlowishUser, SlowishToken
+from .models import SlowishContainer, SlowishBlob, SlowishFile, SlowishChange
+
+# The models in a snapshot, (in the order they are restored, each after
+# those it refers to).
+SNAPSHOT_MODELS = [SlowishAccount, SlowishUser, SlowishToken,
+                   SlowishContainer, SlowishBlob, SlowishFile, SlowishChange]
+
+# Number of rows inserted by each bulk_create(), (on other databases
+# than PostgreSQL).
+SNAPSHOT_BATCH_SIZE = 10000
+
+# Number of replaced blobs whose use is checked by each query, after a
+# restore, (within SQLite's limit on the parameters of a query).
+RESTORE_BLOB_BATCH_SIZE = 500
+
+# The line that ends the rows of each model.
+END_OF_ROWS = b'\\.\n'
+
+# Characters escaped in COPY's text format, (besides the backslash).
+COPY_ESCAPES = {u'\b': u'b', u'\f': u'f', u'\n': u'n', u'\r': u'r',
+                u'\t': u't', u'\v': u'v'}
+COPY_UNESCAPES = dict((v, k) for (k, v) in COPY_ESCAPES.items())
+COPY_ESCAPED = re.compile(u'[\\\\\b\f\n\r\t\v]')
+COPY_ESCAPE = re.compile(u'\\\\(.)')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def model_columns(model):
+    return [field.column for field in model._meta.concrete_fields]
+
+
+def copy_text(value):
+    """Return value as a field of COPY's text format."""
+    if value is None:
+        return u'\\N'
+    return COPY_ESCAPED.sub(
+        lambda match: u'\\' + COPY_ESCAPES.get(match.group(), u'\\'),
+        six.text_type(value))
+
+
+def copy_line(row):
+    """Return a tuple of values as a line of COPY's text format."""
+    return u'\t'.join(copy_text(value) for value in row).encode(
+        'utf-8') + b'\n'
+
+
+def copy_value(text):
+    """Return the value of a field of COPY's text format."""
+    if text == u'\\N':
+        return None
+    return COPY_ESCAPE.sub(
+        lambda match: COPY_UNESCAPES.get(match.group(1), match.group(1)),
+        text)
+
+
+def write_header(stream, header):
+    stream.write(json.dumps(header).encode('utf-8'))
+    stream.write(b'\n')
+
+
+def dump_rows(connection, model, columns, stream):
+    """Write the rows of model to stream, returning how many there were."""
+    if connection.vendor == 'postgresql':
+        quote_name = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            # (The cursor of the database driver, psycopg2's, does COPY)
+            cursor.cursor.copy_expert(
+                'COPY (SELECT {0} FROM {1} ORDER BY {2}) TO STDOUT'.format(
+                    ', '.join(quote_name(column) for column in columns),
+                    quote_name(model._meta.db_table),
+                    quote_name(model._meta.pk.column)),
+                stream)
+            return cursor.cursor.rowcount
+
+    rows = 0
+    names = [field.attname for field in model._meta.concrete_fields]
+    for row in model.objects.using(connection.alias).order_by(
+            'pk').values_list(*names).iterator():
+        stream.write(copy_line(row))
+        rows += 1
+    return rows
+
+
+def dump_content(stream, etag, size):
+    """Write the content of the blob for etag to stream."""
+    with blobs.open_blob(etag) as content:
+        while size > 0:
+            chunk = content.read(min(size, blobs.BLOB_CHUNK_SIZE))
+            if not chunk:
+                raise SnapshotError(
+                    "Blob {0} is shorter than expected".format(etag))
+            stream.write(chunk)
+            size -= len(chunk)
+
+
+def dump_snapshot(path, using='default'):
+    """
+    Write a snapshot of the database's Slowish state to path.
+
+    Returns the number of rows written. On PostgreSQL, every row is
+    read in one REPEATABLE READ transaction, (unless one has already
+    begun), so the snapshot is consistent even while requests are
+    being served.
+    """
+    connection = connections[using]
+    repeatable = (connection.vendor == 'postgresql' and
+                  not connection.in_atomic_block)
+    rows = 0
+    # (Compressing quickly takes a fraction of the time of the default)
+    with transaction.atomic(using=using), gzip.open(
+            path, 'wb', compresslevel=1) as stream:
+        if repeatable:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+
+        for model in SNAPSHOT_MODELS:
+            columns = model_columns(model)
+            write_header(stream, {"model": model._meta.label_lower,
+                                  "columns": columns})
+            rows += dump_rows(connection, model, columns, stream)
+            stream.write(END_OF_ROWS)
+
+        blobs_in_use = SlowishBlob.objects.using(using).filter(
+            refs__gt=0, bytes__gt=0).order_by('pk')
+        for (etag, size) in blobs_in_use.values_list(
+                'etag', 'bytes').iterator():
+            write_header(stream, {"blob": etag, "bytes": size})
+            dump_content(stream, etag, size)
+    return rows
+
+
+class SnapshotRows(object):
+    """
+    A file of the rows of one model in a snapshot, (for COPY FROM),
+    which ends at the END_OF_ROWS line.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.rows = 0
+        self.ended = False
+
+    def readline(self):
+        if self.ended:
+            return b''
+        line = self.stream.readline()
+        if not line.endswith(b'\n'):
+            raise SnapshotError("Snapshot is truncated")
+        if line == END_OF_ROWS:
+            self.ended = True
+            return b''
+        self.rows += 1
+        return line
+
+    def read(self, size=-1):
+        lines = []
+        length = 0
+        while size < 0 or length < size:
+            line = self.readline()
+            if not line:
+                break
+            lines.append(line)
+            length += len(line)
+        return b''.join(lines)
+
+
+class CopyRows(object):
+    """A file of tuples of values in COPY's text format, (for COPY FROM)."""
+
+    def __init__(self, rows):
+        self.lines = (copy_line(row) for row in rows)
+        self.rows = 0
+
+    def read(self, size=-1):
+        lines = []
+        length = 0
+        for line in self.lines:
+            lines.append(line)
+            length += len(line)
+            self.rows += 1
+            if 0 <= size <= length:
+                break
+        return b''.join(lines)
+
+
+def insert_rows(connection, model, names, rows):
+    """
+    Insert rows into the table of model, returning how many there were.
+
+    The rows are tuples of the values of the fields in names, which
+    are read from any iterable, (so only a batch of them need be held
+    in memory at once). On PostgreSQL they are inserted with COPY FROM,
+    and elsewhere with bulk_create().
+    """
+    if connection.vendor == 'postgresql':
+        quote_name = connection.ops.quote_name
+        data = CopyRows(rows)
+        with connection.cursor() as cursor:
+            cursor.cursor.copy_expert(
+                'COPY {0} ({1}) FROM STDIN'.format(
+                    quote_name(model._meta.db_table),
+                    ', '.join(quote_name(model._meta.get_field(name).column)
+                              for name in names)),
+                data)
+        return data.rows
+
+    inserted = 0
+    rows = iter(rows)
+    while True:
+        batch = [model(**dict(zip(names, row)))
+                 for row in islice(rows, SNAPSHOT_BATCH_SIZE)]
+        if not batch:
+            return inserted
+        model.objects.using(connection.alias).bulk_create(batch)
+        inserted += len(batch)
+
+
+def restore_rows(connection, model, columns, rows):
+    """Load the rows of model from rows, (a SnapshotRows)."""
+    if connection.vendor == 'postgresql':
+        quote_name = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.cursor.copy_expert(
+                'COPY {0} ({1}) FROM STDIN'.format(
+                    quote_name(model._meta.db_table),
+                    ', '.join(quote_name(column) for column in columns)),
+                rows)
+        return
+
+    fields = model._meta.concrete_fields
+    values = (
+        [field.to_python(copy_value(value)) for (field, value) in zip(
+            fields, line.decode('utf-8')[:-1].split(u'\t'))]
+        for line in iter(rows.readline, b''))
+    insert_rows(
+        connection, model, [field.attname for field in fields], values)
+
+
+def restore_content(stream, etag, size):
+    """Store the next size bytes of stream as the blob for etag."""
+    content = LimitedStream(stream, size)
+    if os.path.exists(blobs.blob_path(etag)):
+        # (Blobs are named by their content, so this is the same)
+        while content.read(blobs.BLOB_CHUNK_SIZE):
+            pass
+        return
+
+    (temporary, actual_etag, actual_size) = blobs.write_temporary(content)
+    if (actual_etag, actual_size) != (etag, size):
+        blobs.discard_temporary(temporary)
+        raise SnapshotError("Blob {0} is corrupt".format(etag))
+    blobs.commit_temporary(temporary, etag)
+
+
+def delete_rows(connection):
+    """Delete every Slowish row."""
+    tables = [connection.ops.quote_name(model._meta.db_table)
+              for model in reversed(SNAPSHOT_MODELS)]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # (The checks of foreign keys that the transaction has left
+            # pending would otherwise refuse the TRUNCATE)
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute('TRUNCATE {0}'.format(', '.join(tables)))
+            cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+        else:
+            for table in tables:
+                cursor.execute('DELETE FROM {0}'.format(table))
+
+
+def keep_replaced(using, replaced):
+    """
+    Give each of the replaced blobs, (a list of their etags and sizes),
+    that was not restored a row without references, returning the
+    etags of every blob without any.
+
+    So the contents of the blobs no restored file uses are removed
+    through remove_unused(), as if their files had been deleted.
+    """
+    blob_objects = SlowishBlob.objects.using(using)
+    replaced = iter(replaced)
+    while True:
+        batch = list(islice(replaced, RESTORE_BLOB_BATCH_SIZE))
+        if not batch:
+            break
+        blob_objects.acquire(
+            dict((etag, (size, 0)) for (etag, size) in batch))
+    return list(blob_objects.filter(refs__lte=0).values_list(
+        'etag', flat=True))
+
+
+def clear_replaced(using, unused):
+    """
+    Clear what was cached of the state a restore replaced, and remove
+    the blobs with the etags in unused, (unless used again since).
+    """
+    listing_cache.invalidate_listings()
+    for engine in list(engines.engines.values()):
+        engine.clear()
+    token_cache.clear()
+    credentials_cache.clear()
+
+    unused = iter(unused)
+    while True:
+        batch = list(islice(unused, RESTORE_BLOB_BATCH_SIZE))
+        if not batch:
+            return
+        SlowishBlob.objects.using(using).remove_unused(batch)
+
+
+def restore_snapshot(path, using='default'):
+    """
+    Replace the database's Slowish state with the snapshot at path.
+
+    The contents of blobs are stored under SLOWISH_BLOB_ROOT, (where any
+    that are already there are kept), and once the restore commits,
+    those of the replaced blobs that are no longer used are removed,
+    and the process's caches are cleared. Returns the number of rows
+    restored. Raises SnapshotError, (after rolling back), if the
+    snapshot doesn't match the models, which must be migrated first.
+    """
+    connection = connections[using]
+    models = dict((model._meta.label_lower, model)
+                  for model in SNAPSHOT_MODELS)
+
+    restored = 0
+    with transaction.atomic(using=using), gzip.open(path, 'rb') as stream:
+        replaced = list(SlowishBlob.objects.using(using).values_list(
+            'etag', 'bytes'))
+        delete_rows(connection)
+
+        for line in iter(stream.readline, b''):
+            header = json.loads(line.decode('utf-8'))
+            if "blob" in header:
+                restore_content(stream, header["blob"], header["bytes"])
+                continue
+
+            model = models.get(header["model"])
+            if model is None or header["columns"] != model_columns(model):
+                raise SnapshotError(
+                    "Snapshot of {0} doesn't match its model".format(
+                        header["model"]))
+            rows = SnapshotRows(stream)
+            restore_rows(connection, model, header["columns"], rows)
+            if not rows.ended:
+                raise SnapshotError(
+                    "Rows of {0} are malformed".format(header["model"]))
+            restored += rows.rows
+
+        # Start new rows' IDs after those restored
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                    no_style(), SNAPSHOT_MODELS):
+                cursor.execute(sql)
+
+        unused = keep_replaced(using, replaced)
+        transaction.on_commit(
+            lambda: clear_replaced(using, unused), using=using)
+    return restored
@@ -1,13 +1,32 @@
+import copy
+from datetime import timedelta
+import hashlib
 import json
-
+import os
+import shutil
+from StringIO import StringIO
+import tarfile
+import tempfile
+import threading
+import time
+from unittest import skip, skipUnless
+
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
 from django.core.urlresolvers import reverse
-from django.test import TestCase
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.test.client import Client
 from django.test.client import RequestFactory
 from django.http import Http404
+from django.utils import timezone
 
+from . import blobs, engines, listing_cache
+from .auth import credentials_cache, token_cache
 from .models import SlowishAccount, SlowishUser, SlowishContainer, SlowishFile
-from .views import account, container
+from .models import SlowishBlob, SlowishToken
+from .views import account, container, json_array_chunks
 
 
 user_data = {
@@ -21,6 +40,21 @@ user_data = {
 }
 
 
+def make_archive(files, mode='w'):
+    """Return the content of a tar archive holding the given files."""
+    content = StringIO()
+    archive = tarfile.open(fileobj=content, mode=mode)
+    for (name, data) in files:
+        info = tarfile.TarInfo(name)
+        if data is None:
+            info.type = tarfile.DIRTYPE
+        else:
+            info.size = len(data)
+        archive.addfile(info, StringIO(data))
+    archive.close()
+    return content.getvalue()
+
+
 def create_user():
     account = SlowishAccount.objects.create(
         id=user_data["auth"]["tenantId"])
@@ -30,10 +64,37 @@ def create_user():
         password=user_data["auth"]["passwordCredentials"]["password"])
 
 
+def streamed_content(response):
+    """Collect the content of a streamed (listing) response."""
+    return b''.join(response.streaming_content)
+
+
+def file_content(response):
+    """Collect the content of a FileResponse, closing its file."""
+
+    # Note: response.close() would also close the database connection,
+    # (as it signals that the request has finished).
+    content = b''.join(response.streaming_content)
+    response.file_to_stream.close()
+    return content
+
+
+def run_commit_hooks(using='default'):
+    """
+    Run the functions registered with transaction.on_commit(), (which a
+    TestCase never commits, so otherwise never runs).
+    """
+    conn = connections[using]
+    (hooks, conn.run_on_commit) = (conn.run_on_commit, [])
+    for (sids, func) in hooks:
+        func()
+
+
 class TokensViewTest(TestCase):
 
     def setUp(self):
         self.client = Client()
+        credentials_cache.clear()
 
     def test_tokens_invalid(self):
         """Verify that tokens view responds correctly to an invalid post."""
@@ -69,7 +130,11 @@ class TokensViewTest(TestCase):
         url = (content['access']['serviceCatalog'][0]
                ['endpoints'][0]['publicURL'])
         self.assertEquals(url, "http://testserver/slowish/files/1234")
-        self.assertEquals(content['access']['token']['id'], self.user.token)
+        token = self.user.tokens.get()
+        self.assertEquals(content['access']['token']['id'], token.token)
+        self.assertEquals(
+            content['access']['token']['expires'],
+            token.expires.strftime("%Y-%m-%dT%H:%M:%SZ"))
 
         # Try again, but this time with an invalid password, which
         # should yield an authorization failure
@@ -80,13 +145,34 @@ class TokensViewTest(TestCase):
             content_type="application/json")
         self.assertEquals(response.status_code, 401)
 
+    def test_tokens_cached(self):
+        """Verify that repeated authentication doesn't query the database."""
+
+        self.user = create_user()
+        data = json.dumps(user_data)
+        response = self.client.post(
+            reverse('tokens'), data, content_type="application/json")
+        self.assertEquals(response.status_code, 200)
+
+        with self.assertNumQueries(0):
+            cached = self.client.post(
+                reverse('tokens'), data, content_type="application/json")
+        self.assertJSONEqual(cached.content, json.loads(response.content))
+
+        # Changing the user's password means the old one no longer works
+        self.user.password = "changed"
+        self.user.save()
+        response = self.client.post(
+            reverse('tokens'), data, content_type="application/json")
+        self.assertEquals(response.status_code, 401)
+
     def test_tokens_with_tenant_name(self):
         """Verify that we can authenticate with a 'tenantName' entry."""
 
         self.user = create_user()
 
         # Drop the tenantId from the data
-        data = user_data.copy()
+        data = copy.deepcopy(user_data)
         del data["auth"]["tenantId"]
 
         # Ensure that we can't authenticate that way
@@ -107,11 +193,136 @@ class TokensViewTest(TestCase):
         self.assertEquals(response.status_code, 200)
 
 
+class BenchmarkCommandTest(TestCase):
+
+    def setUp(self):
+        # (Tokens issued by other tests were rolled back)
+        credentials_cache.clear()
+        token_cache.clear()
+
+    def test_benchmark(self):
+        """Verify that the benchmark command runs its scenarios."""
+
+        out = StringIO()
+        call_command('slowish_benchmark', 'tokens', requests=2, stdout=out)
+        self.assertTrue(out.getvalue().startswith("tokens: 2 requests in "))
+
+        # The benchmark account is deleted afterwards, unless kept
+        self.assertFalse(SlowishAccount.objects.filter(id=4321).exists())
+        call_command('slowish_benchmark', 'tokens', requests=2, keep=True,
+                     stdout=StringIO())
+        self.assertEquals(
+            SlowishUser.objects.get(account=4321).username,
+            "slowish_benchmark")
+
+    def test_benchmark_account_in_use(self):
+        """Verify that the benchmark won't use another's account."""
+
+        SlowishAccount.objects.create(id=4321)
+        with self.assertRaises(CommandError):
+            call_command('slowish_benchmark', 'tokens', requests=2,
+                         stdout=StringIO())
+        self.assertTrue(SlowishAccount.objects.filter(id=4321).exists())
+
+    def test_benchmark_results(self):
+        """Verify that the benchmark writes its results as JSON."""
+
+        path = os.path.join(tempfile.mkdtemp(), 'results.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        blob_settings = override_settings(SLOWISH_BLOB_ROOT=os.path.dirname(
+            path))
+        blob_settings.enable()
+        self.addCleanup(blob_settings.disable)
+
+        scenarios = ['object_delete', 'object_get', 'object_put']
+        call_command('slowish_benchmark', *scenarios,
+                     requests=3, json=path, stdout=StringIO())
+        with open(path) as f:
+            results = json.load(f)["scenarios"]
+        self.assertEquals(sorted(results), scenarios)
+        for result in results.values():
+            self.assertEquals(result["requests"], 3)
+            self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+            self.assertGreater(result["queries_per_request"], 0)
+
+        # Later runs are compared with a baseline
+        out = StringIO()
+        call_command('slowish_benchmark', 'object_get',
+                     requests=3, baseline=path, stdout=out)
+        self.assertIn(" p95 on baseline", out.getvalue())
+        self.assertFalse(SlowishFile.objects.exists())
+
+        # (Where a baseline measured nothing, there's no change to give)
+        with open(path, 'w') as f:
+            json.dump({"scenarios": {"tokens": {
+                "requests_per_second": 0, "p95_ms": 0}}}, f)
+        out = StringIO()
+        call_command('slowish_benchmark', 'tokens',
+                     requests=3, baseline=path, stdout=out)
+        self.assertIn(", n/a requests/s and n/a p95 on baseline",
+                      out.getvalue())
+
+
+class TokenModelTest(TestCase):
+
+    def setUp(self):
+        self.user = create_user()
+
+    def test_issue_token(self):
+        """Verify that tokens are reused and then rotated."""
+
+        token = self.user.issue_token()
+        self.assertEquals(self.user.issue_token(), token)
+
+        # Once past half of its lifetime, a fresh token is issued, but
+        # the old one remains live
+        SlowishToken.objects.filter(pk=token.pk).update(
+            expires=timezone.now() + timedelta(minutes=1))
+        new_token = self.user.issue_token()
+        self.assertNotEquals(new_token, token)
+        self.assertEquals(self.user.tokens.live().count(), 2)
+
+        self.assertEquals(
+            str(new_token),
+            "token for user (in account 1234) (expires {0})".format(
+                new_token.expires))
+
+    def test_purge_expired(self):
+        """Verify that only expired tokens are purged."""
+
+        live = SlowishToken.objects.create(user=self.user)
+        SlowishToken.objects.create(
+            user=self.user,
+            expires=timezone.now() - timedelta(seconds=1))
+        SlowishToken.objects.create(
+            user=self.user,
+            expires=timezone.now() - timedelta(days=1))
+
+        out = StringIO()
+        call_command('slowish_purge_tokens', stdout=out)
+        self.assertEquals(out.getvalue(), "Deleted 2 expired tokens.\n")
+        self.assertEquals(list(SlowishToken.objects.all()), [live])
+
+
 class FilesViewTest(TestCase):
 
+    # Number of queries that list a container's files, (after the
+    # container itself is read).
+    listing_queries = 1
+
     def setUp(self):
         self.factory = RequestFactory()
         self.user = create_user()
+        self.token = self.user.issue_token().token
+        token_cache.clear()
+        engines.engines.clear()
+
+        # Keep the contents of files stored by each test apart
+        blob_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, blob_root)
+        blob_settings = override_settings(SLOWISH_BLOB_ROOT=blob_root)
+        blob_settings.enable()
+        self.addCleanup(blob_settings.disable)
 
     # The various files views are a little tricky to invoke. We would
     # like to just use self.client.get() but we can't because we need
@@ -132,16 +343,45 @@ class FilesViewTest(TestCase):
         if (use_invalid_token):
             request.META['HTTP_X_AUTH_TOKEN'] = 'bogus'
         else:
-            request.META['HTTP_X_AUTH_TOKEN'] = self.user.token
+            request.META['HTTP_X_AUTH_TOKEN'] = self.token
 
         return account(request, self.user.account.id)
 
+    def account_view_bulk_delete(self, body, **extra):
+        url = reverse('account', kwargs={'account_id': self.user.account.id})
+        request = self.factory.post(
+            url + '?bulk-delete', body, content_type='text/plain', **extra)
+        request.META['HTTP_X_AUTH_TOKEN'] = self.token
+        return account(request, self.user.account.id)
+
     def container_view_put(self, container_name):
         url = reverse('container',
                       kwargs={'account_id': self.user.account.id,
                               'container_name': container_name})
         request = self.factory.put(url)
-        request.META['HTTP_X_AUTH_TOKEN'] = self.user.token
+        request.META['HTTP_X_AUTH_TOKEN'] = self.token
+        return container(request, self.user.account.id, container_name)
+
+    def account_view_head(self):
+        request = self.factory.head(
+            reverse('account', kwargs={'account_id': self.user.account.id}))
+        request.META['HTTP_X_AUTH_TOKEN'] = self.token
+        return account(request, self.user.account.id)
+
+    def container_view_delete(self, container_name, query=''):
+        url = reverse('container',
+                      kwargs={'account_id': self.user.account.id,
+                              'container_name': container_name})
+        request = self.factory.delete(url + query)
+        request.META['HTTP_X_AUTH_TOKEN'] = self.token
+        return container(request, self.user.account.id, container_name)
+
+    def container_view_head(self, container_name):
+        request = self.factory.head(
+            reverse('container',
+                    kwargs={'account_id': self.user.account.id,
+                            'container_name': container_name}))
+        request.META['HTTP_X_AUTH_TOKEN'] = self.token
         return container(request, self.user.account.id, container_name)
 
     def container_view_get(self, container_name, use_invalid_token=False):
@@ -152,35 +392,77 @@ class FilesViewTest(TestCase):
         if (use_invalid_token):
             request.META['HTTP_X_AUTH_TOKEN'] = 'bogus'
         else:
-            request.META['HTTP_X_AUTH_TOKEN'] = self.user.token
+            request.META['HTTP_X_AUTH_TOKEN'] = self.token
         return container(request, self.user.account.id, container_name)
 
-    def file_view_put(self, container_name, path):
+    def file_view_put(self, container_name, path, data='', query='', **extra):
         url = reverse('file',
                       kwargs={'account_id': self.user.account.id,
                               'container_name': container_name,
                               'path': path})
-        request = self.factory.put(url)
-        request.META['HTTP_X_AUTH_TOKEN'] = self.user.token
+        request = self.factory.put(
+            url + query, data,
+            content_type='application/octet-stream', **extra)
+        request.META['HTTP_X_AUTH_TOKEN'] = self.token
+        return container(request, self.user.account.id, container_name, path)
+
+    def archive_view_put(self, container_name, path, data, archive_format,
+                         **extra):
+        url = reverse('file',
+                      kwargs={'account_id': self.user.account.id,
+                              'container_name': container_name,
+                              'path': path})
+        request = self.factory.put(
+            url + '?extract-archive=' + archive_format, data,
+            content_type='application/octet-stream', **extra)
+        request.META['HTTP_X_AUTH_TOKEN'] = self.token
+        return container(request, self.user.account.id, container_name, path)
+
+    def file_view_copy(self, container_name, path, destination):
+        url = reverse('file',
+                      kwargs={'account_id': self.user.account.id,
+                              'container_name': container_name,
+                              'path': path})
+        request = self.factory.generic(
+            'COPY', url, HTTP_DESTINATION=destination)
+        request.META['HTTP_X_AUTH_TOKEN'] = self.token
         return container(request, self.user.account.id, container_name, path)
 
-    def file_view_delete(self, container_name, path):
+    def file_view_head(self, container_name, path):
         url = reverse('file',
                       kwargs={'account_id': self.user.account.id,
                               'container_name': container_name,
                               'path': path})
-        request = self.factory.delete(url)
-        request.META['HTTP_X_AUTH_TOKEN'] = self.user.token
+        request = self.factory.head(url)
+        request.META['HTTP_X_AUTH_TOKEN'] = self.token
         return container(request, self.user.account.id, container_name, path)
 
-    def file_view_get(self, container_name, path='', query=''):
+    def file_view_post(self, container_name, path='', **extra):
+        url = reverse('file',
+                      kwargs={'account_id': self.user.account.id,
+                              'container_name': container_name,
+                              'path': path})
+        request = self.factory.post(url, **extra)
+        request.META['HTTP_X_AUTH_TOKEN'] = self.token
+        return container(request, self.user.account.id, container_name, path)
+
+    def file_view_delete(self, container_name, path, query=''):
+        url = reverse('file',
+                      kwargs={'account_id': self.user.account.id,
+                              'container_name': container_name,
+                              'path': path})
+        request = self.factory.delete(url + query)
+        request.META['HTTP_X_AUTH_TOKEN'] = self.token
+        return container(request, self.user.account.id, container_name, path)
+
+    def file_view_get(self, container_name, path='', query='', **extra):
         url = reverse('file',
                       kwargs={'account_id': self.user.account.id,
                               'container_name': container_name,
                               'path': path})
         url += query
-        request = self.factory.get(url)
-        request.META['HTTP_X_AUTH_TOKEN'] = self.user.token
+        request = self.factory.get(url, **extra)
+        request.META['HTTP_X_AUTH_TOKEN'] = self.token
         return container(request, self.user.account.id, container_name, path)
 
     def test_account_authorized(self):
@@ -193,7 +475,7 @@ class FilesViewTest(TestCase):
         # Then, try again with the correct token, which should work
         response = self.account_view_get()
         self.assertEquals(response.status_code, 200)
-        self.assertJSONEqual(response.content, "[]")
+        self.assertJSONEqual(streamed_content(response), "[]")
 
     def test_account_ordered(self):
         """Ensure that containers are listed in alphabetical order."""
@@ -205,7 +487,7 @@ class FilesViewTest(TestCase):
 
         response = self.account_view_get()
         self.assertJSONEqual(
-            response.content,
+            streamed_content(response),
             '[{"count": 0, "bytes": 0, "name": "bar"},'
             '{"count": 0, "bytes": 0, "name": "baz"},'
             '{"count": 0, "bytes": 0, "name": "foo"}]')
@@ -221,20 +503,20 @@ class FilesViewTest(TestCase):
 
         response = self.account_view_get(query="?marker=order")
         self.assertJSONEqual(
-            response.content,
+            streamed_content(response),
             '[{"count": 0, "bytes": 0, "name": "particular"},'
             '{"count": 0, "bytes": 0, "name": "this"}]')
 
         response = self.account_view_get(query="?end_marker=container")
         self.assertJSONEqual(
-            response.content,
+            streamed_content(response),
             '[{"count": 0, "bytes": 0, "name": "a"},'
             '{"count": 0, "bytes": 0, "name": "collection"}]')
 
         response = self.account_view_get(
             query="?marker=container&end_marker=names")
         self.assertJSONEqual(
-            response.content,
+            streamed_content(response),
             '[{"count": 0, "bytes": 0, "name": "in"},'
             '{"count": 0, "bytes": 0, "name": "is"}]')
 
@@ -243,7 +525,55 @@ class FilesViewTest(TestCase):
 
         # With no containers, we expect an empty list
         response = self.account_view_get()
-        self.assertJSONEqual(response.content, "[]")
+        self.assertJSONEqual(streamed_content(response), "[]")
+
+    def test_account_wrong_account(self):
+        """Verify that a token only grants access to its own account."""
+
+        other = SlowishAccount.objects.create(id=5678)
+        request = self.factory.get(
+            reverse('account', kwargs={'account_id': other.id}))
+        request.META['HTTP_X_AUTH_TOKEN'] = self.token
+        response = account(request, other.id)
+        self.assertEquals(response.status_code, 401)
+
+    def test_token_cached(self):
+        """Verify that an authenticated token is not looked up again."""
+
+        self.container_view_put('cached')
+        self.file_view_put('cached', 'file')
+
+        # Only the file (with its container) is queried, not the user
+        with self.assertNumQueries(1):
+            response = self.file_view_get('cached', 'file')
+        self.assertEquals(response.status_code, 200)
+
+    def test_token_cache_invalidated(self):
+        """Verify that changes to tokens are seen by the token cache."""
+
+        response = self.account_view_get()
+        self.assertEquals(response.status_code, 200)
+
+        # Once a token is deleted, it is no longer accepted
+        SlowishToken.objects.filter(token=self.token).delete()
+        response = self.account_view_get()
+        self.assertEquals(response.status_code, 401)
+
+        # Nor is any token for a user that has been deleted
+        self.token = self.user.issue_token().token
+        response = self.account_view_get()
+        self.assertEquals(response.status_code, 200)
+        self.user.delete()
+        response = self.account_view_get()
+        self.assertEquals(response.status_code, 401)
+
+    def test_token_expired(self):
+        """Verify that an expired token is not accepted."""
+
+        SlowishToken.objects.filter(token=self.token).update(
+            expires=timezone.now() - timedelta(seconds=1))
+        response = self.account_view_get()
+        self.assertEquals(response.status_code, 401)
 
     def test_container_authorized(self):
         """Verify that the container view requires a valid token."""
@@ -265,7 +595,7 @@ class FilesViewTest(TestCase):
 
         # Prior to creation, there shold be an empty list of containers
         response = self.account_view_get()
-        self.assertJSONEqual(response.content, "[]")
+        self.assertJSONEqual(streamed_content(response), "[]")
 
         # Issue a PUT request to create a new container (returns a
         # status of 201==Created)
@@ -280,7 +610,7 @@ class FilesViewTest(TestCase):
         # list of containers
         response = self.account_view_get()
         self.assertJSONEqual(
-            response.content,
+            streamed_content(response),
             '[{"count": 0, "bytes": 0, "name": "new_container"}]')
 
         # Test the __unicode__ method within SlowishContainer
@@ -316,7 +646,7 @@ class FilesViewTest(TestCase):
         response = self.file_view_get("container")
         self.assertEquals(response.status_code, 200)
         self.assertJSONEqual(
-            response.content,
+            streamed_content(response),
             '[{"bytes": 0, "content_type": "application/directory",'
             '"name": "and/yet/one/more"},'
             '{"bytes": 0, "content_type": "application/directory",'
@@ -340,7 +670,7 @@ class FilesViewTest(TestCase):
 
         response = self.file_view_get("blob", query="?marker=order")
         self.assertJSONEqual(
-            response.content,
+            streamed_content(response),
             '[{"bytes": 0, "content_type": "application/directory",'
             '"name": "particular"},'
             '{"bytes": 0, "content_type": "application/directory",'
@@ -348,7 +678,7 @@ class FilesViewTest(TestCase):
 
         response = self.file_view_get("blob", query="?end_marker=file")
         self.assertJSONEqual(
-            response.content,
+            streamed_content(response),
             '[{"bytes": 0, "content_type": "application/directory",'
             '"name": "a"},'
             '{"bytes": 0, "content_type": "application/directory",'
@@ -358,12 +688,74 @@ class FilesViewTest(TestCase):
             "blob",
             query="?marker=file&end_marker=names")
         self.assertJSONEqual(
-            response.content,
+            streamed_content(response),
             '[{"bytes": 0, "content_type": "application/directory",'
             '"name": "in"},'
             '{"bytes": 0, "content_type": "application/directory",'
             '"name": "is"}]')
 
+    def test_files_limit(self):
+        """Verify paging through files with limit and marker."""
+
+        container = SlowishContainer.objects.create(
+            account=self.user.account,
+            name="pages")
+        for name in ['a', 'b', 'c', 'd', 'e']:
+            SlowishFile.objects.create(container=container, path=name)
+
+        def names(response):
+            return [entry["name"]
+                    for entry in json.loads(streamed_content(response))]
+
+        response = self.file_view_get("pages", query="?limit=2")
+        self.assertEquals(names(response), ['a', 'b'])
+
+        response = self.file_view_get("pages", query="?limit=2&marker=b")
+        self.assertEquals(names(response), ['c', 'd'])
+
+        response = self.file_view_get("pages", query="?limit=2&marker=d")
+        self.assertEquals(names(response), ['e'])
+
+        response = self.file_view_get(
+            "pages", query="?limit=2&marker=a&end_marker=c")
+        self.assertEquals(names(response), ['b'])
+
+        # A limit which isn't a number is ignored
+        response = self.file_view_get("pages", query="?limit=many")
+        self.assertEquals(names(response), ['a', 'b', 'c', 'd', 'e'])
+
+    @override_settings(SLOWISH_LISTING_LIMIT=3)
+    def test_listing_limit_enforced(self):
+        """Verify that listings are capped at the maximum page size."""
+
+        container = SlowishContainer.objects.create(
+            account=self.user.account,
+            name="capped")
+        for name in ['a', 'b', 'c', 'd', 'e']:
+            SlowishFile.objects.create(container=container, path=name)
+            SlowishContainer.objects.create(
+                account=self.user.account,
+                name=name)
+
+        # Without a limit, we get a page of the maximum size
+        response = self.file_view_get("capped")
+        self.assertEquals(len(json.loads(streamed_content(response))), 3)
+        response = self.account_view_get()
+        self.assertEquals(len(json.loads(streamed_content(response))), 3)
+
+        # And asking for more than that is refused
+        response = self.file_view_get("capped", query="?limit=4")
+        self.assertEquals(response.status_code, 412)
+        response = self.account_view_get(query="?limit=4")
+        self.assertEquals(response.status_code, 412)
+
+        with self.settings(SLOWISH_LISTING_DEFAULT_LIMIT=1):
+            response = self.file_view_get("capped")
+            self.assertJSONEqual(
+                streamed_content(response),
+                '[{"bytes": 0, "content_type": "application/directory",'
+                '"name": "a"}]')
+
     def test_files_prefix(self):
         """Verify query of files matching a prefix."""
 
@@ -378,7 +770,7 @@ class FilesViewTest(TestCase):
         # List only those files matching a prefix
         response = self.file_view_get("container", query="?prefix=this/file")
         self.assertJSONEqual(
-            response.content,
+            streamed_content(response),
             '[{"bytes": 0, "content_type": "application/directory",'
             '"name": "this/file/is/made/for/you/and/me"},'
             '{"bytes": 0, "content_type": "application/directory",'
@@ -386,23 +778,845 @@ class FilesViewTest(TestCase):
             '{"bytes": 0, "content_type": "application/directory",'
             '"name": "this/file/is/your/file"}]')
 
-    # We don't yet support getting file contents, but we can at least
-    # ask about directory objects that we have stored as files within
-    # a container.
+    def test_files_prefix_range(self):
+        """Verify that a prefix matches exactly, (not as a pattern)."""
+
+        for path in [u"aB", u"ab", u"a%c", u"a_c", u"a\U0010ffffz", u"b"]:
+            self.file_view_put("container", path)
+
+        def names(prefix):
+            files = SlowishFile.objects.with_prefix(prefix).order_by('path')
+            return list(files.values_list('path', flat=True))
+
+        self.assertEquals(names(u"aB"), [u"aB"])
+        self.assertEquals(names(u"a%"), [u"a%c"])
+        self.assertEquals(names(u"a_"), [u"a_c"])
+        self.assertEquals(names(u"a\U0010ffff"), [u"a\U0010ffffz"])
+        self.assertEquals(names(u"a"), [u"a%c", u"aB", u"a_c", u"ab",
+                                        u"a\U0010ffffz"])
+
+    @skipUnless(connection.vendor == 'postgresql',
+                "Only PostgreSQL plans are checked")
+    def test_files_prefix_plan(self):
+        """Verify that a prefix listing is a range scan of the index."""
+
+        self.file_view_put("container", "this/file")
+        files = SlowishFile.objects.live().filter(
+            container=SlowishContainer.objects.get()).with_prefix("this/")
+        files = files.filter(path__gt="this/a").order_by('path')
+        files = files.values_list('path', 'bytes')[:100]
+
+        (sql, params) = files.query.sql_with_params()
+        with connection.cursor() as cursor:
+            # (A table this small would otherwise just be read through)
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("EXPLAIN " + sql, params)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+
+        self.assertIn("slowish_slowishfile_container_id_path", plan)
+        self.assertNotIn("Seq Scan", plan)
+        self.assertNotIn("Sort", plan)
+
+    def test_files_delimiter(self):
+        """Verify listing files rolled up into pseudo-directories."""
+
+        container = SlowishContainer.objects.create(
+            account=self.user.account,
+            name="tree")
+        # ('a0' sorts just after every path starting 'a/')
+        for path in ['a/1', 'a/2', 'a/b/3', 'a0', 'b', 'c/4', 'd/5']:
+            SlowishFile.objects.create(container=container, path=path)
+
+        def entries(query):
+            response = self.file_view_get("tree", query=query)
+            return [entry.get("subdir", entry.get("name"))
+                    for entry in json.loads(streamed_content(response))]
+
+        self.assertEquals(
+            entries("?delimiter=/"), ['a/', 'a0', 'b', 'c/', 'd/'])
+        self.assertEquals(
+            entries("?delimiter=/&prefix=a/"), ['a/1', 'a/2', 'a/b/'])
+
+        # Paging through with limit and marker
+        self.assertEquals(entries("?delimiter=/&limit=2"), ['a/', 'a0'])
+        self.assertEquals(
+            entries("?delimiter=/&limit=2&marker=a0"), ['b', 'c/'])
+        self.assertEquals(
+            entries("?delimiter=/&limit=2&marker=b"), ['c/', 'd/'])
+        self.assertEquals(
+            entries("?delimiter=/&marker=a/"), ['a0', 'b', 'c/', 'd/'])
+        self.assertEquals(
+            entries("?delimiter=/&end_marker=c/"), ['a/', 'a0', 'b'])
+        self.assertEquals(
+            entries("?delimiter=/&end_marker=c0"), ['a/', 'a0', 'b', 'c/'])
+
+        response = self.file_view_get("tree", query="?delimiter=//")
+        self.assertEquals(response.status_code, 412)
+
+    def test_files_delimiter_skips_subdirs(self):
+        """Verify that a subdir costs one query, however many files it has."""
+
+        container = SlowishContainer.objects.create(
+            account=self.user.account,
+            name="tree")
+        SlowishFile.objects.bulk_create(
+            SlowishFile(container=container, path='big/{0}'.format(i))
+            for i in range(100))
+        SlowishFile.objects.create(container=container, path='small')
+
+        # Authenticate and look up the container, then one query for
+        # each of the two entries, and a final query finding no more.
+        with self.assertNumQueries(5):
+            response = self.file_view_get("tree", query="?delimiter=/")
+            content = streamed_content(response)
+        self.assertJSONEqual(
+            content,
+            '[{"subdir": "big/"}, {"bytes": 0, "name": "small",'
+            '"content_type": "application/directory"}]')
+
+    # Directory objects are stored as empty files within a container,
+    # and are got like any other file.
     def test_directory_get(self):
         """Verify that a specific file in a container can be queried."""
 
         self.container_view_put('container')
         self.file_view_put('container', 'path/to/file')
 
-        # Verify file query returns successful status
+        # Verify file query returns successful status, and no content
         response = self.file_view_get("container", "path/to/file")
         self.assertEquals(response.status_code, 200)
+        self.assertEquals(response['Content-Length'], '0')
+        self.assertEquals(file_content(response), b'')
 
         # And a non-existent file should fail
         response = self.file_view_get("container", "does/not/exist")
         self.assertEquals(response.status_code, 404)
 
+    def test_file_content(self):
+        """Verify that the content of a file is stored and returned."""
+
+        etag = hashlib.md5(b'hello').hexdigest()
+
+        response = self.file_view_put('content', 'greeting', b'hello')
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(response['ETag'], etag)
+
+        response = self.file_view_get('content', 'greeting')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(file_content(response), b'hello')
+        self.assertEquals(response['Content-Length'], '5')
+        self.assertEquals(response['ETag'], etag)
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = self.file_view_get('content')
+        self.assertJSONEqual(
+            streamed_content(response),
+            '[{"bytes": 5, "content_type": "application/directory",'
+            '"name": "greeting"}]')
+
+        # A file without content has the etag of empty content
+        response = self.file_view_put('content', 'empty')
+        self.assertEquals(response['ETag'], blobs.EMPTY_ETAG)
+        SlowishFile.objects.filter(path='empty').update(blob=None)
+        response = self.file_view_get('content', 'empty')
+        self.assertEquals(file_content(response), b'')
+        self.assertEquals(response['ETag'], blobs.EMPTY_ETAG)
+
+    def test_file_etag_mismatch(self):
+        """Verify that content not matching a given ETag is refused."""
+
+        response = self.file_view_put(
+            'content', 'greeting', b'hello', HTTP_ETAG='"0123456789"')
+        self.assertEquals(response.status_code, 422)
+        self.assertFalse(SlowishFile.objects.filter(path='greeting').exists())
+
+        response = self.file_view_put(
+            'content', 'greeting', b'hello',
+            HTTP_ETAG=hashlib.md5(b'hello').hexdigest())
+        self.assertEquals(response.status_code, 201)
+
+    def test_file_content_shared(self):
+        """Verify that files with identical content share a blob."""
+
+        self.file_view_put('shared', 'one', b'same')
+        self.file_view_put('shared', 'two', b'same')
+
+        blob = SlowishBlob.objects.get()
+        self.assertEquals(blob.refs, 2)
+        self.assertEquals(str(blob), "{0} (4 bytes)".format(blob.etag))
+        path = blobs.blob_path(blob.etag)
+        self.assertTrue(os.path.exists(path))
+
+        # The content is kept until no file refers to it
+        self.file_view_delete('shared', 'one')
+        self.assertEquals(SlowishBlob.objects.get().refs, 1)
+        self.assertTrue(os.path.exists(path))
+
+        # And then removed, with its blob, once the delete commits
+        self.file_view_delete('shared', 'two')
+        self.assertEquals(SlowishBlob.objects.get().refs, 0)
+        self.assertTrue(os.path.exists(path))
+        run_commit_hooks()
+        self.assertFalse(SlowishBlob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_file_content_rollback(self):
+        """Verify that a release that is rolled back keeps the content."""
+
+        self.file_view_put('rollback', 'one', b'kept')
+        path = blobs.blob_path(SlowishBlob.objects.get().etag)
+
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.file_view_delete('rollback', 'one')
+                raise ValueError("Rolled back")
+        run_commit_hooks()
+        self.assertEquals(SlowishBlob.objects.get().refs, 1)
+        self.assertTrue(os.path.exists(path))
+
+    def test_file_content_acquired_again(self):
+        """Verify that content acquired before the commit is kept."""
+
+        self.file_view_put('again', 'one', b'same')
+        path = blobs.blob_path(SlowishBlob.objects.get().etag)
+
+        self.file_view_delete('again', 'one')
+        self.file_view_put('again', 'two', b'same')
+        run_commit_hooks()
+        self.assertEquals(SlowishBlob.objects.get().refs, 1)
+        self.assertTrue(os.path.exists(path))
+
+    def test_file_overwrite(self):
+        """Verify that storing a file again replaces its content."""
+
+        self.file_view_put('overwrite', 'file', b'old')
+        response = self.file_view_put('overwrite', 'file', b'newer')
+        self.assertEquals(response.status_code, 200)
+
+        run_commit_hooks()
+        blob = SlowishBlob.objects.get()
+        self.assertEquals(blob.etag, hashlib.md5(b'newer').hexdigest())
+        self.assertEquals(blob.refs, 1)
+
+        response = self.file_view_get('overwrite', 'file')
+        self.assertEquals(file_content(response), b'newer')
+
+    def test_file_copy(self):
+        """Verify that copies of a file share its content."""
+
+        self.file_view_put("originals", u"caf\xe9", b"content")
+
+        response = self.file_view_put(
+            "copies", "first", HTTP_X_COPY_FROM="/originals/caf%C3%A9")
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(
+            response['ETag'], hashlib.md5(b"content").hexdigest())
+        self.assertEquals(response['X-Copied-From'], "originals/caf%C3%A9")
+
+        response = self.file_view_copy(
+            "copies", "first", "copies/second")
+        self.assertEquals(response.status_code, 201)
+
+        # The original can go, and the copies still have its content
+        self.file_view_delete("originals", u"caf\xe9")
+        for path in ["first", "second"]:
+            response = self.file_view_get("copies", path)
+            self.assertEquals(file_content(response), b"content")
+
+        blob = SlowishBlob.objects.get()
+        self.assertEquals(blob.refs, 2)
+        copies = SlowishContainer.objects.get(name="copies")
+        self.assertEquals((copies.object_count, copies.bytes_used), (2, 14))
+
+        response = self.file_view_copy("copies", "missing", "copies/third")
+        self.assertEquals(response.status_code, 404)
+        response = self.file_view_copy("copies", "first", "no_path")
+        self.assertEquals(response.status_code, 412)
+
+    def test_file_expiry(self):
+        """Verify that files given an expiry time vanish at that time."""
+
+        response = self.file_view_put(
+            "scratch", "soon", b"short", HTTP_X_DELETE_AFTER="3600")
+        self.assertEquals(response.status_code, 201)
+        response = self.file_view_get("scratch", "soon")
+        self.assertAlmostEqual(
+            int(response['X-Delete-At']), time.time() + 3600, delta=60)
+        file_content(response)
+
+        self.file_view_put("scratch", "later", b"longer",
+                           HTTP_X_DELETE_AT=str(int(time.time()) + 3600))
+        self.file_view_put("scratch", "kept", b"kept")
+
+        for (header, value) in [("HTTP_X_DELETE_AT", "1"),
+                                ("HTTP_X_DELETE_AT", "soon"),
+                                ("HTTP_X_DELETE_AFTER", "-1")]:
+            response = self.file_view_put("scratch", "bad", **{header: value})
+            self.assertEquals(response.status_code, 400)
+
+        # Once their time has come, the files are hidden at once...
+        SlowishFile.objects.exclude(path="kept").update(
+            delete_at=timezone.now() - timedelta(seconds=1))
+        response = self.file_view_get("scratch", "soon")
+        self.assertEquals(response.status_code, 404)
+        response = self.file_view_get("scratch")
+        self.assertEquals(
+            [f["name"] for f in json.loads(streamed_content(response))],
+            ["kept"])
+
+        # ...and deleted by the sweeper
+        stdout = StringIO()
+        call_command('slowish_expire_files', batch_size=1, stdout=stdout)
+        self.assertEquals(stdout.getvalue(), "Deleted 2 expired files.\n")
+        self.assertEquals(
+            list(SlowishFile.objects.values_list('path', flat=True)),
+            ["kept"])
+        scratch = SlowishContainer.objects.get(name="scratch")
+        self.assertEquals((scratch.object_count, scratch.bytes_used), (1, 4))
+        run_commit_hooks()
+        self.assertEquals(SlowishBlob.objects.get().bytes, 4)
+
+    def test_container_expired_files(self):
+        """Verify that a container's expired files aren't counted."""
+
+        self.file_view_put(
+            "scratch", "soon", b"short", HTTP_X_DELETE_AFTER="3600")
+        SlowishFile.objects.update(
+            delete_at=timezone.now() - timedelta(seconds=1))
+
+        response = self.file_view_get("scratch")
+        self.assertEquals(json.loads(streamed_content(response)), [])
+        response = self.container_view_head("scratch")
+        self.assertEquals(response['X-Container-Object-Count'], '0')
+        self.assertEquals(response['X-Container-Bytes-Used'], '0')
+        self.assertFalse(SlowishFile.objects.exists())
+
+        # Nor do they keep it from being deleted
+        self.file_view_put(
+            "scratch", "later", b"short", HTTP_X_DELETE_AFTER="3600")
+        SlowishFile.objects.update(
+            delete_at=timezone.now() - timedelta(seconds=1))
+        response = self.container_view_delete("scratch")
+        self.assertEquals(response.status_code, 204)
+        self.assertFalse(
+            SlowishContainer.objects.filter(name="scratch").exists())
+
+    def test_file_metadata(self):
+        """Verify that a file's metadata is stored, and can be changed."""
+
+        self.file_view_put(
+            "meta", "file", b"content", CONTENT_TYPE="text/plain",
+            HTTP_X_OBJECT_META_COLOR="red",
+            HTTP_X_OBJECT_META_FAVOURITE_FOOD="pie")
+
+        # HEAD needs only the one query, and doesn't read the content
+        with self.assertNumQueries(1):
+            response = self.file_view_head("meta", "file")
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.content, b"")
+        self.assertEquals(response['Content-Length'], '7')
+        self.assertEquals(response['Content-Type'], "text/plain")
+        self.assertEquals(
+            response['ETag'], hashlib.md5(b"content").hexdigest())
+        self.assertEquals(response['X-Object-Meta-Color'], "red")
+        self.assertEquals(response['X-Object-Meta-Favourite-Food'], "pie")
+
+        # POST replaces the metadata, but not the content
+        response = self.file_view_post(
+            "meta", "file", HTTP_X_OBJECT_META_SIZE="large")
+        self.assertEquals(response.status_code, 202)
+        response = self.file_view_get("meta", "file")
+        self.assertEquals(file_content(response), b"content")
+        self.assertEquals(response['X-Object-Meta-Size'], "large")
+        self.assertFalse(response.has_header('X-Object-Meta-Color'))
+
+        # A copy keeps the metadata, (with any more given added)
+        self.file_view_put("meta", "copy", HTTP_X_COPY_FROM="meta/file",
+                           HTTP_X_OBJECT_META_COLOR="blue")
+        response = self.file_view_head("meta", "copy")
+        self.assertEquals(response['X-Object-Meta-Size'], "large")
+        self.assertEquals(response['X-Object-Meta-Color'], "blue")
+
+        # And storing new content resets it
+        self.file_view_put("meta", "file", b"other")
+        response = self.file_view_head("meta", "file")
+        self.assertFalse(response.has_header('X-Object-Meta-Size'))
+        self.assertEquals(response['Content-Type'], "application/octet-stream")
+
+        response = self.file_view_post("meta", "missing")
+        self.assertEquals(response.status_code, 404)
+        response = self.file_view_head("nowhere", "file")
+        self.assertEquals(response.status_code, 404)
+
+    def test_container_metadata(self):
+        """Verify that a container's metadata is merged with changes."""
+
+        self.file_view_put("meta", "file", b"content")
+        self.file_view_post("meta", HTTP_X_CONTAINER_META_OWNER="kirk",
+                            HTTP_X_CONTAINER_META_SHIP="enterprise")
+        response = self.file_view_post("meta", HTTP_X_CONTAINER_META_OWNER="")
+        self.assertEquals(response.status_code, 204)
+
+        response = self.container_view_head("meta")
+        self.assertEquals(response['X-Container-Object-Count'], '1')
+        self.assertEquals(response['X-Container-Bytes-Used'], '7')
+        self.assertEquals(response['X-Container-Meta-Ship'], "enterprise")
+        self.assertFalse(response.has_header('X-Container-Meta-Owner'))
+
+    def test_static_large_object(self):
+        """Verify that a static large object serves its segments' content."""
+
+        segments = [("first", b"0123"), ("second", b""), ("third", b"456789")]
+        for (path, data) in segments:
+            self.file_view_put("segments", path, data)
+        manifest = [{"path": "/segments/" + path,
+                     "etag": hashlib.md5(data).hexdigest(),
+                     "size_bytes": len(data)}
+                    for (path, data) in segments]
+
+        response = self.file_view_put(
+            "large", "object", json.dumps(manifest),
+            query="?multipart-manifest=put")
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(
+            response['ETag'],
+            hashlib.md5("".join(m["etag"] for m in manifest)).hexdigest())
+        large = SlowishContainer.objects.get(name="large")
+        self.assertEquals((large.object_count, large.bytes_used), (1, 10))
+
+        response = self.file_view_get("large", "object")
+        self.assertEquals(response['X-Static-Large-Object'], 'True')
+        self.assertEquals(response['Content-Length'], '10')
+        self.assertEquals(file_content(response), b"0123456789")
+
+        # Ranges are read from just the segments that hold them
+        response = self.file_view_get(
+            "large", "object", HTTP_RANGE="bytes=2-6")
+        self.assertEquals(streamed_content(response), b"23456")
+
+        response = self.file_view_get(
+            "large", "object", query="?multipart-manifest=get")
+        self.assertEquals(
+            [segment["name"] for segment in json.loads(response.content)],
+            ["/segments/first", "/segments/second", "/segments/third"])
+
+        # Segments must exist, and match the manifest
+        manifest[0]["etag"] = hashlib.md5(b"other").hexdigest()
+        manifest[1]["path"] = "/segments/missing"
+        response = self.file_view_put(
+            "large", "bad", json.dumps(manifest),
+            query="?multipart-manifest=put")
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(
+            response.content,
+            b"Errors:\n/segments/first, Etag Mismatch\n"
+            b"/segments/missing, 404 Not Found\n")
+
+        # A copy has the size of the segments too
+        self.file_view_copy("large", "object", "large/copy")
+        response = self.file_view_get("large")
+        self.assertEquals(
+            [(f["name"], f["bytes"]) for f in json.loads(
+                streamed_content(response))],
+            [("copy", 10), ("object", 10)])
+        self.assertEquals(response['X-Container-Object-Count'], '2')
+        self.assertEquals(response['X-Container-Bytes-Used'], '20')
+        large = SlowishContainer.objects.get(name="large")
+        self.assertEquals((large.object_count, large.bytes_used), (2, 20))
+        self.assertEquals(
+            file_content(self.file_view_get("large", "copy")), b"0123456789")
+        self.file_view_delete("large", "copy")
+
+        # Deleting the manifest along with its segments
+        response = self.file_view_delete(
+            "large", "object", query="?multipart-manifest=delete")
+        self.assertEquals(response.status_code, 200)
+        self.assertIn(b"Number Deleted: 4\n", response.content)
+        self.assertFalse(SlowishFile.objects.exists())
+        run_commit_hooks()
+        self.assertFalse(SlowishBlob.objects.exists())
+
+    def test_static_large_object_invalid_manifest(self):
+        """Verify that malformed segments of a manifest are refused."""
+
+        self.file_view_put("segments", "only", b"content")
+        for (segment, message) in [
+                ({"etag": 123}, b"Each segment's etag must be a string."),
+                ({"size_bytes": "7"},
+                 b"Each segment's size_bytes must be a non-negative "
+                 b"integer."),
+                ({"size_bytes": -1},
+                 b"Each segment's size_bytes must be a non-negative "
+                 b"integer."),
+                ({"size_bytes": True},
+                 b"Each segment's size_bytes must be a non-negative "
+                 b"integer.")]:
+            manifest = [dict(segment, path="/segments/only")]
+            response = self.file_view_put(
+                "large", "object", json.dumps(manifest),
+                query="?multipart-manifest=put")
+            self.assertEquals(response.status_code, 400)
+            self.assertEquals(response.content, message)
+        self.assertFalse(SlowishFile.objects.filter(path="object").exists())
+
+    def test_static_large_object_nested(self):
+        """Verify that large objects can't be segments of another."""
+
+        self.file_view_put("segments", "only", b"content")
+        self.file_view_put(
+            "segments", "static", json.dumps([{"path": "/segments/only"}]),
+            query="?multipart-manifest=put")
+        self.file_view_put(
+            "segments", "dynamic", HTTP_X_OBJECT_MANIFEST="segments/on")
+
+        manifest = [{"path": "/segments/static"},
+                    {"path": "/segments/dynamic"},
+                    {"path": "/segments/only"}]
+        response = self.file_view_put(
+            "large", "object", json.dumps(manifest),
+            query="?multipart-manifest=put")
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(
+            response.content,
+            b"Errors:\n/segments/static, Nested Manifests Not Supported\n"
+            b"/segments/dynamic, Nested Manifests Not Supported\n")
+
+    def test_static_large_object_missing_segment(self):
+        """Verify that a static large object without a segment conflicts."""
+
+        self.file_view_put("segments", "only", b"content")
+        manifest = [{"path": "/segments/only"}]
+        self.file_view_put("large", "object", json.dumps(manifest),
+                           query="?multipart-manifest=put")
+
+        self.file_view_delete("segments", "only")
+        response = self.file_view_get("large", "object")
+        self.assertEquals(response.status_code, 409)
+
+    def test_dynamic_large_object(self):
+        """Verify that a dynamic large object serves files by prefix."""
+
+        response = self.file_view_put(
+            "large", "object", HTTP_X_OBJECT_MANIFEST="segments/part%2F")
+        self.assertEquals(response.status_code, 201)
+
+        for (path, data) in [("part/2", b"world"), ("part/1", b"hello, "),
+                             ("partial", b"ignored")]:
+            self.file_view_put("segments", path, data)
+
+        response = self.file_view_get("large", "object")
+        self.assertEquals(response['X-Object-Manifest'], "segments/part/")
+        self.assertEquals(file_content(response), b"hello, world")
+
+        # Segments added later are part of the object
+        self.file_view_put("segments", "part/3", b"!")
+        response = self.file_view_get("large", "object")
+        self.assertEquals(file_content(response), b"hello, world!")
+
+        # But not other large objects, (which have no content of their own)
+        self.file_view_put(
+            "segments", "part/4", json.dumps([{"path": "/segments/part/1"}]),
+            query="?multipart-manifest=put")
+        self.file_view_put(
+            "segments", "part/5", HTTP_X_OBJECT_MANIFEST="segments/part%2F")
+        response = self.file_view_get("large", "object")
+        self.assertEquals(response['Content-Length'], '13')
+        self.assertEquals(file_content(response), b"hello, world!")
+
+        # And a copy has the same segments
+        self.file_view_copy("large", "object", "large/copy")
+        response = self.file_view_get("large", "copy")
+        self.assertEquals(file_content(response), b"hello, world!")
+
+        response = self.file_view_get(
+            "large", "object", query="?multipart-manifest=get")
+        self.assertEquals(file_content(response), b"")
+
+    def test_file_range(self):
+        """Verify that single byte ranges of a file can be fetched."""
+
+        self.file_view_put('ranges', 'digits', b'0123456789')
+
+        def get_range(header):
+            return self.file_view_get('ranges', 'digits', HTTP_RANGE=header)
+
+        response = get_range('bytes=2-5')
+        self.assertEquals(response.status_code, 206)
+        self.assertEquals(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEquals(response['Content-Length'], '4')
+        self.assertEquals(streamed_content(response), b'2345')
+
+        response = get_range('bytes=7-')
+        self.assertEquals(streamed_content(response), b'789')
+
+        response = get_range('bytes=-3')
+        self.assertEquals(streamed_content(response), b'789')
+
+        response = get_range('bytes=8-100')
+        self.assertEquals(response['Content-Range'], 'bytes 8-9/10')
+        self.assertEquals(streamed_content(response), b'89')
+
+        # A range entirely beyond the end of the file can't be satisfied
+        response = get_range('bytes=10-')
+        self.assertEquals(response.status_code, 416)
+        self.assertEquals(response['Content-Range'], 'bytes */10')
+
+        # Nor can any range of an empty file
+        self.file_view_put('ranges', 'empty', b'')
+        for header in ['bytes=0-', 'bytes=-3']:
+            response = self.file_view_get(
+                'ranges', 'empty', HTTP_RANGE=header)
+            self.assertEquals(response.status_code, 416)
+            self.assertEquals(response['Content-Range'], 'bytes */0')
+
+        # And a malformed range is ignored
+        response = get_range('bytes=5-2')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(file_content(response), b'0123456789')
+
+    def test_file_multiple_ranges(self):
+        """Verify that several byte ranges can be fetched at once."""
+
+        self.file_view_put('ranges', 'digits', b'0123456789')
+
+        response = self.file_view_get(
+            'ranges', 'digits', HTTP_RANGE='bytes=0-1,-2')
+        self.assertEquals(response.status_code, 206)
+
+        (content_type, boundary) = response['Content-Type'].split(
+            '; boundary=')
+        self.assertEquals(content_type, 'multipart/byteranges')
+
+        content = streamed_content(response)
+        self.assertEquals(int(response['Content-Length']), len(content))
+        self.assertEquals(
+            content,
+            '--{0}\r\n'
+            'Content-Type: application/octet-stream\r\n'
+            'Content-Range: bytes 0-1/10\r\n'
+            '\r\n'
+            '01\r\n'
+            '--{0}\r\n'
+            'Content-Type: application/octet-stream\r\n'
+            'Content-Range: bytes 8-9/10\r\n'
+            '\r\n'
+            '89\r\n'
+            '--{0}--'.format(boundary))
+
+    def test_file_conditional(self):
+        """Verify conditional requests for a file."""
+
+        response = self.file_view_put('conditional', 'file', b'content')
+        etag = response['ETag']
+        response = self.file_view_get('conditional', 'file')
+        file_content(response)
+        last_modified = response['Last-Modified']
+
+        def get(**headers):
+            return self.file_view_get('conditional', 'file', **headers)
+
+        # Matching etags (quoted or not) mean there's nothing to send
+        response = get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response['ETag'], etag)
+        response = get(HTTP_IF_NONE_MATCH='"other", "{0}"'.format(etag))
+        self.assertEquals(response.status_code, 304)
+        response = get(HTTP_IF_NONE_MATCH='"other"')
+        self.assertEquals(response.status_code, 200)
+        file_content(response)
+
+        response = get(HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEquals(response.status_code, 304)
+        response = get(HTTP_IF_MODIFIED_SINCE='Sat, 01 Jan 2000 00:00:00 GMT')
+        self.assertEquals(response.status_code, 200)
+        file_content(response)
+
+        response = get(HTTP_IF_MATCH='"other"')
+        self.assertEquals(response.status_code, 412)
+        response = get(
+            HTTP_IF_UNMODIFIED_SINCE='Sat, 01 Jan 2000 00:00:00 GMT')
+        self.assertEquals(response.status_code, 412)
+
+        # A range is only served if If-Range matches the file
+        response = get(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag)
+        self.assertEquals(response.status_code, 206)
+        response = get(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"other"')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(file_content(response), b'content')
+
+    def assertUsage(self, containers, objects, size, container_name):
+        response = self.account_view_head()
+        self.assertEquals(response.status_code, 204)
+        self.assertEquals(
+            response['X-Account-Container-Count'], str(containers))
+        self.assertEquals(response['X-Account-Object-Count'], str(objects))
+        self.assertEquals(response['X-Account-Bytes-Used'], str(size))
+
+        response = self.container_view_head(container_name)
+        self.assertEquals(response.status_code, 204)
+        self.assertEquals(response['X-Container-Object-Count'], str(objects))
+        self.assertEquals(response['X-Container-Bytes-Used'], str(size))
+
+    def test_usage_counts(self):
+        """Verify that object and byte counts are maintained."""
+
+        self.container_view_put('counted')
+        self.assertUsage(1, 0, 0, 'counted')
+
+        self.file_view_put('counted', 'one', b'1')
+        self.file_view_put('counted', 'two', b'22')
+        self.assertUsage(1, 2, 3, 'counted')
+
+        # Overwriting a file changes only the byte counts
+        self.file_view_put('counted', 'two', b'4444')
+        self.assertUsage(1, 2, 5, 'counted')
+
+        self.file_view_delete('counted', 'one')
+        self.assertUsage(1, 1, 4, 'counted')
+
+        # The counts are also reported with listings
+        response = self.account_view_get()
+        self.assertEquals(response['X-Account-Object-Count'], '1')
+        self.assertJSONEqual(
+            streamed_content(response),
+            '[{"count": 1, "bytes": 4, "name": "counted"}]')
+        response = self.file_view_get('counted')
+        self.assertEquals(response['X-Container-Bytes-Used'], '4')
+
+    def test_rebuild_counters(self):
+        """Verify that the counts can be rebuilt from the files."""
+
+        self.file_view_put('counted', 'one', b'1')
+        other = SlowishContainer.objects.create(
+            account=self.user.account,
+            name='uncounted')
+        SlowishFile.objects.create(container=other, path='a', bytes=10)
+        SlowishFile.objects.create(container=other, path='b', bytes=20)
+        SlowishContainer.objects.create(
+            account=self.user.account,
+            name='empty',
+            object_count=100)
+
+        call_command('slowish_rebuild_counters')
+
+        response = self.account_view_get()
+        self.assertJSONEqual(
+            streamed_content(response),
+            '[{"count": 1, "bytes": 1, "name": "counted"},'
+            '{"count": 0, "bytes": 0, "name": "empty"},'
+            '{"count": 2, "bytes": 30, "name": "uncounted"}]')
+        self.assertEquals(response['X-Account-Container-Count'], '3')
+        self.assertEquals(response['X-Account-Object-Count'], '3')
+        self.assertEquals(response['X-Account-Bytes-Used'], '31')
+
+    def test_snapshot(self):
+        """Verify that a snapshot restores files and their contents."""
+
+        self.file_view_put(
+            'kept', 'a', b'first', HTTP_X_OBJECT_META_COLOR='red')
+        self.file_view_put('kept', 'b\tc', b'', HTTP_X_DELETE_AFTER='3600')
+        path = os.path.join(tempfile.mkdtemp(), 'snapshot.gz')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+
+        out = StringIO()
+        call_command('slowish_dump_snapshot', path, stdout=out)
+        self.assertEquals(
+            out.getvalue(), "Wrote 10 rows to {0}.\n".format(path))
+
+        # (Which removes the content of the first file from disk)
+        self.file_view_delete('kept', 'a')
+        run_commit_hooks()
+        self.file_view_put('added', 'x', b'other')
+        other = blobs.blob_path(hashlib.md5(b'other').hexdigest())
+
+        out = StringIO()
+        call_command('slowish_restore_snapshot', path, stdout=out)
+        self.assertEquals(
+            out.getvalue(), "Restored 10 rows from {0}.\n".format(path))
+
+        # The content of the file that was replaced is removed, once the
+        # restore commits
+        self.assertTrue(os.path.exists(other))
+        run_commit_hooks()
+        self.assertFalse(os.path.exists(other))
+
+        response = self.account_view_get()
+        self.assertJSONEqual(
+            streamed_content(response),
+            '[{"count": 2, "bytes": 5, "name": "kept"}]')
+        response = self.file_view_get('kept', 'a')
+        self.assertEquals(file_content(response), b'first')
+        self.assertEquals(response['X-Object-Meta-Color'], 'red')
+        response = self.file_view_get('kept', 'b\tc')
+        self.assertIn('X-Delete-At', response)
+
+        # New rows are stored after the restored ones
+        response = self.file_view_put('added', 'x', b'other')
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(
+            SlowishContainer.objects.get(name='added').last_change, 1)
+
+    @override_settings(SLOWISH_LISTING_CACHE='default')
+    def test_snapshot_listings(self):
+        """Verify that listings from before a restore aren't served."""
+
+        caches['default'].clear()
+        self.file_view_put('listed', 'a')
+        path = os.path.join(tempfile.mkdtemp(), 'snapshot.gz')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        call_command('slowish_dump_snapshot', path, stdout=StringIO())
+
+        def names():
+            response = self.file_view_get('listed')
+            if response.streaming:
+                return [f["name"] for f in json.loads(
+                    streamed_content(response))]
+            return [f["name"] for f in json.loads(response.content)]
+
+        # (The container's last_change is the same after these as
+        # before the restore)
+        self.file_view_put('listed', 'b')
+        self.assertEquals(names(), ['a', 'b'])
+        call_command('slowish_restore_snapshot', path, stdout=StringIO())
+        run_commit_hooks()
+        self.file_view_put('listed', 'x')
+        self.assertEquals(names(), ['a', 'x'])
+
+    def test_generate(self):
+        """Verify that generated accounts can be used like any other."""
+
+        out = StringIO()
+        call_command('slowish_generate', accounts=2, containers=2, files=6,
+                     depth=2, fan_out=2, file_size=3, stdout=out)
+        self.assertTrue(out.getvalue().startswith(
+            "Generated accounts 1235 to 1236, (user 'generated', "
+            "password 'not_secret'): 56 rows in "))
+        self.assertEquals(SlowishBlob.objects.get().refs, 24)
+
+        # (The views are invoked as the last account's user)
+        self.user = SlowishUser.objects.get(account=1236)
+        self.token = self.user.issue_token().token
+        response = self.account_view_get()
+        self.assertJSONEqual(
+            streamed_content(response),
+            '[{"count": 6, "bytes": 18, "name": "container0"},'
+            '{"count": 6, "bytes": 18, "name": "container1"}]')
+        response = self.file_view_get(
+            'container1', query='?prefix=dir1/&delimiter=/')
+        self.assertJSONEqual(
+            streamed_content(response),
+            '[{"subdir": "dir1/dir0/"}, {"subdir": "dir1/dir1/"}]')
+        response = self.file_view_get('container1', 'dir1/dir0/file00000005')
+        self.assertEquals(file_content(response), b'xxx')
+
+        self.file_view_put('container1', 'dir1/dir0/file00000005', b'new')
+        response = self.file_view_get(
+            'container1', query='?changes_since=5')
+        self.assertJSONEqual(
+            streamed_content(response),
+            '[{"change": 7, "name": "dir1/dir0/file00000005",'
+            '"deleted": false}]')
+
     def test_file_delete(self):
         """Verify we can delete a file from a container."""
 
@@ -433,8 +1647,482 @@ class FilesViewTest(TestCase):
         response = self.file_view_delete("crew", "red_shirt")
         self.assertEquals(response.status_code, 404)
 
+    def test_container_delete(self):
+        """Verify that only empty containers can be deleted."""
+
+        self.container_view_put("empty")
+        self.file_view_put("full", "file", b"content")
+
+        response = self.container_view_delete("full")
+        self.assertEquals(response.status_code, 409)
+        response = self.container_view_delete("empty")
+        self.assertEquals(response.status_code, 204)
+
+        self.assertEquals(
+            list(SlowishContainer.objects.values_list('name', flat=True)),
+            ["full"])
+        self.assertEquals(SlowishAccount.objects.get().container_count, 1)
+        with self.assertRaises(Http404):
+            self.container_view_delete("empty")
+
+    def test_container_delete_recursive(self):
+        """Verify that a container can be deleted along with its files."""
+
+        for name in ["one", "two", "three"]:
+            self.file_view_put("doomed", name, name)
+        self.file_view_put("kept", "one", "one")
+
+        response = self.container_view_delete("doomed", "?recursive=true")
+        self.assertEquals(response.status_code, 204)
+
+        # The container is gone at once, (and its name free again)...
+        with self.assertRaises(Http404):
+            self.container_view_get("doomed")
+        response = self.account_view_get()
+        self.assertEquals(
+            [c["name"] for c in json.loads(streamed_content(response))],
+            ["kept"])
+        self.assertEquals(response['X-Account-Container-Count'], '1')
+        self.assertEquals(response['X-Account-Object-Count'], '1')
+        self.assertEquals(response['X-Account-Bytes-Used'], '3')
+        response = self.container_view_put("doomed")
+        self.assertEquals(response.status_code, 201)
+
+        # ...while its files are purged later, a batch at a time
+        self.assertEquals(SlowishFile.objects.count(), 4)
+        stdout = StringIO()
+        call_command('slowish_purge_containers', batch_size=2, stdout=stdout)
+        self.assertEquals(
+            stdout.getvalue(), "Purged 3 files of deleted containers.\n")
+
+        self.assertEquals(
+            sorted(SlowishContainer.objects.values_list('name', flat=True)),
+            ["doomed", "kept"])
+        self.assertEquals(SlowishFile.objects.count(), 1)
+        run_commit_hooks()
+        self.assertEquals(SlowishBlob.objects.get().refs, 1)
+
+    def test_bulk_delete(self):
+        """Verify that many files can be deleted in one request."""
+
+        for name in ["one", "two", "three", u"caf\xe9"]:
+            self.file_view_put("bulk", name, b"content")
+        self.file_view_put("full", "kept")
+        self.container_view_put("empty")
+
+        body = "\n".join([
+            "/bulk/one", "bulk/two", "/bulk/caf%C3%A9", "/bulk/missing",
+            "", "/empty", "/full", "/gone/file"])
+        response = self.account_view_bulk_delete(body)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.content, "\n".join([
+            "Number Deleted: 4",
+            "Number Not Found: 2",
+            "Response Body: ",
+            "Response Status: 400 Bad Request",
+            "Errors:",
+            "full, 409 Conflict",
+            ""]))
+
+        self.assertEquals(
+            list(SlowishFile.objects.order_by('path').values_list(
+                'path', flat=True)),
+            ["kept", "three"])
+        self.assertEquals(
+            list(SlowishContainer.objects.order_by('name').values_list(
+                'name', 'object_count', 'bytes_used')),
+            [("bulk", 1, 7), ("full", 1, 0)])
+        acc = SlowishAccount.objects.get()
+        self.assertEquals(
+            (acc.container_count, acc.object_count, acc.bytes_used),
+            (2, 2, 7))
+        self.assertEquals(SlowishBlob.objects.get(bytes=7).refs, 1)
+
+        # The whole container goes once its files have been deleted
+        response = self.account_view_bulk_delete(
+            "/bulk/three\n/bulk\n", HTTP_ACCEPT="application/json")
+        self.assertEquals(json.loads(response.content), {
+            "Number Deleted": 2,
+            "Number Not Found": 0,
+            "Response Body": "",
+            "Response Status": "200 OK",
+            "Errors": []})
+        run_commit_hooks()
+        self.assertFalse(SlowishBlob.objects.filter(bytes=7).exists())
+
+    @override_settings(SLOWISH_BULK_DELETE_LIMIT=2)
+    def test_bulk_delete_limit(self):
+        """Verify that a bulk-delete of too many paths is refused."""
+
+        self.file_view_put("bulk", "file")
+        response = self.account_view_bulk_delete(
+            "/bulk/file\n/bulk/one\n/bulk/two\n",
+            HTTP_ACCEPT="application/json")
+        result = json.loads(response.content)
+        self.assertEquals(
+            result["Response Status"], "413 Request Entity Too Large")
+        self.assertEquals(result["Number Deleted"], 0)
+        self.assertTrue(SlowishFile.objects.exists())
+
+    @skipUnless(connection.vendor == 'postgresql',
+                "Other databases record the changes one by one")
+    def test_bulk_delete_queries(self):
+        """Verify that files are deleted a chunk at a time."""
+
+        for i in range(10):
+            self.file_view_put("bulk", str(i), str(i))
+
+        # Container lookup, then for the chunk (in a savepoint): lock
+        # and delete the files, lock, update and check the blobs, update
+        # the two counters and record the changes, (the unused blobs
+        # being deleted once that commits)
+        body = "\n".join("/bulk/{0}".format(i) for i in range(10))
+        with self.assertNumQueries(11):
+            response = self.account_view_bulk_delete(body)
+        self.assertIn("Number Deleted: 10\n", response.content)
+        run_commit_hooks()
+        self.assertFalse(SlowishBlob.objects.exists())
+
+    def test_extract_archive(self):
+        """Verify that the files in an archive can be uploaded at once."""
+
+        self.file_view_put("unpacked", "docs/b", b"old")
+        archive = make_archive([
+            ("a", b"first"),
+            ("./sub", None),
+            ("./sub/c", b"third"),
+            ("b", b"second"),
+            ("/a", b"again"),
+        ], mode='w:gz')
+
+        response = self.archive_view_put(
+            "unpacked", "docs/", archive, "tar.gz")
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.content, "\n".join([
+            "Number Files Created: 4",
+            "Response Body: ",
+            "Response Status: 201 Created",
+            "Errors:",
+            ""]))
+
+        for (path, data) in [("docs/a", b"again"),
+                             ("docs/b", b"second"),
+                             ("docs/sub/c", b"third")]:
+            response = self.file_view_get("unpacked", path)
+            self.assertEquals(file_content(response), data)
+
+        unpacked = SlowishContainer.objects.get(name="unpacked")
+        self.assertEquals(
+            (unpacked.object_count, unpacked.bytes_used), (3, 16))
+        run_commit_hooks()
+        self.assertEquals(
+            sorted(SlowishBlob.objects.values_list('bytes', 'refs')),
+            [(5, 1), (5, 1), (6, 1)])
+
+    def test_extract_archive_formats(self):
+        """Verify the handling of each archive format, and bad ones."""
+
+        for (archive_format, mode) in [("tar", "w"),
+                                       ("tar.gz", "w:gz"),
+                                       ("tar.bz2", "w:bz2")]:
+            archive = make_archive([(archive_format, b"data")], mode)
+            response = self.archive_view_put(
+                "formats", "", archive, archive_format,
+                HTTP_ACCEPT="application/json")
+            self.assertEquals(json.loads(response.content), {
+                "Number Files Created": 1,
+                "Response Body": "",
+                "Response Status": "201 Created",
+                "Errors": []})
+
+        response = self.archive_view_put("formats", "", b"", "zip")
+        self.assertEquals(response.status_code, 400)
+
+        # A truncated archive keeps the files read before the error
+        archive = make_archive([("whole", b"x" * 1000),
+                                ("partial", b"y" * 1000)], "w:gz")
+        response = self.archive_view_put(
+            "truncated", "", archive[:-20], "tar.gz",
+            HTTP_ACCEPT="application/json")
+        result = json.loads(response.content)
+        self.assertEquals(result["Response Status"], "400 Bad Request")
+        self.assertTrue(result["Response Body"].startswith(
+            "Invalid Tar File: "))
+        self.assertEquals(
+            list(SlowishFile.objects.filter(
+                container__name="truncated").values_list('path', flat=True)),
+            ["whole"])
+
+    def test_changes_feed(self):
+        """Verify that a container lists the changes since a number."""
+
+        for path in ["a", "b", "c"]:
+            self.file_view_put("sync", path, path)
+        self.file_view_delete("sync", "a")
+        self.file_view_put("sync", "b", b"changed")
+
+        def changes(since, limit=''):
+            response = self.file_view_get(
+                "sync", query="?changes_since={0}{1}".format(since, limit))
+            return json.loads(streamed_content(response))
+
+        # Only the latest change to each path is listed, (deletions too)
+        self.assertEquals(
+            changes(0),
+            [{"change": 3, "name": "c", "deleted": False},
+             {"change": 4, "name": "a", "deleted": True},
+             {"change": 5, "name": "b", "deleted": False}])
+        self.assertEquals(
+            [c["change"] for c in changes(3, "&limit=1")], [4])
+        self.assertEquals(changes(5), [])
+
+        response = self.container_view_head("sync")
+        self.assertEquals(response['X-Container-Last-Change'], '5')
+
+        # Expired files are recorded as deleted when they are swept
+        SlowishFile.objects.filter(path="c").update(
+            delete_at=timezone.now() - timedelta(seconds=1))
+        call_command('slowish_expire_files', stdout=StringIO())
+        self.assertEquals(
+            changes(5), [{"change": 6, "name": "c", "deleted": True}])
+
+        response = self.file_view_get("sync", query="?changes_since=latest")
+        self.assertEquals(response.status_code, 400)
+
+    @override_settings(SLOWISH_LISTING_CACHE='default')
+    def test_listing_cache(self):
+        """Verify that cached listings are served until a change."""
+
+        caches['default'].clear()
+        self.file_view_put("cached", "one", b"1")
+
+        def names(query=''):
+            response = self.file_view_get("cached", query=query)
+            self.assertEquals(response.status_code, 200)
+            if response.streaming:
+                content = streamed_content(response)
+            else:
+                content = response.content
+            return [f["name"] for f in json.loads(content)]
+
+        self.assertEquals(names(), ["one"])
+
+        # Only the container is read for a cached listing
+        with self.assertNumQueries(1):
+            self.assertEquals(names(), ["one"])
+
+        # Each change to the container's files is seen at once
+        self.file_view_put("cached", "two", b"2")
+        self.assertEquals(names(), ["one", "two"])
+        self.assertEquals(names("?marker=one"), ["two"])
+        self.file_view_delete("cached", "one")
+        self.assertEquals(names(), ["two"])
+        self.assertEquals(names("?marker=one"), ["two"])
+
+        # Invalidating listings stops any being served from the cache
+        listing_cache.invalidate_listings()
+        with self.assertNumQueries(1 + self.listing_queries):
+            self.assertEquals(names(), ["two"])
+        with self.assertNumQueries(1):
+            self.assertEquals(names(), ["two"])
+
+        # A listing of a file that is about to expire isn't cached
+        self.file_view_put("cached", "brief", b"3", HTTP_X_DELETE_AFTER="1")
+        self.assertEquals(names(), ["brief", "two"])
+        with self.assertNumQueries(1 + self.listing_queries):
+            names()
+
+    @override_settings(SLOWISH_LISTING_ENGINE='unknown')
+    def test_listing_engine_unknown(self):
+        """Verify that an unknown listing engine is a configuration error."""
+
+        with self.assertRaises(ImproperlyConfigured):
+            engines.listing_engine()
+
+    def test_listings_streamed(self):
+        """Verify that account and container listings are streamed."""
+
+        self.container_view_put("stream")
+        self.file_view_put("stream", "a")
+
+        response = self.account_view_get()
+        self.assertTrue(response.streaming)
+        self.assertEquals(response["Content-Type"], "application/json")
+
+        response = self.file_view_get("stream")
+        self.assertTrue(response.streaming)
+        self.assertEquals(response["Content-Type"], "application/json")
+
+    def test_json_array_chunks(self):
+        """Verify chunked serialization of listing entries."""
+
+        self.assertEquals(list(json_array_chunks(iter([]))), ['[]'])
+
+        chunks = list(json_array_chunks(
+            ({"name": str(i)} for i in range(5)), chunk_size=2))
+        self.assertEquals(len(chunks), 3)
+        self.assertEquals(
+            json.loads(''.join(chunks)),
+            [{"name": str(i)} for i in range(5)])
+
     def test_container_does_not_exist(self):
         """Verify a 404 status for a non-existent container."""
 
         with self.assertRaises(Http404):
             self.container_view_get('does_not_exist')
+
+
+@override_settings(SLOWISH_LISTING_ENGINE='memory')
+class MemoryEngineFilesViewTest(FilesViewTest):
+    """Run the files view tests with listings from the memory engine."""
+
+    # (Once the engine has read them)
+    listing_queries = 0
+
+    @skip("Prefix listings don't query the database")
+    def test_files_prefix_plan(self):
+        pass
+
+    def test_files_delimiter_skips_subdirs(self):
+        """Verify that the files are read once, and then only changes."""
+
+        container = SlowishContainer.objects.create(
+            account=self.user.account,
+            name="tree")
+        SlowishFile.objects.bulk_create(
+            SlowishFile(container=container, path='big/{0}'.format(i))
+            for i in range(100))
+        SlowishFile.objects.create(container=container, path='small')
+
+        # Authenticate and look up the container, then read its files
+        with self.assertNumQueries(3):
+            response = self.file_view_get("tree", query="?delimiter=/")
+            content = streamed_content(response)
+        self.assertJSONEqual(
+            content,
+            '[{"subdir": "big/"}, {"bytes": 0, "name": "small",'
+            '"content_type": "application/directory"}]')
+
+        # After a change, only the changed files are read, (the token
+        # being cached by now)
+        self.file_view_put("tree", "big/more", b"more")
+        with self.assertNumQueries(3):
+            response = self.file_view_get("tree", query="?prefix=big/m")
+            content = streamed_content(response)
+        self.assertEquals(
+            [f["name"] for f in json.loads(content)], ["big/more"])
+        with self.assertNumQueries(1):
+            self.file_view_get("tree", query="?prefix=big/m")
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            "Concurrent writers need a database server")
+class ConcurrentPutTest(TransactionTestCase):
+
+    def setUp(self):
+        self.user = create_user()
+        self.token = self.user.issue_token().token
+        token_cache.clear()
+
+        blob_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, blob_root)
+        blob_settings = override_settings(SLOWISH_BLOB_ROOT=blob_root)
+        blob_settings.enable()
+        self.addCleanup(blob_settings.disable)
+
+    def file_put(self, container_name, path, data):
+        url = reverse('file',
+                      kwargs={'account_id': self.user.account.id,
+                              'container_name': container_name,
+                              'path': path})
+        request = RequestFactory().put(
+            url, data, content_type='application/octet-stream')
+        request.META['HTTP_X_AUTH_TOKEN'] = self.token
+        return container(request, self.user.account.id, container_name, path)
+
+    def file_get(self, container_name, path):
+        url = reverse('file',
+                      kwargs={'account_id': self.user.account.id,
+                              'container_name': container_name,
+                              'path': path})
+        request = RequestFactory().get(url)
+        request.META['HTTP_X_AUTH_TOKEN'] = self.token
+        return container(request, self.user.account.id, container_name, path)
+
+    def test_download_releases_connection(self):
+        """Verify that a large download doesn't hold the connection."""
+
+        large = b'x' * (blobs.BLOB_CHUNK_SIZE + 1)
+        self.file_put('downloads', 'large', large)
+        self.file_put('downloads', 'small', b'small')
+
+        response = self.file_get('downloads', 'small')
+        self.assertIsNotNone(connection.connection)
+        self.assertEquals(file_content(response), b'small')
+
+        response = self.file_get('downloads', 'large')
+        self.assertIsNone(connection.connection)
+        self.assertEquals(file_content(response), large)
+
+    def test_put_queries(self):
+        """Verify the number of statements an upload takes."""
+
+        self.file_put('queries', 'first', b'content')
+
+        # Container lookup, blob upsert, file insert, the two counters
+        # and the change record
+        with self.assertNumQueries(6):
+            response = self.file_put('queries', 'second', b'content')
+        self.assertEquals(response.status_code, 201)
+
+        # An overwrite also locks and updates the file, and releases the
+        # old blob, (which is still used by the first file). The sizes
+        # are the same, so the account's counters are left alone.
+        with self.assertNumQueries(9):
+            response = self.file_put('queries', 'second', b'altered')
+        self.assertEquals(response.status_code, 200)
+
+    def test_concurrent_puts(self):
+        """Verify that parallel uploads of the same paths all succeed."""
+
+        paths = ['a', 'b', 'c', 'd']
+        statuses = []
+        errors = []
+
+        def upload(n):
+            try:
+                for path in paths:
+                    response = self.file_put('race', path, b'x' * n)
+                    statuses.append((path, response.status_code))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=upload, args=(n % 5,))
+                   for n in range(24)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(errors, [])
+        self.assertEquals(len(statuses), 24 * len(paths))
+        self.assertEquals(
+            sorted(path for (path, status) in statuses if status == 201),
+            paths)
+        self.assertEquals(
+            set(status for (path, status) in statuses), set([200, 201]))
+
+        # The counters and references agree with the files that won
+        files = SlowishFile.objects.filter(container__name='race')
+        total = sum(files.values_list('bytes', flat=True))
+        race = SlowishContainer.objects.get(name='race')
+        self.assertEquals(race.object_count, len(paths))
+        self.assertEquals(race.bytes_used, total)
+        account = SlowishAccount.objects.get()
+        self.assertEquals(account.container_count, 1)
+        self.assertEquals(account.object_count, len(paths))
+        self.assertEquals(account.bytes_used, total)
+        for blob in SlowishBlob.objects.all():
+            self.assertEquals(blob.refs, files.filter(blob=blob).count())
@@ -1,22 +1,188 @@
-from datetime import datetime, timedelta
+import calendar
+from datetime import datetime
+import io
 import json
+import time
 
-from django.http import JsonResponse, HttpResponse
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.template import loader
+from django.core.urlresolvers import reverse
 from django.shortcuts import get_object_or_404
+from django.utils import six, timezone
+from django.utils.http import http_date, urlquote, urlunquote
 
+from . import background, blobs, bulk, downloads, large_objects
+from . import engines, listing_cache
+from .auth import authenticate_credentials, token_required, unauthorized
 from .models import SlowishAccount, SlowishUser, SlowishContainer, SlowishFile
+from .models import SlowishBlob, SlowishChange, dump_metadata, load_metadata
 
+# Number of entries serialized into each chunk of a streamed listing.
+LISTING_CHUNK_SIZE = 1000
 
-def unauthorized():
-    unauth_response = {
-        "unauthorized":
-        {"code": 401,
-         "message":
-         "Unable to authenticate user with credentials provided."}}
+# Number of base URLs for which tokens responses are pre-rendered.
+CATALOG_SKELETONS_SIZE = 64
 
-    return JsonResponse(unauth_response, status=401)
+# Pre-rendered tokens responses, keyed by base URL.
+catalog_skeletons = {}
+
+# The largest page of a listing that we will return, (this matches
+# the default container_listing_limit of Swift itself).
+LISTING_LIMIT = 10000
+
+
+def limit_too_large():
+    maximum = getattr(settings, 'SLOWISH_LISTING_LIMIT', LISTING_LIMIT)
+    return HttpResponse(
+        'Maximum limit is {0}'.format(maximum),
+        status=412)  # Precondition failed
+
+
+def json_array_chunks(entries, chunk_size=LISTING_CHUNK_SIZE):
+    """
+    Serialize an iterable of entries as a JSON array, in chunks.
+
+    Each yielded string holds up to chunk_size entries, so a listing
+    can be sent as it is read from the database rather than being
+    built up in memory first.
+    """
+    separator = '['
+    chunk = []
+    for entry in entries:
+        chunk.append(separator)
+        chunk.append(json.dumps(entry))
+        separator = ','
+        if len(chunk) >= 2 * chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append('[]' if separator == '[' else ']')
+    yield ''.join(chunk)
+
+
+def listing_limit(request):
+    """
+    Return the number of entries to list in response to request.
+
+    As in Swift, a limit that isn't a non-negative integer is ignored
+    in favor of the default. Returns None if the requested limit is
+    larger than the maximum page size.
+    """
+    maximum = getattr(settings, 'SLOWISH_LISTING_LIMIT', LISTING_LIMIT)
+    limit = request.GET.get("limit", "")
+
+    if not limit.isdigit():
+        return getattr(settings, 'SLOWISH_LISTING_DEFAULT_LIMIT', maximum)
+
+    limit = int(limit)
+    if limit > maximum:
+        return None
+
+    return limit
+
+
+def listing_page(queryset, field, request, limit):
+    """
+    Narrow queryset to the page of a listing that request asks for.
+
+    The marker and end_marker parameters become comparisons on field,
+    (keyset pagination), so with an index on the parent and field,
+    each page is a bounded index range scan however deep into the
+    listing it starts.
+    """
+    queryset = queryset.order_by(field)
+
+    if "marker" in request.GET:
+        queryset = queryset.filter(
+            **{field + '__gt': request.GET["marker"]})
+
+    if "end_marker" in request.GET:
+        queryset = queryset.filter(
+            **{field + '__lt': request.GET["end_marker"]})
+
+    return queryset[:limit]
+
+
+def listing_response(entries):
+    """Return a streamed JSON array response for a listing."""
+
+    # Note: Swift listings are top-level JSON arrays. The old-browser
+    # concern that makes JsonResponse insist on safe=False for those
+    # is a non-issue here since we don't expect browsers to be using
+    # this API, (see the documentation for JsonResponse in
+    # https://docs.djangoproject.com/en/1.9/ref/request-response/).
+    return StreamingHttpResponse(
+        json_array_chunks(entries),
+        content_type="application/json")
+
+
+def catalog_skeleton(base_url):
+    """
+    Return the body of a tokens response for base_url, as a template.
+
+    The result is a JSON document with %-format slots for the values
+    that vary with the authenticated user. Skeletons are computed once
+    per base URL, leaving only string formatting to do per request.
+    """
+    skeleton = catalog_skeletons.get(base_url)
+    if skeleton is not None:
+        return skeleton
+
+    # The account ID is the final component of the account URL, so
+    # reversing the URL for account 0 and dropping that "0" gives the
+    # prefix of every account's URL.
+    account_url = base_url + reverse('account', kwargs={'account_id': 0})
+    account_url = account_url[:-1]
+
+    catalog = {
+        "access": {
+            "serviceCatalog": [
+                {
+                    "endpoints": [
+                        {
+                            "publicURL": account_url + ":account_id:",
+                            "region": "CloudCity",
+                            "tenantId": ":account_id:"
+                        }
+                    ],
+                    "name": "cloudFiles",
+                    "type": "object-store"
+                }
+            ],
+            "token": {
+                "RAX-AUTH:authenticatedBy": [
+                    "PASSWORD"
+                ],
+                "expires": ":expires:",
+                "id": ":token:",
+                "tenant": {
+                    "id": ":account_id:",
+                    "name": ":account_id:"
+                }
+            },
+            "user": {
+                "RAX-AUTH:defaultRegion": "CloudCity",
+                "id": "UNKNOWN_PURPOSE",
+                "name": ":username:"
+            }
+        }
+    }
+
+    # Every value substituted into the skeleton is a JSON-encoded
+    # string, (including its quotes), except that account IDs are
+    # digits which need no encoding, so they go inside the quotes.
+    skeleton = json.dumps(catalog).replace('%', '%%')
+    for name in ('expires', 'token', 'username'):
+        skeleton = skeleton.replace(
+            '":{0}:"'.format(name), '%({0})s'.format(name))
+    skeleton = skeleton.replace(':account_id:', '%(account_id)s')
+
+    if len(catalog_skeletons) >= CATALOG_SKELETONS_SIZE:
+        catalog_skeletons.clear()
+    catalog_skeletons[base_url] = skeleton
+
+    return skeleton
 
 
 @csrf_exempt
@@ -45,14 +211,15 @@ def tokens(request):
             account_id = jreq['auth']['tenantName']
         username = jreq['auth']['passwordCredentials']['username']
         password = jreq['auth']['passwordCredentials']['password']
-        user = SlowishUser.objects.get(
-            account__id=account_id,
-            username=username,
-            password=password)
     except:
         return unauthorized()
 
-    expiration = datetime.utcnow() + timedelta(days=2)
+    token = authenticate_credentials(account_id, username, password)
+    if token is None:
+        return unauthorized()
+
+    user = token.user
+    expiration = token.expires.astimezone(timezone.utc)
 
     # The base URL we want to use is whatever is being used in the
     # current request, but without any path, (not even a trailing
@@ -60,139 +227,577 @@ def tokens(request):
     # then the [:-1] slice to drop that.
     base_url = request.build_absolute_uri('/')[:-1]
 
-    template = loader.get_template('slowish/tokens.json')
-    context = {
-        "user": user,
-        "expires": expiration.strftime("%Y-%m-%dT%H:%M:%SZ"),
-        "base_url": base_url
+    content = catalog_skeleton(base_url) % {
+        "account_id": int(user.account.id),
+        "expires": json.dumps(expiration.strftime("%Y-%m-%dT%H:%M:%SZ")),
+        "token": json.dumps(token.token),
+        "username": json.dumps(user.username),
     }
-    return HttpResponse(
-        template.render(context, request),
-        content_type="application/json")
+    return HttpResponse(content, content_type="application/json")
 
 
 @csrf_exempt
-def account(request, account_id):
-    try:
-        SlowishUser.objects.get(
-            account__id=account_id,
-            token=request.META['HTTP_X_AUTH_TOKEN'])
-    except:
-        return unauthorized()
+@token_required
+def account(request, account):
+    if request.method in ('POST', 'DELETE') and 'bulk-delete' in request.GET:
+        return bulk.bulk_delete(request, account)
 
-    containers = SlowishContainer.objects.filter(account__id=account_id)
-    containers = containers.order_by('name')
+    if (request.method == 'HEAD'):
+        return account_usage(HttpResponse('', status=204), account)
 
-    if request.GET:
-        if "marker" in request.GET:
-            containers = containers.filter(name__gt=request.GET["marker"])
+    limit = listing_limit(request)
+    if limit is None:
+        return limit_too_large()
 
-        if "end_marker" in request.GET:
-            containers = containers.filter(name__lt=request.GET["end_marker"])
+    containers = SlowishContainer.objects.live().filter(account=account)
+    containers = listing_page(containers, 'name', request, limit)
 
-    # Note: The need for safe=False is documented here:
-    #
-    # https://docs.djangoproject.com/en/1.9/ref/request-response/#jsonresponse-objects
-    # The safety concern is really a non-issue for us:
-    #
-    #   * As described above, this was only a concern with old browsers
-    #
-    #   * We don't expect browsers to be using this API anyway
-    #
-    #   * Regardless, we're implemeting the Swift API which has an
-    #     array return-value at this point, so there's nothing we
-    #     can change and remain compatible.
-    return JsonResponse(
-        [{"count": 0,
-          "bytes": 0,
-          "name": container.name} for container in containers],
-        safe=False)
+    # Using iterator() reads the rows through a server-side cursor (on
+    # PostgreSQL) so that memory use doesn't grow with the listing.
+    containers = containers.values_list(
+        'name', 'object_count', 'bytes_used').iterator()
+    response = listing_response(
+        {"count": count,
+         "bytes": size,
+         "name": name} for (name, count, size) in containers)
+    return account_usage(response, account)
+
+
+def account_usage(response, account):
+    """Add the counts of an account to the headers of response."""
+
+    # The account may have come from the token cache, so its counts
+    # are read afresh.
+    (containers, objects, size) = SlowishAccount.objects.filter(
+        pk=account.pk).values_list(
+            'container_count', 'object_count', 'bytes_used').get()
+
+    response['X-Account-Container-Count'] = containers
+    response['X-Account-Object-Count'] = objects
+    response['X-Account-Bytes-Used'] = size
+    return response
+
+
+def container_usage(response, container):
+    """Add the counts of a container to the headers of response."""
+    response['X-Container-Object-Count'] = container.object_count
+    response['X-Container-Bytes-Used'] = container.bytes_used
+    response['X-Container-Last-Change'] = container.last_change
+    return metadata_headers(response, 'Container', container.metadata)
+
+
+def request_metadata(request, kind):
+    """
+    Return the X-<kind>-Meta-* headers of request, as a dict.
+
+    The keys are the lower-cased names after the prefix, (so
+    X-Object-Meta-Color is "color").
+    """
+    prefix = 'HTTP_X_{0}_META_'.format(kind.upper())
+    return dict(
+        (key[len(prefix):].lower().replace('_', '-'), value)
+        for (key, value) in request.META.items()
+        if key.startswith(prefix))
+
+
+def metadata_headers(response, kind, metadata):
+    """Add the X-<kind>-Meta-* headers of a metadata column to response."""
+    for (name, value) in load_metadata(metadata).items():
+        response['X-{0}-Meta-{1}'.format(kind, name.title())] = value
+    return response
 
 
 def container_put(request, account, container_name, path):
-    (container, container_created) = SlowishContainer.objects.get_or_create(
-        account=account,
-        name=container_name)
+    (container, container_created) = SlowishContainer.objects.get_or_insert(
+        account, container_name)
 
     if (path != ''):
-        (file, file_created) = SlowishFile.objects.get_or_create(
-            container=container,
-            path=path)
-    else:
-        file_created = False
+        return object_put(request, container, path)
+
+    container.update_metadata(request_metadata(request, 'Container'))
 
-    if (container_created or file_created):
+    if container_created:
         return HttpResponse('', status=201)  # Created
     else:
         return HttpResponse('', status=200)  # OK
 
 
-def container_delete(request, container, path):
+def requested_expiry(request):
+    """
+    Return when the file stored by request should expire, (or None).
+
+    Raises ValueError, with a message for the client, if the request's
+    X-Delete-At or X-Delete-After header is invalid.
+    """
+    now = time.time()
+    if 'HTTP_X_DELETE_AT' in request.META:
+        try:
+            delete_at = int(request.META['HTTP_X_DELETE_AT'])
+        except ValueError:
+            raise ValueError('Non-integer X-Delete-At')
+        if delete_at < now:
+            raise ValueError('X-Delete-At in past')
+    elif 'HTTP_X_DELETE_AFTER' in request.META:
+        try:
+            delete_after = int(request.META['HTTP_X_DELETE_AFTER'])
+        except ValueError:
+            raise ValueError('Non-integer X-Delete-After')
+        if delete_after < 0:
+            raise ValueError('X-Delete-After in past')
+        delete_at = now + delete_after
+    else:
+        return None
+
+    return datetime.fromtimestamp(delete_at, timezone.utc)
+
+
+def object_put(request, container, path):
     try:
-        file = SlowishFile.objects.get(container=container, path=path)
-    except:
+        delete_at = requested_expiry(request)
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
+
+    attributes = {
+        "content_type": request.META.get('CONTENT_TYPE') or None,
+        "delete_at": delete_at,
+        "metadata": dump_metadata(request_metadata(request, 'Object')),
+    }
+    if request.GET.get('multipart-manifest') == 'put':
+        return large_objects.static_manifest_put(
+            request, container, path, attributes)
+    if request.META.get('HTTP_X_OBJECT_MANIFEST'):
+        attributes["dynamic_manifest"] = urlunquote(
+            request.META['HTTP_X_OBJECT_MANIFEST'])
+
+    # The request body is streamed to the blob store rather than being
+    # read into memory as request.body
+    (temporary, etag, size) = blobs.write_temporary(request)
+
+    expected_etag = request.META.get('HTTP_ETAG')
+    if expected_etag and expected_etag.strip('"').lower() != etag:
+        blobs.discard_temporary(temporary)
+        return HttpResponse('', status=422)  # Unprocessable entity
+
+    (created,) = container.store_files(
+        [(path, temporary, etag, size)], attributes)
+
+    if created:
+        response = HttpResponse('', status=201)  # Created
+    else:
+        response = HttpResponse('', status=200)  # OK
+    response['ETag'] = etag
+    return response
+
+
+def copy_location(header):
+    """
+    Return the (container name, path) that a copy header refers to.
+
+    The header is a URL encoded "/container/path", (with the leading
+    slash optional). Returns None if it doesn't name a file.
+    """
+    (container_name, sep, path) = urlunquote(header).lstrip('/').partition(
+        '/')
+    if not container_name or not path:
+        return None
+    return (container_name, path)
+
+
+def object_copy(request, account, source, destination):
+    """
+    Copy the file at source to destination, (both within account).
+
+    Both are (container name, path) tuples. The copy shares the stored
+    content of the original, so no content is read or written, however
+    large the file is. Copying a large object copies its manifest, (so
+    the copy has the same segments). As in Swift, the copy has the
+    metadata of the original, updated with any given in request.
+    """
+    if source is None or destination is None:
+        return HttpResponse(
+            'Copy location must be of the form <container name>/<object name>',
+            status=412)  # Precondition failed
+
+    try:
+        delete_at = requested_expiry(request)
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
+
+    try:
+        original = SlowishFile.objects.live().select_related('blob').get(
+            container__account=account,
+            container__deleted=False,
+            container__name=source[0],
+            path=source[1])
+    except SlowishFile.DoesNotExist:
+        return HttpResponse('', status=404)
+
+    (container, container_created) = SlowishContainer.objects.get_or_insert(
+        account, destination[0])
+
+    if original.blob is None:
+        # (A static large object has no blob, but the size of its
+        # segments)
+        blob = SlowishBlob(bytes=original.bytes)
+    elif SlowishBlob.objects.share(original.blob_id):
+        blob = original.blob
+    else:
+        # The original was deleted since it was found
+        return HttpResponse('', status=404)
+
+    metadata = load_metadata(original.metadata)
+    metadata.update(request_metadata(request, 'Object'))
+    attributes = {"content_type": original.content_type,
+                  "delete_at": delete_at,
+                  "dynamic_manifest": original.dynamic_manifest,
+                  "metadata": dump_metadata(metadata),
+                  "static_manifest": original.static_manifest}
+    (created,) = container.store_blobs(
+        [(destination[1], blob)], attributes)
+
+    if created:
+        response = HttpResponse('', status=201)  # Created
+    else:
+        response = HttpResponse('', status=200)  # OK
+    response['ETag'] = original.etag
+    response['X-Copied-From'] = urlquote(u'/'.join(source))
+    response['X-Copied-From-Last-Modified'] = http_date(
+        calendar.timegm(original.last_modified.utctimetuple()))
+    return response
+
+
+def container_post(request, container, path):
+    """
+    Update the metadata of a container, or of a file within it.
+
+    As in Swift, a file's metadata (and Content-Type) is replaced by
+    that given, while a container's is merged with it. The content of
+    a file is left as it is.
+    """
+    if path == '':
+        try:
+            container.update_metadata(request_metadata(request, 'Container'))
+        except SlowishContainer.DoesNotExist:
+            return HttpResponse('', status=404)
+        return HttpResponse('', status=204)  # No content
+
+    changes = {"metadata": dump_metadata(request_metadata(request, 'Object'))}
+    if request.META.get('CONTENT_TYPE'):
+        changes["content_type"] = request.META['CONTENT_TYPE']
+    updated = SlowishFile.objects.live().filter(
+        container=container, path=path).update(**changes)
+    if not updated:
+        return HttpResponse('', status=404)
+
+    return HttpResponse('', status=202)  # Accepted
+
+
+def container_delete(request, container, path):
+    if path == '':
+        return container_remove(request, container)
+
+    if request.GET.get('multipart-manifest') == 'delete':
+        try:
+            file = SlowishFile.objects.live().get(
+                container=container,
+                path=path,
+                static_manifest__isnull=False)
+        except SlowishFile.DoesNotExist:
+            pass
+        else:
+            return large_objects.static_manifest_delete(
+                request, container, file)
+
+    if container.delete_files([path]) == 0:
         return HttpResponse('', status=404)
 
-    file.delete()
     return HttpResponse('', status=204)  # No content
 
 
-# We haven't yet implemented support for storing fie contents, but a
-# GET of a file path is still useful for distinguishing whether it
-# exists in the container or not.
-def container_get_file(request, container, path):
+def container_remove(request, container):
+    # As in Swift, only empty containers can be deleted, unless the
+    # (slowish only) recursive parameter asks for its files to go too.
+    recursive = request.GET.get('recursive', '').lower() in (
+        'true', 'yes', 'on', '1')
+
     try:
-        SlowishFile.objects.get(container=container, path=path)
-        return HttpResponse('', status=200)  # OK
-    except:
+        if recursive:
+            container.mark_deleted()
+            background.request_purge()
+        elif not container.delete_if_empty():
+            return HttpResponse('', status=409)  # Conflict
+    except SlowishContainer.DoesNotExist:
         return HttpResponse('', status=404)
 
+    return HttpResponse('', status=204)  # No content
 
-def container_get_contents(request, container):
 
-    files = SlowishFile.objects.filter(container=container).order_by("path")
+def file_content_response(request, file):
+    """Return a response serving the file's own stored content."""
+    if file.blob is None or request.method == 'HEAD':
+        content = io.BytesIO()
+    else:
+        content = blobs.open_blob(file.blob.etag)
 
-    if request.GET:
-        if "prefix" in request.GET:
-            files = files.filter(path__startswith=request.GET["prefix"])
+    return downloads.file_response(
+        request,
+        content,
+        size=file.bytes,
+        etag=file.etag,
+        last_modified=file.last_modified,
+        content_type=file.content_type or downloads.DEFAULT_CONTENT_TYPE)
 
-        if "marker" in request.GET:
-            files = files.filter(path__gt=request.GET["marker"])
 
-        if "end_marker" in request.GET:
-            files = files.filter(path__lt=request.GET["end_marker"])
+def container_get_file(request, account, container_name, path):
+    """
+    Serve a file, (or just its headers, for HEAD).
 
-    # See comment by call to JsonResponse above for justification of safe=False
-    return JsonResponse(
-        [{"bytes": 0,
-          "name": file.path,
-          "content_type": "application/directory"} for file in files],
-        safe=False)
+    The file is found along with its container and blob by a single
+    query, on the unique indexes of both containers and files.
+    """
+    try:
+        file = SlowishFile.objects.live().select_related('blob').get(
+            container__account=account,
+            container__deleted=False,
+            container__name=container_name,
+            path=path)
+    except SlowishFile.DoesNotExist:
+        return HttpResponse('', status=404)
 
+    if request.GET.get('multipart-manifest') == 'get':
+        if file.static_manifest is not None:
+            return large_objects.static_manifest_get(request, file)
+        response = file_content_response(request, file)
+    elif file.static_manifest is not None:
+        # The segments are only checked when their content is wanted
+        segments = large_objects.static_segments(file)
+        if request.method != 'HEAD' and not large_objects.segments_stored(
+                segments):
+            return HttpResponse('', status=409)  # Conflict
+        response = large_objects.large_object_response(
+            request, file, segments)
+    elif file.dynamic_manifest is not None:
+        response = large_objects.large_object_response(
+            request, file,
+            large_objects.dynamic_segments(account, file))
+    else:
+        response = file_content_response(request, file)
+
+    if file.delete_at is not None:
+        response['X-Delete-At'] = calendar.timegm(
+            file.delete_at.utctimetuple())
+    metadata_headers(response, 'Object', file.metadata)
+    return release_connection(response)
+
+
+def release_connection(response):
+    """
+    Close the database connection before a large body is sent.
+
+    The body of a file is read from the blob store alone, so there is
+    no need for a client that downloads it slowly to hold a database
+    connection all the while, (which would otherwise only be closed
+    once the whole body was sent). Many slow downloads at once can
+    then be served without using up the database's connections.
+    Small bodies are sent in a single write, and keep the connection.
+    """
+    if (response.streaming and
+            int(response.get('Content-Length', 0)) > blobs.BLOB_CHUNK_SIZE and
+            not connection.in_atomic_block):
+        connection.close()
+    return response
+
+
+def file_entry(path, size):
+    return {"bytes": size,
+            "name": path,
+            "content_type": "application/directory"}
+
+
+def file_entries(files, expiring):
+    """
+    Generate the entries of a listing of files.
+
+    The files are (path, size, delete_at) tuples, and the delete_at of
+    each file that expires is added to expiring, (for the listing
+    cache).
+    """
+    for (path, size, delete_at) in files:
+        if delete_at is not None:
+            expiring.append(delete_at)
+        yield file_entry(path, size)
+
+
+def delimited_entries(engine, container, request, limit, expiring):
+    """
+    Generate the entries of a listing of files with a delimiter.
+
+    Files whose names contain the delimiter after the prefix are rolled
+    up into a single "subdir" entry for the part of the name up to the
+    delimiter. Rather than reading every file in such a subdirectory,
+    the next page starts just past the end of it, so each entry of
+    the listing costs one index probe, however many files there are.
+    The delete_at of each file read that expires is added to expiring.
+    """
+    prefix = request.GET.get("prefix", "")
+    delimiter = request.GET["delimiter"]
+    marker = request.GET.get("marker", "")
+    end_marker = request.GET.get("end_marker")
+    inclusive = False
+    count = 0
+
+    while count < limit:
+        # The ORM engine reads the page through iterator(), so rows
+        # after a subdir, (which are skipped), are mostly never fetched.
+        empty = True
+        for (path, size, delete_at) in engine.files(
+                container, prefix, marker, end_marker, limit - count,
+                inclusive):
+            empty = False
+            marker = path
+            inclusive = False
+            if delete_at is not None:
+                expiring.append(delete_at)
+            end = path.find(delimiter, len(prefix))
+            if end >= 0:
+                subdir = path[:end + 1]
+
+                # Skip all paths that start with subdir, (as the
+                # delimiter sorts just before the following character),
+                # but not a path that is that following character.
+                marker = path[:end] + six.unichr(ord(delimiter) + 1)
+                inclusive = True
+
+                # A client paging through a listing will pass the last
+                # subdir it saw as the marker, so that isn't repeated.
+                if subdir != request.GET.get("marker"):
+                    count += 1
+                    yield {"subdir": subdir}
+                break
+
+            count += 1
+            yield file_entry(path, size)
+
+        if empty:
+            return
+
+
+def container_get_changes(request, container, limit):
+    """
+    List the changes to files in container since a change number.
+
+    Each entry is the latest change to a path, (a deleted file being
+    listed as such), in order of number, so a client can page through
+    them by passing the last number it saw as changes_since.
+    """
+    since = request.GET["changes_since"]
+    if not since.isdigit():
+        return HttpResponse('Invalid changes_since', status=400)
+
+    # This is a range scan of the unique (container, change) index
+    changes = SlowishChange.objects.filter(
+        container=container, change__gt=int(since)).order_by('change')
+    changes = changes.values_list('change', 'path', 'deleted')[:limit]
+    entries = ({"change": change, "name": path, "deleted": deleted}
+               for (change, path, deleted) in changes.iterator())
+
+    return container_usage(listing_response(entries), container)
 
-@csrf_exempt
-def container(request, account_id, container_name, path=''):
-    try:
-        SlowishUser.objects.get(
-            account__id=account_id,
-            token=request.META['HTTP_X_AUTH_TOKEN'])
-    except:
-        return unauthorized()
 
-    account = get_object_or_404(SlowishAccount, id=account_id)
+def container_get_contents(request, container):
+
+    limit = listing_limit(request)
+    if limit is None:
+        return limit_too_large()
+
+    cache = listing_cache.listing_cache()
+    if cache is None:
+        return container_listing(request, container, limit, [])
+
+    key = listing_cache.listing_key(cache, container, request)
+    content = cache.get(key)
+    if content is not None:
+        return container_usage(
+            HttpResponse(content, content_type="application/json"),
+            container)
+
+    expiring = []
+    response = container_listing(request, container, limit, expiring)
+    if response.streaming:
+        response.streaming_content = listing_cache.caching_content(
+            response.streaming_content, cache, key, expiring)
+    return response
+
+
+def container_listing(request, container, limit, expiring):
+    """
+    Return a response listing the files in container, (or the changes
+    to them), adding the delete_at of any listed file to expiring.
+    """
+    if "changes_since" in request.GET:
+        return container_get_changes(request, container, limit)
+
+    # As in Swift, only single-character delimiters are supported
+    delimiter = request.GET.get("delimiter")
+    if delimiter is not None and (
+            len(delimiter) != 1 or ord(delimiter) > 254):
+        return HttpResponse('Bad delimiter', status=412)
+
+    # Expired files are left out of listings until they are deleted
+    engine = engines.listing_engine()
+    if delimiter is not None:
+        entries = delimited_entries(
+            engine, container, request, limit, expiring)
+    else:
+        files = engine.files(
+            container,
+            request.GET.get("prefix"),
+            request.GET.get("marker"),
+            request.GET.get("end_marker"),
+            limit)
+        entries = file_entries(files, expiring)
 
+    return container_usage(listing_response(entries), container)
+
+
+@csrf_exempt
+@token_required
+def container(request, account, container_name, path=''):
     if (request.method == 'PUT'):
+        if 'extract-archive' in request.GET:
+            return bulk.extract_archive(
+                request, account, container_name, path)
+        if 'HTTP_X_COPY_FROM' in request.META and path != '':
+            return object_copy(
+                request, account,
+                copy_location(request.META['HTTP_X_COPY_FROM']),
+                (container_name, path))
         return container_put(request, account, container_name, path)
 
+    if request.method == 'COPY' and path != '':
+        return object_copy(
+            request, account,
+            (container_name, path),
+            copy_location(request.META.get('HTTP_DESTINATION', '')))
+
+    if path != '' and request.method not in ('DELETE', 'POST'):
+        return container_get_file(request, account, container_name, path)
+
     container = get_object_or_404(
-        SlowishContainer,
+        SlowishContainer.objects.live(),
         account=account,
         name=container_name)
 
     if (request.method == 'DELETE'):
         return container_delete(request, container, path)
 
-    if path == '':
-        return container_get_contents(request, container)
-    else:
-        return container_get_file(request, container, path)
+    if (request.method == 'POST'):
+        return container_post(request, container, path)
+
+    if (request.method == 'HEAD'):
+        # (The counts of a container include its files until they are
+        # deleted, however long ago they were hidden)
+        if container.expire_files():
+            container.refresh_from_db()
+        return container_usage(HttpResponse('', status=204), container)
+    return container_get_contents(request, container)